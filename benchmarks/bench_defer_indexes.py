@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the defer_indexes and sort_by_primary_key options of 
+import_table_group_to_sqlite.
+
+The synthetic table has an integer primary key in random order and an 
+indexed code column. Run from the repository root:
+    
+    python benchmarks/bench_defer_indexes.py [n_rows]
+    
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import csvw_functions_extra
+from common import write_synthetic_table_group, time_function
+
+
+def main(n_rows=1000000):
+    ""
+    data_folder = tempfile.mkdtemp()
+    
+    try:
+        
+        metadata_filepath = write_synthetic_table_group(data_folder, n_rows)
+        database_filepath = os.path.join(data_folder, 'data.sqlite')
+        
+        def remove_database():
+            if os.path.exists(database_filepath):
+                os.remove(database_filepath)
+        
+        print(f'import_table_group_to_sqlite, {n_rows} rows')
+        
+        for label, kwargs in [
+                ('indexes during load', dict()),
+                ('defer_indexes', dict(defer_indexes=True)),
+                ('defer_indexes + sort_by_primary_key', dict(defer_indexes=True, sort_by_primary_key=True))
+                ]:
+            
+            elapsed = \
+                time_function(
+                    csvw_functions_extra.import_table_group_to_sqlite,
+                    metadata_filepath = metadata_filepath,
+                    database_filepath = database_filepath,
+                    setup = remove_database,
+                    **kwargs
+                    )
+            print(f'{label:>36}: {elapsed:.2f} s ({n_rows / elapsed:,.0f} rows/s)')
+            
+    finally:
+        
+        shutil.rmtree(data_folder)
+        
+
+if __name__ == '__main__':
+    
+    main(*[int(x) for x in sys.argv[1:]])
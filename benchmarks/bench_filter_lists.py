@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of get_rows with long filter_by value lists.
+
+Compares, across list sizes, the time to select rows of a synthetic lookup
+table (by its text primary key) using:
+
+- a literal IN (...) list in the SQL text (get_where_string);
+- an IN (?,?,...) list of bound parameters (get_where_clause);
+- a temporary table of the values, i.e. IN (SELECT value FROM temp...),
+  which get_rows uses for lists longer than _FILTER_TEMP_TABLE_THRESHOLD.
+
+Run from the repository root:
+
+    python benchmarks/bench_filter_lists.py [n_rows]
+
+"""
+
+import os
+import sys
+import random
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import csvw_functions_extra
+import csvw_functions_extra.csvw_functions_extra as cfe
+from common import write_synthetic_lookup_table_group, time_function
+
+
+def get_rows_literal(db, codes):
+    ""
+    where_string = csvw_functions_extra.get_where_string({'code': codes})
+    return db.run_sql(f'SELECT * FROM lookup {where_string}')
+
+
+def get_rows_threshold(db, codes, threshold):
+    ""
+    default_threshold = cfe._FILTER_TEMP_TABLE_THRESHOLD
+    cfe._FILTER_TEMP_TABLE_THRESHOLD = threshold
+    try:
+        return db.get_rows('lookup', filter_by={'code': codes})
+    finally:
+        cfe._FILTER_TEMP_TABLE_THRESHOLD = default_threshold
+
+
+def main(n_rows=1000000):
+    ""
+    data_folder = tempfile.mkdtemp()
+
+    try:
+
+        metadata_filepath = write_synthetic_lookup_table_group(data_folder, n_rows)
+        database_filepath = os.path.join(data_folder, 'data.sqlite')
+        csvw_functions_extra.import_table_group_to_sqlite(
+            metadata_filepath = metadata_filepath,
+            database_filepath = database_filepath
+            )
+
+        rng = random.Random(1)
+
+        print(f'lookup table, {n_rows} rows, time (ms) to get the rows of a list of codes')
+        print(f'{"list size":>10} {"literal IN":>12} {"bound IN":>12} {"temp table":>12}')
+
+        with csvw_functions_extra.CsvwDatabase(database_filepath) as db:
+
+            for n in [10, 100, 1000, 10000, 30000, 100000, 500000]:
+
+                if n > n_rows:
+                    break
+
+                codes = [f'E{x:08d}' for x in rng.sample(range(n_rows), n)]
+
+                times = [
+                    time_function(get_rows_literal, db, codes),
+                    time_function(get_rows_threshold, db, codes, n)  # bound IN
+                        if n <= 32766 else None,  # SQLITE_MAX_VARIABLE_NUMBER
+                    time_function(get_rows_threshold, db, codes, 0)
+                    ]
+
+                print(
+                    f'{n:>10} '
+                    + ' '.join(
+                        f'{"-":>12}' if x is None else f'{x * 1000:>12.2f}'
+                        for x in times
+                        )
+                    )
+
+    finally:
+
+        shutil.rmtree(data_folder)
+
+
+if __name__ == '__main__':
+
+    main(*[int(x) for x in sys.argv[1:]])
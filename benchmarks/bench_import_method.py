@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the import_method options of import_table_group_to_sqlite.
+
+Compares the native importer (csv module + executemany in one transaction)
+with the sqlite3 command line tool. Run from the repository root:
+    
+    python benchmarks/bench_import_method.py [n_rows]
+    
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import csvw_functions_extra
+from common import write_synthetic_table_group, time_function
+
+
+def main(n_rows=1000000):
+    ""
+    data_folder = tempfile.mkdtemp()
+    
+    try:
+        
+        metadata_filepath = write_synthetic_table_group(data_folder, n_rows)
+        database_filepath = os.path.join(data_folder, 'data.sqlite')
+        
+        def remove_database():
+            if os.path.exists(database_filepath):
+                os.remove(database_filepath)
+        
+        print(f'import_table_group_to_sqlite, {n_rows} rows')
+        
+        for import_method in ['native', 'cli']:
+            
+            if import_method == 'cli' and shutil.which('sqlite3') is None:
+                print(f'{import_method:>8}: sqlite3 command line tool not found')
+                continue
+            
+            elapsed = \
+                time_function(
+                    csvw_functions_extra.import_table_group_to_sqlite,
+                    metadata_filepath = metadata_filepath,
+                    database_filepath = database_filepath,
+                    import_method = import_method,
+                    setup = remove_database
+                    )
+            print(f'{import_method:>8}: {elapsed:.2f} s ({n_rows / elapsed:,.0f} rows/s)')
+            
+    finally:
+        
+        shutil.rmtree(data_folder)
+        
+
+if __name__ == '__main__':
+    
+    main(*[int(x) for x in sys.argv[1:]])
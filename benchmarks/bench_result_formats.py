@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the result_format argument of get_rows.
+
+Compares the time and peak Python memory used to get all rows of a
+synthetic table as a list of dictionaries ('rows'), as a dictionary of
+array.array / list columns ('columns') and as a dictionary of NumPy arrays
+('numpy', if NumPy is installed). Run from the repository root:
+
+    python benchmarks/bench_result_formats.py [n_rows]
+
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import csvw_functions_extra
+from common import write_synthetic_table_group, time_function
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def get_peak_memory(func, *args, **kwargs):
+    """Returns the peak memory in bytes allocated by Python during a call
+    to func.
+
+    """
+    tracemalloc.start()
+    try:
+        func(*args, **kwargs)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main(n_rows=1000000):
+    ""
+    data_folder = tempfile.mkdtemp()
+
+    try:
+
+        metadata_filepath = write_synthetic_table_group(data_folder, n_rows)
+        database_filepath = os.path.join(data_folder, 'data.sqlite')
+        csvw_functions_extra.import_table_group_to_sqlite(
+            metadata_filepath = metadata_filepath,
+            database_filepath = database_filepath
+            )
+
+        print(f'synthetic table, {n_rows} rows, get_rows of all rows')
+        print(f'{"result_format":>14} {"time (s)":>10} {"peak (MB)":>10}')
+
+        with csvw_functions_extra.CsvwDatabase(database_filepath) as db:
+
+            for result_format in ['rows', 'columns', 'numpy']:
+
+                if result_format == 'numpy' and numpy is None:
+                    continue
+
+                kwargs = dict(fields=['id', 'value'], result_format=result_format)
+
+                elapsed = time_function(db.get_rows, 'synthetic', **kwargs)
+                peak = get_peak_memory(db.get_rows, 'synthetic', **kwargs) / 1e6
+
+                print(f'{result_format:>14} {elapsed:>10.2f} {peak:>10.1f}')
+
+    finally:
+
+        shutil.rmtree(data_folder)
+
+
+if __name__ == '__main__':
+
+    main(*[int(x) for x in sys.argv[1:]])
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the sql_strict and sql_without_rowid table layouts of 
+import_table_group_to_sqlite.
+
+Compares the database size, import time and point lookup latency (by 
+primary key) of a synthetic lookup table with a text primary key. Run from 
+the repository root:
+    
+    python benchmarks/bench_table_layout.py [n_rows] [n_lookups]
+    
+"""
+
+import os
+import sys
+import random
+import shutil
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import csvw_functions_extra
+from common import write_synthetic_lookup_table_group
+
+
+def main(n_rows=1000000, n_lookups=100000):
+    ""
+    data_folder = tempfile.mkdtemp()
+    
+    try:
+        
+        metadata_filepath = write_synthetic_lookup_table_group(data_folder, n_rows)
+        
+        rng = random.Random(1)
+        codes = [f'E{rng.randrange(n_rows):08d}' for _ in range(n_lookups)]
+        
+        print(f'lookup table, {n_rows} rows, {n_lookups} point lookups')
+        print(f'{"layout":>28} {"import (s)":>12} {"size (MB)":>12} {"lookup (us)":>12}')
+        
+        for label, kwargs in [
+                ('rowid', dict()),
+                ('strict', dict(sql_strict=True)),
+                ('without_rowid', dict(sql_without_rowid=True)),
+                ('strict + without_rowid', dict(sql_strict=True, sql_without_rowid=True))
+                ]:
+            
+            database_filepath = os.path.join(data_folder, f'{label}.sqlite')
+            
+            start_time = time.perf_counter()
+            csvw_functions_extra.import_table_group_to_sqlite(
+                metadata_filepath = metadata_filepath,
+                database_filepath = database_filepath,
+                **kwargs
+                )
+            import_time = time.perf_counter() - start_time
+            
+            size = os.path.getsize(database_filepath) / 1e6
+            
+            with csvw_functions_extra.CsvwDatabase(database_filepath) as db:
+                query = 'SELECT * FROM lookup WHERE code = ?'
+                db.execute(query, (codes[0],)).fetchall()  # warm up
+                start_time = time.perf_counter()
+                for code in codes:
+                    db.execute(query, (code,)).fetchall()
+                lookup_time = (time.perf_counter() - start_time) / n_lookups * 1e6
+            
+            print(f'{label:>28} {import_time:>12.2f} {size:>12.1f} {lookup_time:>12.2f}')
+            
+    finally:
+        
+        shutil.rmtree(data_folder)
+        
+
+if __name__ == '__main__':
+    
+    main(*[int(x) for x in sys.argv[1:]])
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+Helper functions for the csvw_functions_extra benchmarks.
+
+"""
+
+import os
+import json
+import random
+import time
+
+
+def write_synthetic_table_group(
+        data_folder,
+        n_rows,
+        table_name='synthetic',
+        seed=0
+        ):
+    """Writes a synthetic CSV file and a normalized CSVW metadata file
+    in the data_folder, as if created by download_table_group.
+    
+    The table has an integer primary key (in random order), an indexed
+    string code column, a decimal column and a free text column.
+    
+    :returns: The filepath of the CSVW metadata file.
+    
+    """
+    os.makedirs(data_folder, exist_ok=True)
+    
+    rng = random.Random(seed)
+    ids = list(range(n_rows))
+    rng.shuffle(ids)
+    
+    csv_file_name = f'{table_name}.csv'
+    with open(os.path.join(data_folder, csv_file_name), 'w', newline='') as f:
+        f.write('id,code,value,text\n')
+        for i in ids:
+            f.write(f'{i},E{rng.randrange(10000):08d},{rng.random() * 1000:.3f},row {i}\n')
+            
+    metadata_table_group_dict = {
+        '@context': 'http://www.w3.org/ns/csvw',
+        '@type': 'TableGroup',
+        'tables': [
+            {
+                '@type': 'Table',
+                'url': csv_file_name,
+                'https://purl.org/berg/csvw_functions_extra/vocab/csv_file_name': {'@value': csv_file_name},
+                'https://purl.org/berg/csvw_functions_extra/vocab/sql_table_name': {'@value': table_name},
+                'tableSchema': {
+                    'primaryKey': ['id'],
+                    'columns': [
+                        {'name': 'id', 'datatype': {'base': 'integer'}},
+                        {'name': 'code', 'datatype': {'base': 'string'},
+                         'https://purl.org/berg/csvw_functions_extra/vocab/sqlsetindex': True},
+                        {'name': 'value', 'datatype': {'base': 'decimal'}},
+                        {'name': 'text', 'datatype': {'base': 'string'}}
+                        ]
+                    }
+                }
+            ]
+        }
+    
+    metadata_filepath = os.path.join(data_folder, f'{table_name}-metadata.json')
+    with open(metadata_filepath, 'w') as f:
+        json.dump(metadata_table_group_dict, f, indent=4)
+        
+    return metadata_filepath
+
+
+def write_synthetic_lookup_table_group(
+        data_folder,
+        n_rows,
+        table_name='lookup',
+        seed=0
+        ):
+    """Writes a synthetic lookup table, as used for geography or 
+    classification codes, and a normalized CSVW metadata file in the 
+    data_folder.
+    
+    The table has a text primary key (i.e. 'E00012345', in random order), 
+    a name column and a decimal column.
+    
+    :returns: The filepath of the CSVW metadata file.
+    
+    """
+    os.makedirs(data_folder, exist_ok=True)
+    
+    rng = random.Random(seed)
+    ids = list(range(n_rows))
+    rng.shuffle(ids)
+    
+    csv_file_name = f'{table_name}.csv'
+    with open(os.path.join(data_folder, csv_file_name), 'w', newline='') as f:
+        f.write('code,name,value\n')
+        for i in ids:
+            f.write(f'E{i:08d},Area {i},{rng.random() * 1000:.3f}\n')
+            
+    metadata_table_group_dict = {
+        '@context': 'http://www.w3.org/ns/csvw',
+        '@type': 'TableGroup',
+        'tables': [
+            {
+                '@type': 'Table',
+                'url': csv_file_name,
+                'https://purl.org/berg/csvw_functions_extra/vocab/csv_file_name': {'@value': csv_file_name},
+                'https://purl.org/berg/csvw_functions_extra/vocab/sql_table_name': {'@value': table_name},
+                'tableSchema': {
+                    'primaryKey': ['code'],
+                    'columns': [
+                        {'name': 'code', 'datatype': {'base': 'string'}},
+                        {'name': 'name', 'datatype': {'base': 'string'}},
+                        {'name': 'value', 'datatype': {'base': 'decimal'}}
+                        ]
+                    }
+                }
+            ]
+        }
+    
+    metadata_filepath = os.path.join(data_folder, f'{table_name}-metadata.json')
+    with open(metadata_filepath, 'w') as f:
+        json.dump(metadata_table_group_dict, f, indent=4)
+        
+    return metadata_filepath
+
+
+def time_function(
+        func,
+        *args,
+        repeat=3,
+        setup=None,
+        **kwargs
+        ):
+    """Returns the best elapsed time in seconds of repeat calls to func.
+    
+    setup is an optional function called before each call to func, which 
+    is not timed.
+    
+    """
+    result = None
+    for _ in range(repeat):
+        if not setup is None:
+            setup()
+        start_time = time.perf_counter()
+        func(*args, **kwargs)
+        elapsed = time.perf_counter() - start_time
+        if result is None or elapsed < result:
+            result = elapsed
+    return result
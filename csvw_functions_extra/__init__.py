@@ -6,6 +6,7 @@ from .csvw_functions_extra import get_available_csv_file_names
 
 # download csv files
 from .csvw_functions_extra import download_table_group
+from .csvw_functions_extra import download_table_group_async
 
 # downloaded csvw metadata file
 from .csvw_functions_extra import get_metadata_table_group_dict
@@ -18,18 +19,27 @@ from .csvw_functions_extra import get_metadata_columns_codes
 from .csvw_functions_extra import import_table_group_to_sqlite
 
 # database functions
+from .csvw_functions_extra import CsvwDatabase
 from .csvw_functions_extra import add_index
 from .csvw_functions_extra import get_all_table_names_in_database
 from .csvw_functions_extra import get_sql_table_names_in_database
 from .csvw_functions_extra import get_field_names
 from .csvw_functions_extra import get_row_count
 from .csvw_functions_extra import get_rows
+from .csvw_functions_extra import iter_rows
 from .csvw_functions_extra import run_sql
+from .csvw_functions_extra import iter_sql
+
+# columnar tables
+from .csvw_functions_extra import DictionaryEncodedArray
+from .csvw_functions_extra import export_columnar_table
+from .csvw_functions_extra import load_columnar_table
 
 # utility functions
 from .csvw_functions_extra import convert_to_iterator
 from .csvw_functions_extra import get_field_string
 from .csvw_functions_extra import get_group_by_string
 from .csvw_functions_extra import get_where_string
+from .csvw_functions_extra import get_where_clause
 
 
@@ -10,38 +10,189 @@ Created on Sat Aug 12 14:47:35 2023
 
 import csvw_functions
 import os
+import sys
 import json
 import urllib.request
 import urllib.parse
+import urllib.error
+import http.client
+import re
+import time
+import hashlib
 import sqlite3
 import subprocess
 import zipfile
+import shutil
+import tempfile
+import gzip
+import io
+import csv
+import datetime
+import contextlib
+import asyncio
+import functools
+import collections
+import collections.abc
+import array
+import itertools
+import threading
+import concurrent.futures
 # import pandas as pd
 
 
 #%% remote csvw metadata functions
 
 def get_normalized_metadata_table_group_dict(
-        metadata_document_location
+        metadata_document_location,
+        cache_folder=None
         ):
+    """Returns a normalized version of a CSVW metadata file.
+    
+    If cache_folder is supplied then the normalized metadata is saved in 
+    the 'metadata' subfolder of cache_folder and reused in later calls, 
+    which avoids validating the metadata file again. For local files 
+    the cache is keyed by the file path and a hash of the file contents. 
+    For remote files a conditional request is made using the ETag and
+    Last-Modified values of the previous response.
+    
     """
-    """
+    if cache_folder is None:
+        
+        metadata_table_group_dict = \
+            csvw_functions.validate_table_group_metadata(
+                metadata_document_location
+                )
+            
+    elif urllib.parse.urlsplit(metadata_document_location).scheme in ['http', 'https']:
+        
+        metadata_table_group_dict = \
+            _get_cached_remote_normalized_metadata_table_group_dict(
+                metadata_document_location,
+                cache_folder
+                )
+            
+    else:
+        
+        metadata_table_group_dict = \
+            _get_cached_local_normalized_metadata_table_group_dict(
+                metadata_document_location,
+                cache_folder
+                )
+        
+    return metadata_table_group_dict
+
+
+def _get_cached_local_normalized_metadata_table_group_dict(
+        metadata_document_location,
+        cache_folder
+        ):
+    ""
+    hasher = hashlib.sha256()
+    hasher.update(os.path.abspath(metadata_document_location).encode())
+    with open(metadata_document_location, 'rb') as f:
+        hasher.update(f.read())
+    fp_cache = os.path.join(cache_folder, 'metadata', f'{hasher.hexdigest()}.json')
+    
+    if os.path.exists(fp_cache):
+        with open(fp_cache) as f:
+            return json.load(f)['normalized']
+        
     metadata_table_group_dict = \
         csvw_functions.validate_table_group_metadata(
             metadata_document_location
             )
         
+    _write_metadata_cache_file(
+        fp_cache,
+        dict(
+            location=metadata_document_location,
+            normalized=metadata_table_group_dict
+            )
+        )
+    
+    return metadata_table_group_dict
+
+
+def _get_cached_remote_normalized_metadata_table_group_dict(
+        metadata_document_location,
+        cache_folder
+        ):
+    ""
+    key = hashlib.sha256(metadata_document_location.encode()).hexdigest()
+    fp_cache = os.path.join(cache_folder, 'metadata', f'{key}.json')
+    
+    if os.path.exists(fp_cache):
+        with open(fp_cache) as f:
+            cache_dict = json.load(f)
+    else:
+        cache_dict = None
+        
+    request = urllib.request.Request(metadata_document_location)
+    if not cache_dict is None:
+        if cache_dict.get('etag'):
+            request.add_header('If-None-Match', cache_dict['etag'])
+        if cache_dict.get('last_modified'):
+            request.add_header('If-Modified-Since', cache_dict['last_modified'])
+    
+    try:
+        with urllib.request.urlopen(request) as response:
+            content = response.read()
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+    except urllib.error.HTTPError as err:
+        if err.code == 304 and not cache_dict is None:
+            return cache_dict['normalized']
+        raise
+        
+    sha256 = hashlib.sha256(content).hexdigest()
+    
+    if not cache_dict is None and cache_dict['sha256'] == sha256:
+        
+        metadata_table_group_dict = cache_dict['normalized']
+        
+    else:
+        
+        metadata_table_group_dict = \
+            csvw_functions.validate_table_group_metadata(
+                metadata_document_location
+                )
+    
+    _write_metadata_cache_file(
+        fp_cache,
+        dict(
+            location=metadata_document_location,
+            etag=etag,
+            last_modified=last_modified,
+            sha256=sha256,
+            normalized=metadata_table_group_dict
+            )
+        )
+    
     return metadata_table_group_dict
+
+
+def _write_metadata_cache_file(
+        fp_cache,
+        cache_dict
+        ):
+    ""
+    os.makedirs(os.path.dirname(fp_cache), exist_ok=True)
+    fp_part = f'{fp_cache}.{os.getpid()}.{threading.get_ident()}.part'
+    with open(fp_part, 'w') as f:
+        json.dump(cache_dict, f)
+    os.replace(fp_part, fp_cache)
     
 
 def get_available_csv_file_names(
-        metadata_document_location
+        metadata_document_location,
+        cache_folder=None
         ):
     """
     """
     metadata_table_group_dict = \
         get_normalized_metadata_table_group_dict(
-                metadata_document_location
+                metadata_document_location,
+                cache_folder=cache_folder
                 )
     
     result = []
@@ -65,6 +216,13 @@ def download_table_group(
         data_folder,
         csv_file_names=None,  # if none then all are downloaded
         overwrite_existing_files=False,
+        refresh_changed_files=False,
+        extract_zip_files=True,
+        max_workers=None,
+        max_workers_per_host=None,
+        cache_folder=None,
+        cache_max_size=None,
+        callback=None,
         verbose=False
         ):
     """Reads a CSVW metadata file and downloads the CSV files from remote locations.
@@ -72,6 +230,9 @@ def download_table_group(
     This makes use of the https://purl.org/berg/csvw_functions_extra vocabulary.
     
     This also saves a normalised version of the CSWV metadata file in the data_folder.
+    
+    A download manifest is kept in the data_folder which records the url,
+    ETag, Last-Modified, size and content hash of each downloaded file.
         
     :param metadata_document_location: The filepath of the csvw metadata 
         file containing a table group object.
@@ -91,6 +252,47 @@ def download_table_group(
         in data_folder.
     :type overwrite_existing_files: bool
     
+    :param refresh_changed_files: If True, then existing files in data_folder
+        are downloaded again only if they have changed on the remote server.
+        This is checked with a conditional request using the ETag and 
+        Last-Modified values in the download manifest.
+    :type refresh_changed_files: bool
+    
+    :param extract_zip_files: If True, then CSV files are extracted from 
+        any downloaded ZIP files. If False, then only the ZIP files are saved
+        and the CSV data is read directly from the ZIP files by 
+        import_table_group_to_sqlite.
+    :type extract_zip_files: bool
+    
+    :param max_workers: The maximum number of tables to download at the 
+        same time. If None then the tables are downloaded one at a time.
+    :type max_workers: int
+    
+    :param max_workers_per_host: The maximum number of files to download
+        at the same time from any one host. If None then there is no limit
+        other than max_workers.
+    :type max_workers_per_host: int
+    
+    :param cache_folder: The filepath of an optional download cache folder,
+        which may be shared between different data folders. Downloaded files
+        are stored in the cache by content hash and are linked or copied
+        into the data_folder if the url, ETag and Last-Modified values of 
+        the remote file match a cached download. The normalized CSVW metadata
+        is also cached, see get_normalized_metadata_table_group_dict.
+    :type cache_folder: str
+    
+    :param cache_max_size: The maximum size of the download cache in bytes.
+        If exceeded then the least recently used files are removed from the
+        cache. If None then there is no limit.
+    :type cache_max_size: int
+    
+    :param callback: An optional function which is called with a dictionary 
+        describing each download event, i.e. for monitoring download times 
+        and throughput. The 'event' key of the dictionary is one of 'file', 
+        'zip_extract', 'table' or 'table_group'. When max_workers is used, 
+        the callback is called from the worker threads.
+    :type callback: callable
+    
     :param verbose: If True, then this function prints intermediate variables
         and other useful information.
     :type verbose: bool
@@ -102,6 +304,8 @@ def download_table_group(
     """
     if verbose:
         print('--- FUNCTION: csvw_functions_extra.download_table_group ---')
+        
+    start_time = time.perf_counter()
     
     # convert single csv_file_name to list. None becomes an empty list.
     csv_file_name_list=convert_to_iterator(csv_file_names)
@@ -112,12 +316,323 @@ def download_table_group(
         
     # get normalised metadata_table_group_dict
     metadata_table_group_dict = \
-        csvw_functions.validate_table_group_metadata(
-            metadata_document_location
+        get_normalized_metadata_table_group_dict(
+            metadata_document_location,
+            cache_folder=cache_folder
             )
     #if verbose:
         #print(metadata_table_group_dict)
     
+    # get the download tasks of the tables to be downloaded
+    download_tasks, download_info_list = \
+        _get_download_tasks(
+            metadata_table_group_dict,
+            data_folder,
+            csv_file_name_list
+            )
+    
+    host_semaphores = \
+        _get_host_semaphores(
+            download_info_list,
+            max_workers_per_host
+            )
+        
+    download_manifest = \
+        _read_download_manifest(
+            data_folder
+            )
+        
+    # collects the bytes received for the 'table_group' event
+    file_bytes = []
+    def group_callback(event_dict):
+        if event_dict['event'] == 'file':
+            file_bytes.append(event_dict['bytes'])
+        callback(event_dict)
+    if callback is None:
+        group_callback = None
+    
+    download_kwargs = dict(
+        overwrite_existing_files=overwrite_existing_files,
+        refresh_changed_files=refresh_changed_files,
+        extract_zip_files=extract_zip_files,
+        download_manifest=download_manifest,
+        host_semaphores=host_semaphores,
+        cache_folder=cache_folder,
+        cache_max_size=cache_max_size,
+        callback=group_callback,
+        verbose=verbose
+        )
+        
+    # new download manifest entries are collected from each task 
+    # so that the manifest is only written by this thread
+    manifest_updates = {}
+    
+    try:
+    
+        if max_workers is None:
+            
+            for download_task in download_tasks:
+                
+                manifest_updates.update(
+                    _download_tables_and_metadata(
+                        download_task,
+                        **download_kwargs
+                        )
+                    )
+                
+        else:
+            
+            with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+                
+                futures = [
+                    executor.submit(
+                        _download_tables_and_metadata,
+                        download_task,
+                        **download_kwargs
+                        )
+                    for download_task in download_tasks
+                    ]
+                
+                try:
+                    for future in concurrent.futures.as_completed(futures):
+                        manifest_updates.update(future.result())
+                except BaseException:
+                    # don't start any downloads which are still waiting
+                    for future in futures:
+                        future.cancel()
+                    raise
+                
+    finally:
+        
+        # save updated download manifest, including any files 
+        # downloaded before an error occurred
+        download_manifest['files'].update(manifest_updates)
+        _write_download_manifest(
+            data_folder,
+            download_manifest
+            )
+        
+    # save updated metadata_table_group_dict
+    metadata_filepath = \
+        _save_downloaded_metadata_table_group_dict(
+            metadata_table_group_dict,
+            metadata_document_location,
+            data_folder
+            )
+        
+    _emit_download_event(
+        callback,
+        'table_group',
+        metadata_document_location=metadata_document_location,
+        table_count=len(download_info_list),
+        bytes=sum(file_bytes),
+        elapsed=time.perf_counter() - start_time
+        )
+        
+    return metadata_filepath
+
+
+async def download_table_group_async(
+        metadata_document_location,
+        data_folder,
+        csv_file_names=None,  # if none then all are downloaded
+        overwrite_existing_files=False,
+        refresh_changed_files=False,
+        extract_zip_files=True,
+        max_workers=8,
+        max_workers_per_host=None,
+        cache_folder=None,
+        cache_max_size=None,
+        callback=None,
+        verbose=False
+        ):
+    """Coroutine version of download_table_group.
+    
+    The tables are downloaded and extracted concurrently in worker threads,
+    so the event loop is not blocked. The arguments and return value are the
+    same as download_table_group. The callback is called from the worker
+    threads.
+    
+    If the coroutine is cancelled (or a download fails) then any downloads 
+    in progress stop after their current chunk, leaving '.part' files which
+    are resumed by the next call. Download manifest entries of the files
+    which have already been downloaded are saved.
+    
+    :param max_workers: The maximum number of tables to download at the 
+        same time.
+    :type max_workers: int
+    
+    """
+    if verbose:
+        print('--- FUNCTION: csvw_functions_extra.download_table_group_async ---')
+        
+    start_time = time.perf_counter()
+        
+    loop = asyncio.get_running_loop()
+    
+    # convert single csv_file_name to list. None becomes an empty list.
+    csv_file_name_list=convert_to_iterator(csv_file_names)
+    
+    # create data_folder if it doesn't exist
+    if not os.path.exists(data_folder):
+        os.makedirs(data_folder)
+        
+    # get normalised metadata_table_group_dict
+    metadata_table_group_dict = \
+        await loop.run_in_executor(
+            None,
+            get_normalized_metadata_table_group_dict,
+            metadata_document_location,
+            cache_folder
+            )
+        
+    # get the download tasks of the tables to be downloaded
+    download_tasks, download_info_list = \
+        _get_download_tasks(
+            metadata_table_group_dict,
+            data_folder,
+            csv_file_name_list
+            )
+    
+    host_semaphores = \
+        _get_host_semaphores(
+            download_info_list,
+            max_workers_per_host
+            )
+        
+    download_manifest = \
+        _read_download_manifest(
+            data_folder
+            )
+        
+    # collects the bytes received for the 'table_group' event
+    file_bytes = []
+    def group_callback(event_dict):
+        if event_dict['event'] == 'file':
+            file_bytes.append(event_dict['bytes'])
+        callback(event_dict)
+    if callback is None:
+        group_callback = None
+        
+    cancel_event = threading.Event()
+    
+    download_kwargs = dict(
+        overwrite_existing_files=overwrite_existing_files,
+        refresh_changed_files=refresh_changed_files,
+        extract_zip_files=extract_zip_files,
+        download_manifest=download_manifest,
+        host_semaphores=host_semaphores,
+        cache_folder=cache_folder,
+        cache_max_size=cache_max_size,
+        cancel_event=cancel_event,
+        callback=group_callback,
+        verbose=verbose
+        )
+    
+    manifest_updates = {}
+    
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers)
+    
+    async def run_download_task(download_task):
+        result = \
+            await loop.run_in_executor(
+                executor,
+                functools.partial(
+                    _download_tables_and_metadata,
+                    download_task,
+                    **download_kwargs
+                    )
+                )
+        manifest_updates.update(result)
+        
+    tasks = [
+        asyncio.ensure_future(run_download_task(download_task))
+        for download_task in download_tasks
+        ]
+        
+    try:
+        
+        await asyncio.gather(*tasks)
+        
+    except BaseException:
+        
+        # stops any downloads which are in progress or waiting
+        cancel_event.set()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+        
+    finally:
+        
+        executor.shutdown(wait=False)
+        download_manifest['files'].update(manifest_updates)
+        _write_download_manifest(
+            data_folder,
+            download_manifest
+            )
+        
+    # save updated metadata_table_group_dict
+    metadata_filepath = \
+        _save_downloaded_metadata_table_group_dict(
+            metadata_table_group_dict,
+            metadata_document_location,
+            data_folder
+            )
+        
+    _emit_download_event(
+        callback,
+        'table_group',
+        metadata_document_location=metadata_document_location,
+        table_count=len(download_info_list),
+        bytes=sum(file_bytes),
+        elapsed=time.perf_counter() - start_time
+        )
+        
+    return metadata_filepath
+
+
+def _emit_download_event(
+        callback,
+        event,
+        **kwargs
+        ):
+    """Calls callback with a dictionary describing a download event.
+    
+    Adds a 'throughput' value (bytes per second) if the event has 'bytes'
+    and 'elapsed' values.
+    
+    """
+    if callback is None:
+        return
+    
+    result = dict(event=event, **kwargs)
+    if 'bytes' in result and 'elapsed' in result:
+        result['throughput'] = \
+            result['bytes'] / result['elapsed'] if result['elapsed'] > 0 else None
+    
+    callback(result)
+
+
+def _get_download_tasks(
+        metadata_table_group_dict,
+        data_folder,
+        csv_file_name_list
+        ):
+    """Returns the download info of the tables to be downloaded, grouped 
+    into download tasks.
+    
+    Tables which share a local file (i.e. the same ZIP file) are in the same
+    download task, so they are downloaded one after the other.
+    
+    Also updates the 'url' value of each table in metadata_table_group_dict.
+    
+    :returns: A tuple of (download_tasks, download_info_list), where 
+        download_tasks is a list of lists of download info dictionaries.
+    
+    """
+    download_info_list = []
+    
     for i, metadata_table_dict in enumerate(metadata_table_group_dict['tables']):
         
         download_info=_get_download_info(
@@ -130,23 +645,30 @@ def download_table_group(
         if len(csv_file_name_list)==0 \
             or download_info['csv_file_name'] in csv_file_name_list:
                 
-            if verbose:
-                print('---')
-                for k,v in download_info.items(): print(k,v)
-        
-            _download_table_and_metadata(
-                overwrite_existing_files=overwrite_existing_files,
-                verbose=verbose,
-                **download_info
-                )
-            
-            if verbose:
-                print('---')
+            download_info_list.append(download_info)
     
         # update metadata_table_dict
         metadata_table_dict['url']=download_info['csv_file_name']
         
-    # save updated metadata_table_group_dict
+    download_tasks = {}
+    for download_info in download_info_list:
+        if download_info['csv_download_url'] is None:
+            key = download_info['fp_zip']
+        else:
+            key = download_info['fp_csv']
+        download_tasks.setdefault(key, []).append(download_info)
+        
+    return list(download_tasks.values()), download_info_list
+
+
+def _save_downloaded_metadata_table_group_dict(
+        metadata_table_group_dict,
+        metadata_document_location,
+        data_folder
+        ):
+    """Saves the updated metadata_table_group_dict in the data_folder.
+    
+    """
     metadata_filepath = os.path.join(data_folder,os.path.basename(metadata_document_location))
     
     if os.path.normpath(metadata_filepath) == os.path.normpath(metadata_document_location):
@@ -193,11 +715,12 @@ def _get_download_info(
     if zip_file_name is None:
         fp_zip = None
     else:
-        fp_zip = zip_file_name
+        fp_zip = os.path.join(data_folder,zip_file_name)
     if verbose:
         print('fp_zip:', fp_zip)
     
     result = dict(
+        data_folder=data_folder,
         csv_file_name=csv_file_name, 
         csv_download_url=csv_download_url, 
         zip_download_url=zip_download_url, 
@@ -212,550 +735,4393 @@ def _get_download_info(
     return result
 
 
-def _download_table_and_metadata(
-        csv_download_url=None,
-        fp_csv=None,
-        zip_download_url=None,
-        fp_zip=None,
-        csv_zip_extract_path=None,
-        metadata_url=None,
-        metadata_file_suffix=None,
-        overwrite_existing_files=False,
-        verbose=False,
-        **kwargs  # to pick up unused keywords in **download_info
+def _get_host_semaphores(
+        download_info_list,
+        max_workers_per_host=None
         ):
+    """Returns a dictionary of semaphores limiting the downloads per host.
+    
+    Keys are the host names of the download urls. Returns an empty
+    dictionary if max_workers_per_host is None.
+    
     """
+    result = {}
+    
+    if max_workers_per_host is None:
+        return result
+    
+    for download_info in download_info_list:
+        for url in [download_info['csv_download_url'],
+                    download_info['zip_download_url'],
+                    download_info['metadata_url']]:
+            if not url is None:
+                host = urllib.parse.urlsplit(url).netloc
+                if not host in result:
+                    result[host] = threading.BoundedSemaphore(max_workers_per_host)
+                    
+    return result
+
+
+def _download_file(
+        url,
+        filepath,
+        validators=None,
+        host_semaphores=None,
+        chunk_size=1024*1024,
+        max_retries=5,
+        cancel_event=None,
+        stats=None,
+        verbose=False
+        ):
+    """Downloads a remote file, waiting for a free slot for the url host if
+    host_semaphores is supplied.
+    
+    The file is streamed in chunks to a '.part' file which is only renamed 
+    to filepath once the full length has been received. If the download
+    fails then it is resumed using a HTTP Range request, and any '.part' 
+    file left by a previous call is also resumed. An If-Range header with 
+    the ETag or Last-Modified value of the response which started the 
+    '.part' file (saved in a '.part.validators' file) is sent, so that the 
+    download restarts from the beginning if the remote file has changed.
+    
+    If validators is supplied (a dictionary with 'etag' and 'last_modified'
+    keys) then a conditional request is made and None is returned if the
+    remote file has not been modified.
+    
+    If cancel_event (a threading.Event) is set then the download stops
+    after the current chunk and concurrent.futures.CancelledError is raised.
+    
+    If stats (a dictionary) is supplied then its 'bytes' value is increased
+    by the number of bytes received.
+    
+    Returns a download manifest entry for the file.
+    
     """
+    if verbose:
+        print('downloading:', url)
+        
+    semaphore = (host_semaphores or {}).get(urllib.parse.urlsplit(url).netloc)
     
-    if not csv_download_url is None:
+    fp_part = f'{filepath}.part'
+    
+    for attempt in range(max_retries + 1):
         
-        # download csv
-        if overwrite_existing_files or not os.path.exists(fp_csv):
-            
-            urllib.request.urlretrieve(
-                url=csv_download_url, 
-                filename=fp_csv
-                )
+        try:
             
-    else:  # zip file
-        
-        # download zip
-        if not zip_download_url is None:
-        
-            if overwrite_existing_files or not os.path.exists(fp_zip):
+            if semaphore is None:
+                result = _download_file_part(url, fp_part, chunk_size, validators, cancel_event, stats, verbose)
+            else:
+                with semaphore:
+                    result = _download_file_part(url, fp_part, chunk_size, validators, cancel_event, stats, verbose)
+            break
                 
+        except urllib.error.HTTPError as err:
+            
+            if err.code == 304:  # not modified
                 if verbose:
-                    print('downloading zip file...')
-                urllib.request.urlretrieve(
-                    url=zip_download_url, 
-                    filename=fp_zip
-                    )
-        
-        # extract csv
-        if overwrite_existing_files or not os.path.exists(fp_csv):
+                    print('not modified:', url)
+                return None
+            elif err.code == 416:  # the '.part' file can't be resumed
+                os.remove(fp_part)
+                _remove_part_validators(fp_part)
+            elif err.code < 500 or attempt == max_retries:
+                raise
+                
+        except (urllib.error.URLError, http.client.HTTPException, OSError):
             
-            if verbose:
-                print('extracting csv file...')
-            with zipfile.ZipFile(fp_zip) as z:
-    
-                with open(fp_csv, 'wb') as f:
-                    
-                    f.write(z.read(csv_zip_extract_path))
-              
+            if attempt == max_retries:
+                raise
+                
+        if verbose:
+            print('download failed, retrying:', url)
+        time.sleep(0.5 * 2 ** attempt)
             
-    # download metadata
-    if not metadata_url is None:
+    os.replace(fp_part, filepath)
+    _remove_part_validators(fp_part)
+    
+    return result
+    
+    
+def _get_part_validators_filepath(
+        fp_part
+        ):
+    """Returns the filepath of the file which stores the ETag and 
+    Last-Modified values of the response which started a '.part' file.
+    
+    """
+    return f'{fp_part}.validators'
+
+
+def _read_part_validators(
+        fp_part_validators
+        ):
+    """Returns the validators of a '.part' file, or None.
+    
+    """
+    try:
+        with open(fp_part_validators) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    
+    
+def _write_part_validators(
+        fp_part_validators,
+        headers
+        ):
+    ""
+    with open(fp_part_validators, 'w') as f:
+        json.dump(
+            dict(
+                etag=headers.get('ETag'),
+                last_modified=headers.get('Last-Modified')
+                ),
+            f
+            )
         
-        if not csv_download_url is None:
         
-            fp_metadata=f"{fp_csv}-{metadata_file_suffix}"
+def _remove_part_validators(
+        fp_part
+        ):
+    ""
+    fp_part_validators = _get_part_validators_filepath(fp_part)
+    if os.path.exists(fp_part_validators):
+        os.remove(fp_part_validators)
+
+
+def _get_if_range_value(
+        part_validators
+        ):
+    """Returns the If-Range header value used to resume a '.part' file: the
+    ETag if it is a strong ETag, otherwise the Last-Modified date, or None.
+    
+    """
+    if part_validators is None:
+        return None
+    etag = part_validators.get('etag')
+    if etag and not etag.startswith('W/'):  # If-Range needs a strong ETag
+        return etag
+    return part_validators.get('last_modified') or None
+
+
+def _check_part_validators(
+        part_validators,
+        headers
+        ):
+    """Returns False if a partial response has a different ETag or 
+    Last-Modified value to the response which started the '.part' file.
+    
+    """
+    for key, header in [('etag', 'ETag'), ('last_modified', 'Last-Modified')]:
+        if part_validators.get(key) and headers.get(header) \
+                and part_validators[key] != headers.get(header):
+            return False
+    return True
+    
+    
+def _download_file_part(
+        url,
+        fp_part,
+        chunk_size,
+        validators=None,
+        cancel_event=None,
+        stats=None,
+        verbose=False
+        ):
+    """Downloads a remote file to fp_part, resuming from the end of any 
+    existing fp_part file.
+    
+    Raises http.client.IncompleteRead if fewer bytes are received than 
+    the length given by the server.
+    
+    Returns a download manifest entry for the file.
+    
+    """
+    fp_part_validators = _get_part_validators_filepath(fp_part)
+    
+    start = os.path.getsize(fp_part) if os.path.exists(fp_part) else 0
+    
+    if start > 0:
+        # a '.part' file is only resumed if it can be checked that the 
+        # remote file has not changed since it was started
+        part_validators = _read_part_validators(fp_part_validators)
+        if_range = _get_if_range_value(part_validators)
+        if if_range is None:
+            if verbose:
+                print('no validators for the existing .part file, restarting download')
+            start = 0
+    
+    request = urllib.request.Request(url)
+    if start > 0:
+        request.add_header('Range', f'bytes={start}-')
+        request.add_header('If-Range', if_range)
+    elif not validators is None:
+        if validators.get('etag'):
+            request.add_header('If-None-Match', validators['etag'])
+        if validators.get('last_modified'):
+            request.add_header('If-Modified-Since', validators['last_modified'])
+            
+    hasher = hashlib.sha256()
+        
+    with urllib.request.urlopen(request) as response:
+        
+        content_range = response.headers.get('Content-Range')
+        
+        if start > 0 and response.status == 206 and not content_range is None:
+            
+            # resume download
+            match = re.match(r'bytes (\d+)-(\d+)/(\d+|\*)', content_range)
+            if match is None or int(match.group(1)) != start:
+                raise Exception(f'Unexpected Content-Range "{content_range}" for {url}')
+            total = None if match.group(3) == '*' else int(match.group(3))
+            if not _check_part_validators(part_validators, response.headers):
+                # i.e. a server which ignores If-Range
+                os.remove(fp_part)
+                os.remove(fp_part_validators)
+                raise http.client.HTTPException(
+                    f'Remote file changed since the .part file was started: {url}'
+                    )
+            mode = 'ab'
+            if verbose:
+                print(f'resuming download from byte {start}')
+            with open(fp_part, 'rb') as f:
+                for chunk in iter(lambda: f.read(chunk_size), b''):
+                    hasher.update(chunk)
             
         else:
             
-            fp_metadata=f"{fp_zip}-{metadata_file_suffix}"
-        
-        if overwrite_existing_files or not os.path.exists(fp_metadata):
+            # server has sent the full file, i.e. a new download, or the 
+            # remote file has changed since the '.part' file was started
+            content_length = response.headers.get('Content-Length')
+            total = None if content_length is None else int(content_length)
+            mode = 'wb'
+            _write_part_validators(fp_part_validators, response.headers)
             
-            urllib.request.urlretrieve(
-                url=metadata_url, 
-                filename=fp_metadata
-                )
+        with open(fp_part, mode) as f:
             
+            while True:
+                if not cancel_event is None and cancel_event.is_set():
+                    raise concurrent.futures.CancelledError()
+                chunk = response.read1(chunk_size)
+                if not chunk:
+                    break
+                f.write(chunk)
+                hasher.update(chunk)
+                if not stats is None:
+                    stats['bytes'] += len(chunk)
+                
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+                
+    size = os.path.getsize(fp_part)
+    
+    if not total is None and size != total:
+        raise http.client.IncompleteRead(b'', total - size)
         
-
-#%% downloaded csvw metadata file
+    return dict(
+        url=url,
+        etag=etag,
+        last_modified=last_modified,
+        size=size,
+        sha256=hasher.hexdigest()
+        )
 
 
-def get_metadata_table_group_dict(
-        metadata_filepath
+def _get_download_manifest_filepath(
+        data_folder
         ):
     ""
-    with open(metadata_filepath) as f:
-        metadata_table_group_dict=json.load(f)
-        
-    return metadata_table_group_dict
+    return os.path.join(data_folder, 'csvw_functions_extra_download_manifest.json')
 
 
-def get_metadata_table_dict(
-        sql_table_name,
-        metadata_table_group_dict = None,
-        metadata_filepath = None
+def _read_download_manifest(
+        data_folder
         ):
-    ""
-    if metadata_table_group_dict is None:
-        
-        metadata_table_group_dict = \
-            get_metadata_table_group_dict(
-                metadata_filepath = metadata_filepath
-                )
+    """Reads the download manifest in the data_folder.
     
-    for metadata_table_dict in metadata_table_group_dict['tables']:
-        
-        if metadata_table_dict['https://purl.org/berg/csvw_functions_extra/vocab/sql_table_name']['@value']==sql_table_name:
-            
-            break
-        
+    The 'files' value has keys of file names relative to the data_folder
+    and values of dictionaries with 'url', 'etag', 'last_modified', 
+    'size' and 'sha256' keys.
+    
+    """
+    fp_manifest = _get_download_manifest_filepath(data_folder)
+    
+    if os.path.exists(fp_manifest):
+        with open(fp_manifest) as f:
+            return json.load(f)
     else:
-        
-        raise Exception
+        return {'files': {}}
     
-    return metadata_table_dict
     
-
-def get_metadata_column_dict(
-        column_name,
-        sql_table_name,
-        metadata_table_group_dict = None,
-        metadata_filepath = None
+def _write_download_manifest(
+        data_folder,
+        download_manifest
         ):
     ""
-    if metadata_table_group_dict is None:
+    fp_manifest = _get_download_manifest_filepath(data_folder)
+    
+    with open(f'{fp_manifest}.part', 'w') as f:
+        json.dump(download_manifest, f, indent=4)
+    os.replace(f'{fp_manifest}.part', fp_manifest)
+    
+    
+def _download_file_if_required(
+        url,
+        filepath,
+        data_folder,
+        overwrite_existing_files=False,
+        refresh_changed_files=False,
+        download_manifest=None,
+        host_semaphores=None,
+        downloaded_files=None,
+        cache_folder=None,
+        cache_max_size=None,
+        cancel_event=None,
+        callback=None,
+        csv_file_name=None,
+        verbose=False
+        ):
+    """Downloads a remote file if it doesn't exist locally, or if 
+    overwrite_existing_files is True, or if refresh_changed_files is True
+    and the remote file has changed.
+    
+    downloaded_files is an optional dictionary of the results of previous 
+    calls, keyed by filepath. Files already in downloaded_files are not 
+    downloaded again, i.e. when several tables share the same ZIP file.
+    
+    A 'file' event is sent to callback, with a 'status' value of 
+    'downloaded', 'cache_hit', 'not_modified', 'skipped' (the file exists) or
+    'shared' (the file was downloaded for a previous table).
+    
+    Returns a tuple of the download manifest key and the new download 
+    manifest entry. The entry is None if the file was not downloaded.
+    
+    """
+    key = os.path.relpath(filepath, data_folder).replace('\\', '/')
+    
+    start_time = time.perf_counter()
+    stats = dict(bytes=0, status='downloaded')
+    
+    def emit():
+        _emit_download_event(
+            callback,
+            'file',
+            csv_file_name=csv_file_name,
+            url=url,
+            host=urllib.parse.urlsplit(url).netloc,
+            filepath=filepath,
+            status=stats['status'],
+            bytes=stats['bytes'],
+            elapsed=time.perf_counter() - start_time
+            )
+    
+    if not downloaded_files is None and filepath in downloaded_files:
         
-        metadata_table_group_dict = \
-            get_metadata_table_group_dict(
-                metadata_filepath = metadata_filepath
-                )
-            
-    metadata_table_dict = \
-        get_metadata_table_dict(
-               sql_table_name,
-               metadata_table_group_dict
-               )
+        stats['status'] = 'shared'
+        emit()
+        return downloaded_files[filepath]
     
-    for metadata_column_dict in metadata_table_dict['tableSchema']['columns']:
+    elif overwrite_existing_files or not os.path.exists(filepath):
         
-        if metadata_column_dict['name'] == column_name:
+        validators = None
+        
+    elif refresh_changed_files:
+        
+        # a conditional request is only used if the local file matches
+        # the download manifest
+        entry = (download_manifest or {'files': {}})['files'].get(key)
+        if not entry is None \
+            and entry['url'] == url \
+            and entry['size'] == os.path.getsize(filepath):
+            validators = entry
+        else:
+            validators = None
             
-            break
+    else:
         
+        stats['status'] = 'skipped'
+        emit()
+        return key, None
+            
+    if cache_folder is None:
+            
+        result = \
+            _download_file(
+                url=url,
+                filepath=filepath,
+                validators=validators,
+                host_semaphores=host_semaphores,
+                cancel_event=cancel_event,
+                stats=stats,
+                verbose=verbose
+                )
+        if result is None:
+            stats['status'] = 'not_modified'
+            
     else:
         
-        raise Exception
-    
-    return metadata_column_dict
+        result = \
+            _download_file_using_cache(
+                url=url,
+                filepath=filepath,
+                cache_folder=cache_folder,
+                cache_max_size=cache_max_size,
+                validators=validators,
+                host_semaphores=host_semaphores,
+                cancel_event=cancel_event,
+                stats=stats,
+                verbose=verbose
+                )
     
+    if not downloaded_files is None:
+        downloaded_files[filepath] = (key, result)
+        
+    emit()
+        
+    return key, result
 
-def get_metadata_sql_table_names(
-        metadata_table_group_dict = None,
-        metadata_filepath = None
+
+def _get_remote_validators(
+        url,
+        host_semaphores=None
         ):
+    """Returns the ETag and Last-Modified values of a remote file using a 
+    HEAD request.
+    
+    Returns None if the request fails or if the server provides neither value.
+    
     """
-    """
-    if metadata_table_group_dict is None:
-        
-        metadata_table_group_dict = \
-            get_metadata_table_group_dict(
-                metadata_filepath
-                )
-
-    result=[]
+    semaphore = (host_semaphores or {}).get(urllib.parse.urlsplit(url).netloc)
     
-    for metadata_table_dict in metadata_table_group_dict['tables']:
-        
-        x = metadata_table_dict.get('https://purl.org/berg/csvw_functions_extra/vocab/sql_table_name')
-        
-        if not x is None:
-            
-            result.append(x['@value'])
-            
-    return result
+    request = urllib.request.Request(url, method='HEAD')
+    
+    try:
+        with (semaphore or contextlib.nullcontext()):
+            with urllib.request.urlopen(request) as response:
+                etag = response.headers.get('ETag')
+                last_modified = response.headers.get('Last-Modified')
+    except (urllib.error.URLError, http.client.HTTPException, OSError):
+        return None
+    
+    if etag is None and last_modified is None:
+        return None
+    
+    return dict(etag=etag, last_modified=last_modified)
 
 
+def _get_download_cache_key(
+        url,
+        etag,
+        last_modified
+        ):
+    ""
+    x = json.dumps([url, etag, last_modified])
+    return hashlib.sha256(x.encode()).hexdigest()
 
-def get_metadata_columns_codes(
-        sql_table_name,
-        column_names = None,
-        metadata_table_group_dict = None,
-        metadata_filepath = None
+
+def _download_file_using_cache(
+        url,
+        filepath,
+        cache_folder,
+        cache_max_size=None,
+        validators=None,
+        host_semaphores=None,
+        cancel_event=None,
+        stats=None,
+        verbose=False
         ):
+    """Downloads a remote file using a content addressed download cache.
+    
+    The cache folder contains:
+        - 'objects/<sha256>': the downloaded files, named by content hash.
+        - 'keys/<key>.json': download manifest entries, where the key is
+          a hash of the url, ETag and Last-Modified values.
+          
+    A HEAD request is used to get the current ETag and Last-Modified values
+    of the remote file. If these match a cached download then the cached
+    file is hard linked (or copied if this is not possible) to filepath.
+    Otherwise the file is downloaded and added to the cache.
+    
+    Files in the data folder may be hard links to the cache objects, 
+    so should not be modified in place.
+    
+    If stats (a dictionary) is supplied then its 'status' value is set to 
+    'downloaded', 'cache_hit' or 'not_modified' and its 'bytes' value is 
+    increased by the number of bytes received.
+    
+    Returns a download manifest entry for the file, or None if validators
+    is supplied and the remote file has not been modified.
+    
     """
-    """
-    metadata_table_dict = \
-        get_metadata_table_dict(
-            sql_table_name,
-            metadata_table_group_dict = metadata_table_group_dict,
-            metadata_filepath = metadata_filepath
+    if stats is None:
+        stats = dict(bytes=0)
+    stats['status'] = 'downloaded'
+    
+    remote_validators = \
+        _get_remote_validators(
+            url,
+            host_semaphores
             )
         
-    if column_names is None:
-        column_names = \
-            [metadata_column_dict['name'] 
-             for metadata_column_dict 
-             in metadata_table_dict['tableSchema']['columns']
-             ]
-            
-    column_names = convert_to_iterator(column_names)
-    
-    result = {}
-    
-    for metadata_column_dict in metadata_table_dict['tableSchema']['columns']:
+    if not remote_validators is None:
         
-        if metadata_column_dict['name'] in column_names:
+        # check if modified
+        if not validators is None:
+            if (validators.get('etag') is not None 
+                and validators['etag'] == remote_validators['etag']) \
+                or (validators.get('etag') is None 
+                    and validators.get('last_modified') is not None
+                    and validators['last_modified'] == remote_validators['last_modified']):
+                if verbose:
+                    print('not modified:', url)
+                stats['status'] = 'not_modified'
+                return None
+        
+        # check cache
+        cache_key = \
+            _get_download_cache_key(
+                url, 
+                remote_validators['etag'], 
+                remote_validators['last_modified']
+                )
+        fp_key = os.path.join(cache_folder, 'keys', f'{cache_key}.json')
+        
+        if os.path.exists(fp_key):
             
-            datatype_base = metadata_column_dict['datatype']['base']
+            with open(fp_key) as f:
+                entry = json.load(f)
                 
-            codes = metadata_column_dict.get(
-                'https://purl.org/berg/csvw_functions_extra/vocab/codes',
-                {}
+            if _copy_from_download_cache(
+                    cache_folder,
+                    entry,
+                    filepath
+                    ):
+                if verbose:
+                    print('download cache hit:', url)
+                stats['status'] = 'cache_hit'
+                return entry
+        
+    result = \
+        _download_file(
+            url=url,
+            filepath=filepath,
+            validators=validators,
+            host_semaphores=host_semaphores,
+            cancel_event=cancel_event,
+            stats=stats,
+            verbose=verbose
+            )
+    if result is None:
+        stats['status'] = 'not_modified'
+        
+    if not result is None \
+        and not (result['etag'] is None and result['last_modified'] is None):
+        
+        _add_to_download_cache(
+            cache_folder, 
+            result,
+            filepath
+            )
+        
+        if not cache_max_size is None:
+            _evict_download_cache(
+                cache_folder, 
+                cache_max_size,
+                verbose=verbose
                 )
-            
-            if datatype_base == 'integer':
-                x=lambda y:int(y) if y!='' else y
-            elif datatype_base in ['decimal','number']:
-                x=lambda y:float(y) if y!='' else y
-            elif datatype_base == 'string':
-                x=lambda y:y
-            else:
-                raise Exception
-            
-            codes = {x(k):v['@value'] for k,v in codes.items()}
-            
-            result[metadata_column_dict['name']] = codes
-
+        
     return result
 
 
-#%% import data to sqlite
-
-def import_table_group_to_sqlite(
-        metadata_filepath,
-        database_filepath,
-        csv_file_names=None,  # if none then all are imported
-        overwrite_existing_tables=False,
-        verbose=False
+def _link_or_copy_file(
+        src,
+        dst
         ):
+    """Hard links src to dst, or copies src to dst if a hard link is not 
+    possible (i.e. on a different file system). 
+    
+    dst is written to a temporary file first and then renamed.
+    
     """
-    Reads a CSVW metadata file and imports the CSV data into a SQLITE database.
+    fp_part = f'{dst}.{os.getpid()}.{threading.get_ident()}.part'
     
-    This makes use of the https://purl.org/berg/csvw_functions_extra vocabulary.
+    try:
+        os.link(src, fp_part)
+    except OSError:
+        shutil.copyfile(src, fp_part)
         
-    :param metadata_document_location: The filepath of the csvw metadata 
-        file containing a table group object.
-    :type metadata_document_location: str
+    os.replace(fp_part, dst)
     
-    :param data_folder: The filepath of a local folder where the 
-        downloaded CSV data is located and the SQLITE database is stored.
-    :type data_folder: str
     
-    :param database_name: The name of the SQLITE database, relative to the
-        data_folder.
-    :type database_name: str
+def _copy_from_download_cache(
+        cache_folder,
+        entry,
+        filepath
+        ):
+    """Links or copies a cached file to filepath.
     
-    :param csv_file_names: The csv_file_name values of the tables 
-        to be imported. If None then all tables are imported.
+    Returns False if the cached file is missing or has the wrong size.
+    
+    """
+    fp_object = os.path.join(cache_folder, 'objects', entry['sha256'])
+    
+    try:
+        if os.path.getsize(fp_object) != entry['size']:
+            return False
+        _link_or_copy_file(fp_object, filepath)
+        os.utime(fp_object)  # marks the file as recently used
+    except FileNotFoundError:  # i.e. evicted by another process
+        return False
+        
+    return True
+    
+
+def _add_to_download_cache(
+        cache_folder,
+        entry,
+        filepath
+        ):
+    """Adds a downloaded file to the download cache.
+    
+    """
+    os.makedirs(os.path.join(cache_folder, 'objects'), exist_ok=True)
+    os.makedirs(os.path.join(cache_folder, 'keys'), exist_ok=True)
+    
+    fp_object = os.path.join(cache_folder, 'objects', entry['sha256'])
+    if not os.path.exists(fp_object):
+        _link_or_copy_file(filepath, fp_object)
+    else:
+        os.utime(fp_object)
+        
+    cache_key = \
+        _get_download_cache_key(
+            entry['url'], 
+            entry['etag'], 
+            entry['last_modified']
+            )
+    fp_key = os.path.join(cache_folder, 'keys', f'{cache_key}.json')
+    fp_part = f'{fp_key}.{os.getpid()}.{threading.get_ident()}.part'
+    with open(fp_part, 'w') as f:
+        json.dump(entry, f, indent=4)
+    os.replace(fp_part, fp_key)
+    
+    
+def _evict_download_cache(
+        cache_folder,
+        cache_max_size,
+        verbose=False
+        ):
+    """Removes the least recently used files from the download cache until 
+    its total size is no more than cache_max_size bytes.
+    
+    Key files of removed objects are left in place; these are treated as
+    cache misses.
+    
+    """
+    folder = os.path.join(cache_folder, 'objects')
+    
+    objects = []
+    for entry in os.scandir(folder):
+        if entry.is_file() and not entry.name.endswith('.part'):
+            stat = entry.stat()
+            objects.append((stat.st_mtime, stat.st_size, entry.path))
+            
+    total_size = sum(x[1] for x in objects)
+    
+    for mtime, size, fp_object in sorted(objects):
+        
+        if total_size <= cache_max_size:
+            break
+        
+        if verbose:
+            print('removing from download cache:', fp_object)
+        try:
+            os.remove(fp_object)
+        except FileNotFoundError:
+            pass
+        total_size -= size
+
+
+def _download_tables_and_metadata(
+        download_info_list,
+        cancel_event=None,
+        callback=None,
+        verbose=False,
+        **kwargs
+        ):
+    """Downloads one or more tables in turn.
+    
+    CSV files in ZIP files are extracted after all tables are downloaded, 
+    so that each ZIP file is opened only once.
+    
+    Returns a dictionary of new download manifest entries.
+    
+    """
+    result = {}
+    
+    downloaded_files = {}
+    zip_extractions = {}
+    
+    for download_info in download_info_list:
+        
+        if verbose:
+            print('---')
+            for k,v in download_info.items(): print(k,v)
+    
+        result.update(
+            _download_table_and_metadata(
+                downloaded_files=downloaded_files,
+                zip_extractions=zip_extractions,
+                cancel_event=cancel_event,
+                callback=callback,
+                verbose=verbose,
+                **kwargs,
+                **download_info
+                )
+            )
+        
+        if verbose:
+            print('---')
+            
+    for fp_zip, members in zip_extractions.items():
+        
+        _extract_zip_members(
+            fp_zip,
+            members,
+            cancel_event=cancel_event,
+            callback=callback,
+            verbose=verbose
+            )
+            
+    return result
+
+
+def _download_table_and_metadata(
+        data_folder,
+        csv_file_name=None,
+        csv_download_url=None,
+        fp_csv=None,
+        zip_download_url=None,
+        fp_zip=None,
+        csv_zip_extract_path=None,
+        metadata_url=None,
+        metadata_file_suffix=None,
+        overwrite_existing_files=False,
+        refresh_changed_files=False,
+        extract_zip_files=True,
+        download_manifest=None,
+        host_semaphores=None,
+        downloaded_files=None,
+        zip_extractions=None,
+        cache_folder=None,
+        cache_max_size=None,
+        cancel_event=None,
+        callback=None,
+        verbose=False,
+        **kwargs  # to pick up unused keywords in **download_info
+        ):
+    """Downloads a table and its associated metadata file.
+    
+    If zip_extractions is supplied then any CSV file to be extracted from
+    a ZIP file is added to this dictionary (keys are ZIP filepaths, values
+    are lists of (csv_zip_extract_path, fp_csv) tuples) rather than 
+    extracted straight away.
+    
+    A 'table' event is sent to callback once the table is downloaded.
+    
+    Returns a dictionary of new download manifest entries.
+    
+    """
+    result = {}
+    
+    start_time = time.perf_counter()
+    
+    # collects the 'file' events of the table
+    file_events = []
+    def file_callback(event_dict):
+        file_events.append(event_dict)
+        if not callback is None:
+            callback(event_dict)
+    
+    download_kwargs = dict(
+        data_folder=data_folder,
+        overwrite_existing_files=overwrite_existing_files,
+        refresh_changed_files=refresh_changed_files,
+        download_manifest=download_manifest,
+        host_semaphores=host_semaphores,
+        downloaded_files=downloaded_files,
+        cache_folder=cache_folder,
+        cache_max_size=cache_max_size,
+        cancel_event=cancel_event,
+        callback=file_callback,
+        csv_file_name=csv_file_name,
+        verbose=verbose
+        )
+    
+    if not csv_download_url is None:
+        
+        # download csv
+        key, entry = \
+            _download_file_if_required(
+                url=csv_download_url, 
+                filepath=fp_csv,
+                **download_kwargs
+                )
+        if not entry is None:
+            result[key] = entry
+            
+    else:  # zip file
+        
+        zip_changed = False
+        
+        # download zip
+        if not zip_download_url is None:
+        
+            if verbose:
+                print('downloading zip file...')
+            key, entry = \
+                _download_file_if_required(
+                    url=zip_download_url, 
+                    filepath=fp_zip,
+                    **download_kwargs
+                    )
+            if not entry is None:
+                result[key] = entry
+                previous_entry = (download_manifest or {'files': {}})['files'].get(key, {})
+                zip_changed = entry['sha256'] != previous_entry.get('sha256')
+        
+        # extract csv
+        if not extract_zip_files:
+            
+            pass
+        
+        elif overwrite_existing_files or zip_changed or not os.path.exists(fp_csv):
+            
+            if zip_extractions is None:
+                _extract_zip_members(
+                    fp_zip,
+                    [(csv_zip_extract_path, fp_csv)],
+                    cancel_event=cancel_event,
+                    callback=callback,
+                    verbose=verbose
+                    )
+            else:
+                zip_extractions.setdefault(fp_zip, []).append(
+                    (csv_zip_extract_path, fp_csv)
+                    )
+              
+            
+    # download metadata
+    if not metadata_url is None:
+        
+        if not csv_download_url is None:
+        
+            fp_metadata=f"{fp_csv}-{metadata_file_suffix}"
+            
+        else:
+            
+            fp_metadata=f"{fp_zip}-{metadata_file_suffix}"
+        
+        key, entry = \
+            _download_file_if_required(
+                url=metadata_url, 
+                filepath=fp_metadata,
+                **download_kwargs
+                )
+        if not entry is None:
+            result[key] = entry
+            
+    _emit_download_event(
+        callback,
+        'table',
+        csv_file_name=csv_file_name,
+        urls=[x['url'] for x in file_events],
+        statuses=[x['status'] for x in file_events],
+        bytes=sum(x['bytes'] for x in file_events),
+        elapsed=time.perf_counter() - start_time
+        )
+            
+    return result
+
+
+def _extract_zip_members(
+        fp_zip,
+        members,
+        chunk_size=1024*1024,
+        cancel_event=None,
+        callback=None,
+        verbose=False
+        ):
+    """Extracts one or more files from a ZIP file in a single pass.
+    
+    Each member is streamed in chunks to a '.part' file which is renamed
+    once the extraction is complete. If cancel_event is set then the 
+    extraction stops and concurrent.futures.CancelledError is raised.
+    
+    A 'zip_extract' event is sent to callback for each member.
+    
+    :param members: A list of (csv_zip_extract_path, fp_csv) tuples.
+    
+    """
+    with zipfile.ZipFile(fp_zip) as z:
+        
+        # extract in the order the members are stored in the archive
+        members = sorted(
+            members, 
+            key=lambda x: z.getinfo(x[0]).header_offset
+            )
+        
+        for csv_zip_extract_path, fp_csv in members:
+            
+            if verbose:
+                print('extracting csv file:', csv_zip_extract_path)
+                
+            fp_part = f'{fp_csv}.part'
+            start_time = time.perf_counter()
+            
+            with z.open(csv_zip_extract_path) as f_zip, \
+                open(fp_part, 'wb') as f:
+                    
+                while True:
+                    if not cancel_event is None and cancel_event.is_set():
+                        raise concurrent.futures.CancelledError()
+                    chunk = f_zip.read(chunk_size)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                
+            os.replace(fp_part, fp_csv)
+            
+            _emit_download_event(
+                callback,
+                'zip_extract',
+                fp_zip=fp_zip,
+                csv_zip_extract_path=csv_zip_extract_path,
+                filepath=fp_csv,
+                bytes=os.path.getsize(fp_csv),
+                elapsed=time.perf_counter() - start_time
+                )
+            
+        
+
+#%% downloaded csvw metadata file
+
+
+def get_metadata_table_group_dict(
+        metadata_filepath
+        ):
+    ""
+    with open(metadata_filepath) as f:
+        metadata_table_group_dict=json.load(f)
+        
+    return metadata_table_group_dict
+
+
+def get_metadata_table_dict(
+        sql_table_name,
+        metadata_table_group_dict = None,
+        metadata_filepath = None
+        ):
+    ""
+    if metadata_table_group_dict is None:
+        
+        metadata_table_group_dict = \
+            get_metadata_table_group_dict(
+                metadata_filepath = metadata_filepath
+                )
+    
+    for metadata_table_dict in metadata_table_group_dict['tables']:
+        
+        if metadata_table_dict['https://purl.org/berg/csvw_functions_extra/vocab/sql_table_name']['@value']==sql_table_name:
+            
+            break
+        
+    else:
+        
+        raise Exception
+    
+    return metadata_table_dict
+    
+
+def get_metadata_column_dict(
+        column_name,
+        sql_table_name,
+        metadata_table_group_dict = None,
+        metadata_filepath = None
+        ):
+    ""
+    if metadata_table_group_dict is None:
+        
+        metadata_table_group_dict = \
+            get_metadata_table_group_dict(
+                metadata_filepath = metadata_filepath
+                )
+            
+    metadata_table_dict = \
+        get_metadata_table_dict(
+               sql_table_name,
+               metadata_table_group_dict
+               )
+    
+    for metadata_column_dict in metadata_table_dict['tableSchema']['columns']:
+        
+        if metadata_column_dict['name'] == column_name:
+            
+            break
+        
+    else:
+        
+        raise Exception
+    
+    return metadata_column_dict
+    
+
+def get_metadata_sql_table_names(
+        metadata_table_group_dict = None,
+        metadata_filepath = None
+        ):
+    """
+    """
+    if metadata_table_group_dict is None:
+        
+        metadata_table_group_dict = \
+            get_metadata_table_group_dict(
+                metadata_filepath
+                )
+
+    result=[]
+    
+    for metadata_table_dict in metadata_table_group_dict['tables']:
+        
+        x = metadata_table_dict.get('https://purl.org/berg/csvw_functions_extra/vocab/sql_table_name')
+        
+        if not x is None:
+            
+            result.append(x['@value'])
+            
+    return result
+
+
+
+def get_metadata_columns_codes(
+        sql_table_name,
+        column_names = None,
+        metadata_table_group_dict = None,
+        metadata_filepath = None
+        ):
+    """
+    """
+    metadata_table_dict = \
+        get_metadata_table_dict(
+            sql_table_name,
+            metadata_table_group_dict = metadata_table_group_dict,
+            metadata_filepath = metadata_filepath
+            )
+        
+    if column_names is None:
+        column_names = \
+            [metadata_column_dict['name'] 
+             for metadata_column_dict 
+             in metadata_table_dict['tableSchema']['columns']
+             ]
+            
+    column_names = convert_to_iterator(column_names)
+    
+    result = {}
+    
+    for metadata_column_dict in metadata_table_dict['tableSchema']['columns']:
+        
+        if metadata_column_dict['name'] in column_names:
+            
+            datatype_base = metadata_column_dict['datatype']['base']
+                
+            codes = metadata_column_dict.get(
+                'https://purl.org/berg/csvw_functions_extra/vocab/codes',
+                {}
+                )
+            
+            if datatype_base == 'integer':
+                x=lambda y:int(y) if y!='' else y
+            elif datatype_base in ['decimal','number']:
+                x=lambda y:float(y) if y!='' else y
+            elif datatype_base == 'string':
+                x=lambda y:y
+            else:
+                raise Exception
+            
+            codes = {x(k):v['@value'] for k,v in codes.items()}
+            
+            result[metadata_column_dict['name']] = codes
+
+    return result
+
+
+#%% import data to sqlite
+
+def import_table_group_to_sqlite(
+        metadata_filepath,
+        database_filepath,
+        csv_file_names=None,  # if none then all are imported
+        overwrite_existing_tables=False,
+        import_method='native',
+        import_pragmas=None,
+        batch_size=10000,
+        defer_indexes=False,
+        sort_by_primary_key=False,
+        max_workers=None,
+        incremental=False,
+        commit_interval=None,
+        progress_callback=None,
+        resume=False,
+        atomic_reload=False,
+        sql_strict=False,
+        sql_without_rowid=False,
+        verbose=False
+        ):
+    """
+    Reads a CSVW metadata file and imports the CSV data into a SQLITE database.
+    
+    This makes use of the https://purl.org/berg/csvw_functions_extra vocabulary.
+        
+    :param metadata_filepath: The filepath of a CSVW metadata file which 
+        has been created by the `download_table_group` function. The CSV 
+        data is read from the folder of the metadata file.
+    :type metadata_filepath: str
+    
+    :param database_filepath: The filepath of the SQLITE database.
+    :type database_filepath: str
+    
+    :param csv_file_names: The csv_file_name values of the tables 
+        to be imported. If None then all tables are imported.
     :type csv_file_names: str or list
     
-    :param overwrite_existing_tables: If True, then before importing the CSV data
-        any associated existing table in the database is removed and recreated.
-    :type overwrite_existing_tables: bool
+    :param overwrite_existing_tables: If True, then before importing the CSV data
+        any associated existing table in the database is removed and recreated.
+    :type overwrite_existing_tables: bool
+    
+    :param import_method: Either 'native', where the CSV data is read with the
+        Python csv module and inserted in batches in a single transaction, or 
+        'cli', where the sqlite3 command line tool is used (this must be 
+        installed, and can only read uncompressed CSV files).
+    :type import_method: str
+    
+    :param import_pragmas: SQLite PRAGMA statements to run before a native 
+        import, i.e. {'journal_mode': 'MEMORY'}. These are added to 
+        (or replace) the defaults of synchronous=OFF, cache_size=-65536 
+        (64 MiB) and temp_store=MEMORY.
+    :type import_pragmas: dict
+    
+    :param batch_size: The number of rows inserted by each executemany call
+        in a native import.
+    :type batch_size: int
+    
+    :param defer_indexes: If True, then the sqlsetindex indexes of new 
+        tables are built after the CSV data is loaded, and ANALYZE is then 
+        run on the table. This only applies to tables which are created by 
+        this function call.
+    :type defer_indexes: bool
+    
+    :param sort_by_primary_key: If True (and defer_indexes is True), then 
+        the CSV data is first loaded into an unindexed staging table and 
+        then copied into the final table sorted by the primary key, so the 
+        primary key index is built in order.
+    :type sort_by_primary_key: bool
+    
+    :param max_workers: The maximum number of tables to read at the same
+        time. If not None, then each table is read, converted and written 
+        to its own temporary database file in a process pool. The 
+        temporary databases are then attached and copied into the database 
+        one at a time, in the same order as the serial import. If None then 
+        the tables are imported one at a time.
+    :type max_workers: int
+    
+    :param incremental: If True, then a table is skipped if its CSV data 
+        and CSVW metadata are unchanged since it was last imported, as 
+        recorded in the import log table. Tables which have changed (or 
+        which are not in the import log) are removed and imported again.
+    :type incremental: bool
+    
+    :param commit_interval: The number of rows between commits in a native
+        import. If None, then each table is imported in a single 
+        transaction. Otherwise the number of rows committed is recorded
+        in the import progress table, so an interrupted import can be 
+        resumed.
+    :type commit_interval: int
+    
+    :param progress_callback: An optional function which is called after 
+        each batch of rows in a native import with a dictionary with keys
+        'event' ('import_progress'), 'table_name', 'rows', 
+        'rows_committed', 'bytes', 'total_bytes', 'elapsed' and 
+        'rows_per_second'.
+    :type progress_callback: callable
+    
+    :param resume: If True, then a table whose previous import with a 
+        commit_interval was interrupted is resumed after the last committed 
+        rows, rather than being imported from the start.
+    :type resume: bool
+    
+    :param atomic_reload: If True, then an existing table which is to be 
+        removed and imported again (due to overwrite_existing_tables, the
+        sql_remove_existing_table vocabulary or the incremental option) is 
+        not removed first. Instead the CSV data is imported into a shadow 
+        table, its indexes are built, and the existing table is replaced by
+        the shadow table in a single transaction. The database is set to 
+        WAL mode, so other connections can read the existing table until 
+        it is replaced.
+    :type atomic_reload: bool
+    
+    :param sql_strict: If True, then new tables are created as STRICT 
+        tables, so values which cannot be converted to the column datatype
+        raise an error. Applies to tables that do not set the 
+        sql_strict vocabulary.
+    :type sql_strict: bool
+    
+    :param sql_without_rowid: If True, then new tables with a primaryKey 
+        are created as WITHOUT ROWID tables, which are stored clustered on 
+        the primary key. Applies to tables that do not set the 
+        sql_without_rowid vocabulary.
+    :type sql_without_rowid: bool
+    
+    :param verbose: If True, then this function prints intermediate variables
+        and other useful information.
+    :type verbose: bool
+    
+    :returns: A dictionary with keys of the table names and values of 
+        the number of rows imported.
+    :rtype: dict
+    
+    """
+    if verbose:
+        print('--- FUNCTION: csvw_functions_extra.import_table_group_to_sqlite ---')
+        
+    if import_method != 'native' \
+        and (not commit_interval is None or not progress_callback is None or resume):
+        raise Exception('commit_interval, progress_callback and resume can only be used with import_method="native".')
+    
+    if not max_workers is None \
+        and (not commit_interval is None or not progress_callback is None or resume):
+        raise Exception('commit_interval, progress_callback and resume cannot be used with max_workers.')
+        
+    if sort_by_primary_key and resume:
+        raise Exception('sort_by_primary_key and resume cannot be used together.')
+    
+    # all database operations share one connection
+    with _get_database(database_filepath) as database:
+        
+        # convert single csv_file_name to list. None becomes an empty list.
+        csv_file_name_list=convert_to_iterator(csv_file_names)
+    
+        # 
+        metadata_dir, metadata_filename = os.path.split(metadata_filepath)
+        
+        # get normalised metadata_table_group_dict
+        metadata_table_group_dict = \
+            get_metadata_table_group_dict(
+                    metadata_filepath
+                    )
+        #print(metadata_table_group_dict)
+    
+        result = {}
+        
+        # tables to import into a shadow table and then swap in
+        reload_table_names = set()
+        
+        if atomic_reload:
+            database.execute('PRAGMA journal_mode=WAL;')
+            
+        # set the default table layout of each table to be imported
+        metadata_table_group_dict['tables'] = [
+            _set_table_layout_defaults(
+                metadata_table_dict,
+                sql_strict=sql_strict,
+                sql_without_rowid=sql_without_rowid,
+                import_method=import_method
+                )
+            if len(csv_file_name_list)==0 
+            or metadata_table_dict['https://purl.org/berg/csvw_functions_extra/vocab/csv_file_name']['@value'] in csv_file_name_list
+            else metadata_table_dict
+            for metadata_table_dict in metadata_table_group_dict['tables']
+            ]
+    
+        # remove existing tables if requested
+        for metadata_table_dict in metadata_table_group_dict['tables']:
+    
+            # get import info
+            csv_file_name, table_name, fp_csv, remove_existing_table = \
+                _get_import_info(
+                    metadata_table_dict,
+                    data_folder = metadata_dir,
+                    verbose=False,
+                    ) 
+        
+            # if requested by csv_file_name argument
+            if len(csv_file_name_list)==0 \
+                or csv_file_name in csv_file_name_list:
+                
+                if verbose:
+                    print('---')
+                    print('csv_file_name',csv_file_name)
+                    print('table_name',table_name)
+                    print('fp_csv',fp_csv)
+                    print('remove_existing_table',remove_existing_table)
+                
+                if _check_if_table_exists_in_database(
+                    database, 
+                    table_name
+                    ):
+                
+                    if remove_existing_table or overwrite_existing_tables:
+                        
+                        if atomic_reload:
+                            reload_table_names.add(table_name)
+                        else:
+                            _drop_table(
+                                database,
+                                table_name
+                                )
+        
+        # get the tables to import
+        import_tasks = []
+        for metadata_table_dict in metadata_table_group_dict['tables']:
+        
+            # get import info
+            csv_file_name, table_name, fp_csv, remove_existing_table = _get_import_info(
+                    metadata_table_dict,
+                    data_folder = metadata_dir,
+                    verbose=False,
+                    ) 
+            
+            if len(csv_file_name_list)==0 \
+                or csv_file_name in csv_file_name_list:
+            
+                csv_source = \
+                    _get_csv_source(
+                        fp_csv,
+                        metadata_table_dict,
+                        data_folder = metadata_dir
+                        )
+                if verbose:
+                    print('table_name', table_name)
+                    print('csv_source', csv_source)
+                
+                if incremental and not table_name in reload_table_names:
+                
+                    if _check_if_import_is_unchanged(
+                            database,
+                            table_name,
+                            csv_source,
+                            metadata_table_dict
+                            ):
+                    
+                        if verbose:
+                            print('Table unchanged since last import, skipped')
+                        result[table_name] = 0
+                        continue
+                    
+                    if atomic_reload:
+                        if _check_if_table_exists_in_database(database, table_name):
+                            reload_table_names.add(table_name)
+                    elif not (resume and _get_import_progress_rows_committed(
+                            database, 
+                            table_name, 
+                            csv_source
+                            ) > 0):
+                        _drop_table(
+                            database,
+                            table_name
+                            )
+                        
+                # the table (or shadow table) that the CSV data is loaded into
+                if table_name in reload_table_names:
+                    load_table_name = f'{table_name}{_SHADOW_TABLE_SUFFIX}'
+                    if not (resume and _get_import_progress_rows_committed(
+                            database, 
+                            load_table_name, 
+                            csv_source
+                            ) > 0):
+                        _drop_table(
+                            database,
+                            load_table_name
+                            )
+                else:
+                    load_table_name = table_name
+                if verbose:
+                    print('load_table_name', load_table_name)
+                
+                import_tasks.append((metadata_table_dict, table_name, csv_source, load_table_name))
+            
+        # create and import tables
+        if max_workers is None:
+        
+            for metadata_table_dict, table_name, csv_source, load_table_name in import_tasks:
+            
+                result[table_name] = \
+                    _import_table(
+                        csv_source,
+                        metadata_table_dict,
+                        database,
+                        load_table_name,
+                        defer_indexes=defer_indexes,
+                        sort_by_primary_key=sort_by_primary_key,
+                        import_method=import_method,
+                        import_pragmas=import_pragmas,
+                        batch_size=batch_size,
+                        commit_interval=commit_interval,
+                        progress_callback=progress_callback,
+                        resume=resume,
+                        verbose=verbose
+                        )
+            
+                _finish_table_import(
+                    database,
+                    metadata_table_dict,
+                    table_name,
+                    csv_source,
+                    load_table_name,
+                    result[table_name],
+                    verbose=verbose
+                    )
+            
+                if verbose:
+                    print('---')
+                
+        else:
+        
+            result.update(
+                _import_tables_parallel(
+                    import_tasks,
+                    database,
+                    defer_indexes=defer_indexes,
+                    sort_by_primary_key=sort_by_primary_key,
+                    import_method=import_method,
+                    import_pragmas=import_pragmas,
+                    batch_size=batch_size,
+                    max_workers=max_workers,
+                    verbose=verbose
+                    )
+                )
+                
+    return result
+            
+
+def _import_table(
+        csv_source,
+        metadata_table_dict,
+        database_filepath,
+        table_name,
+        defer_indexes=False,
+        sort_by_primary_key=False,
+        import_method='native',
+        import_pragmas=None,
+        batch_size=10000,
+        commit_interval=None,
+        progress_callback=None,
+        resume=False,
+        verbose=False
+        ):
+    """Imports the CSV data of a single table into the database, creating 
+    the table if needed.
+    
+    :returns: The number of rows imported.
+    
+    """
+    table_exists = \
+        _check_if_table_exists_in_database(
+            database_filepath, 
+            table_name
+            )
+        
+    if defer_indexes and not table_exists:
+        
+        # import table data to new database table, then build indexes
+        return _import_csv_file_with_deferred_indexes(
+            csv_source,
+            metadata_table_dict,
+            database_filepath,
+            table_name,
+            sort_by_primary_key=sort_by_primary_key,
+            import_method=import_method,
+            import_pragmas=import_pragmas,
+            batch_size=batch_size,
+            commit_interval=commit_interval,
+            progress_callback=progress_callback,
+            verbose=verbose
+            )
+        
+    # create empty table if needed
+    if not table_exists:
+        
+        _create_table_from_csvw(
+            metadata_table_dict, 
+            database_filepath, 
+            table_name)
+        
+    # import table data to database
+    rows_imported = \
+        _import_csv_file(
+            csv_source,
+            database_filepath,
+            table_name,
+            conversion_plan=_get_conversion_plan(metadata_table_dict),
+            import_method=import_method,
+            import_pragmas=import_pragmas,
+            batch_size=batch_size,
+            commit_interval=commit_interval,
+            progress_callback=progress_callback,
+            resume=resume,
+            verbose=verbose
+            )
+    
+    # build any indexes deferred by an interrupted import
+    if table_exists and defer_indexes and resume:
+        
+        _create_indexes_from_csvw(
+            metadata_table_dict,
+            database_filepath,
+            table_name,
+            verbose=verbose
+            )
+        _analyze_table(database_filepath, table_name)
+    
+    return rows_imported
+
+
+def _import_tables_parallel(
+        import_tasks,
+        database_filepath,
+        defer_indexes=False,
+        sort_by_primary_key=False,
+        import_method='native',
+        import_pragmas=None,
+        batch_size=10000,
+        max_workers=None,
+        verbose=False
+        ):
+    """Imports several tables using a process pool.
+    
+    Each worker process reads and converts the CSV data of one table and 
+    writes it to an unindexed table in its own temporary database file, 
+    which is created next to the database. This process is the only writer
+    to the database: each temporary database is attached and its rows 
+    copied in, in the order of import_tasks, as soon as it is ready.
+    
+    :param import_tasks: A list of (metadata_table_dict, table_name, 
+        csv_source, load_table_name) tuples.
+    
+    :returns: A dictionary with keys of the table names and values of 
+        the number of rows imported.
+    
+    """
+    result = {}
+    
+    if isinstance(database_filepath, CsvwDatabase):
+        fp_database = database_filepath.database_filepath
+    else:
+        fp_database = database_filepath
+        
+    temp_dir = tempfile.mkdtemp(
+        prefix='csvw_functions_extra_import_',
+        dir=os.path.dirname(os.path.abspath(fp_database))
+        )
+    
+    try:
+    
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+            
+            futures = []
+            for i, (metadata_table_dict, table_name, csv_source, load_table_name) in enumerate(import_tasks):
+                fp_temp_database = os.path.join(temp_dir, f'{i}.sqlite')
+                futures.append(
+                    executor.submit(
+                        _import_csv_file_to_new_database,
+                        csv_source,
+                        metadata_table_dict,
+                        fp_temp_database,
+                        table_name,
+                        import_method=import_method,
+                        import_pragmas=import_pragmas,
+                        batch_size=batch_size
+                        )
+                    )
+                
+            try:
+                
+                for (metadata_table_dict, table_name, csv_source, load_table_name), future \
+                    in zip(import_tasks, futures):
+                    
+                    fp_temp_database, rows_imported = future.result()
+                    if verbose:
+                        print('table_name', table_name)
+                        print('fp_temp_database', fp_temp_database)
+                        print('rows_imported', rows_imported)
+                    
+                    table_exists = \
+                        _check_if_table_exists_in_database(
+                            database_filepath, 
+                            load_table_name
+                            )
+                    deferred = defer_indexes and not table_exists
+                    
+                    if not table_exists:
+                        _create_table_from_csvw(
+                            metadata_table_dict, 
+                            database_filepath, 
+                            load_table_name,
+                            create_indexes=not deferred,
+                            verbose=verbose
+                            )
+                    
+                    _copy_table_rows(
+                        database_filepath,
+                        load_table_name,
+                        source_table_name=table_name,
+                        source_database_filepath=fp_temp_database,
+                        order_by=_get_primary_key(metadata_table_dict) \
+                            if deferred and sort_by_primary_key else None,
+                        verbose=verbose
+                        )
+                    os.remove(fp_temp_database)
+                    
+                    if deferred:
+                        _create_indexes_from_csvw(
+                            metadata_table_dict,
+                            database_filepath,
+                            load_table_name,
+                            verbose=verbose
+                            )
+                        _analyze_table(database_filepath, load_table_name)
+                        
+                    result[table_name] = result.get(table_name, 0) + rows_imported
+                    
+                    _finish_table_import(
+                        database_filepath,
+                        metadata_table_dict,
+                        table_name,
+                        csv_source,
+                        load_table_name,
+                        rows_imported,
+                        verbose=verbose
+                        )
+                    
+            except BaseException:
+                
+                for future in futures:
+                    future.cancel()
+                raise
+                
+    finally:
+        
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        
+    return result
+
+
+def _import_csv_file_to_new_database(
+        csv_source,
+        metadata_table_dict,
+        fp_database,
+        table_name,
+        import_method='native',
+        import_pragmas=None,
+        batch_size=10000
+        ):
+    """Imports CSV data into an unindexed table in a new database file.
+    
+    This runs in a worker process of _import_tables_parallel.
+    
+    :returns: A (fp_database, rows_imported) tuple.
+    
+    """
+    _create_table_from_csvw(
+        metadata_table_dict, 
+        fp_database, 
+        table_name,
+        primary_key=False,
+        create_indexes=False
+        )
+    
+    pragmas = {'journal_mode': 'OFF'}
+    pragmas.update(import_pragmas or {})
+    
+    rows_imported = \
+        _import_csv_file(
+            csv_source,
+            fp_database,
+            table_name,
+            conversion_plan=_get_conversion_plan(metadata_table_dict),
+            import_method=import_method,
+            import_pragmas=pragmas,
+            batch_size=batch_size
+            )
+    
+    return fp_database, rows_imported
+    
+
+def _copy_table_rows(
+        database_filepath,
+        table_name,
+        source_table_name,
+        source_database_filepath=None,
+        order_by=None,
+        verbose=False
+        ):
+    """Copies all rows of a source table into a table with the same columns
+    using a single INSERT ... SELECT statement.
+    
+    :param source_database_filepath: If not None, then the source table 
+        is in this database file, which is attached for the copy.
+    :param order_by: An optional list of column names to sort the rows by.
+    
+    """
+    with _get_database(database_filepath) as database:
+        
+        conn = database.connection
+        
+        if source_database_filepath is None:
+            source = f'"{source_table_name}"'
+        else:
+            conn.execute('ATTACH DATABASE ? AS source;', (source_database_filepath,))
+            source = f'source."{source_table_name}"'
+            
+        try:
+            
+            query = f'INSERT INTO main."{table_name}" SELECT * FROM {source}'
+            if order_by:
+                query += ' ORDER BY ' + ', '.join(f'"{x}"' for x in order_by)
+            query += ';'
+            if verbose:
+                print(query)
+            conn.execute(query)
+            
+        finally:
+            
+            if not source_database_filepath is None:
+                conn.execute('DETACH DATABASE source;')
+    
+    
+def _analyze_table(
+        database_filepath,
+        table_name
+        ):
+    """Runs ANALYZE on a table so the query planner has index statistics.
+    
+    """
+    with _get_database(database_filepath) as database:
+        database.execute(f'ANALYZE "{table_name}";')
+
+
+_SHADOW_TABLE_SUFFIX = '__shadow'
+
+
+def _finish_table_import(
+        database_filepath,
+        metadata_table_dict,
+        table_name,
+        csv_source,
+        load_table_name,
+        row_count,
+        verbose=False
+        ):
+    """Records a table import in the import log and, if the CSV data was 
+    loaded into a shadow table, swaps the shadow table in. Any columnar 
+    cache of the table is removed.
+    
+    """
+    if load_table_name != table_name:
+        
+        _swap_shadow_table(
+            database_filepath,
+            table_name,
+            load_table_name,
+            verbose=verbose
+            )
+        
+    _write_import_log_entry(
+        database_filepath,
+        table_name,
+        csv_source,
+        metadata_table_dict,
+        row_count
+        )
+    
+    _write_codes_tables(
+        database_filepath,
+        metadata_table_dict,
+        table_name
+        )
+    
+    _remove_columnar_table_folder(
+        _get_columnar_table_folder(database_filepath, table_name)
+        )
+    
+    
+_CODES_TABLE_INFIX = '__codes__'
+
+
+def _get_codes_table_name(
+        table_name,
+        column_name
+        ):
+    """Returns the name of the code lookup table of a column.
+    
+    """
+    return f'{table_name}{_CODES_TABLE_INFIX}{column_name}'
+
+
+def _get_codes(
+        metadata_table_dict
+        ):
+    """Returns the `codes` of the columns of a table as a dictionary with 
+    the column names as keys and dictionaries of code to label as values.
+    
+    The codes are converted in the same way as the CSV values of the 
+    column (see _get_conversion_plan), so that they compare equal to the 
+    values in the database. Codes which cannot be converted (or which are
+    null values of the column) are kept as text.
+    
+    """
+    codes = {}
+    
+    for column_dict, (_, converter) in zip(
+            metadata_table_dict['tableSchema']['columns'],
+            _get_conversion_plan(metadata_table_dict)
+            ):
+        
+        column_codes = column_dict.get(
+            'https://purl.org/berg/csvw_functions_extra/vocab/codes'
+            )
+        if column_codes is None:
+            continue
+        
+        lookup_dict = {}
+        for k, v in column_codes.items():
+            code = k if converter is None else converter(k)
+            if code is None:
+                code = k
+            lookup_dict[code] = v['@value'] if isinstance(v, dict) else v
+        
+        codes[column_dict['name']] = lookup_dict
+        
+    return codes
+
+
+def _write_codes_tables(
+        database_filepath,
+        metadata_table_dict,
+        table_name
+        ):
+    """Writes the `codes` of the columns of a table to lookup tables, with
+    one table per column with codes.
+    
+    Each lookup table has an indexed "code" column (the primary key) and a 
+    "label" column, and replaces any existing lookup table of the column. 
+    Lookup tables of columns which no longer have codes are removed.
+    
+    The codes are converted as in `_get_codes`.
+    
+    """
+    codes = _get_codes(metadata_table_dict)
+    
+    with _get_database(database_filepath) as database:
+        
+        conn = database.connection
+        
+        in_transaction = conn.in_transaction
+        if not in_transaction:
+            conn.execute('BEGIN;')
+        
+        try:
+            
+            for codes_table_name in database._get_codes_table_names(table_name).values():
+                conn.execute(f'DROP TABLE "{codes_table_name}";')
+            
+            for column_name, lookup_dict in codes.items():
+                codes_table_name = _get_codes_table_name(table_name, column_name)
+                conn.execute(
+                    f'CREATE TABLE "{codes_table_name}" (code PRIMARY KEY, label TEXT) WITHOUT ROWID;'
+                    )
+                conn.executemany(
+                    f'INSERT OR REPLACE INTO "{codes_table_name}" VALUES (?,?);',
+                    lookup_dict.items()
+                    )
+                
+            if not in_transaction:
+                conn.execute('COMMIT;')
+            
+        except BaseException:
+            
+            if not in_transaction and conn.in_transaction:
+                conn.execute('ROLLBACK;')
+            raise
+    
+    
+def _swap_shadow_table(
+        database_filepath,
+        table_name,
+        shadow_table_name,
+        verbose=False
+        ):
+    """Replaces a table with its shadow table in a single transaction.
+    
+    The indexes of the shadow table keep their names, which is why index
+    names alternate between reloads (see _get_index_name).
+    
+    """
+    with _get_database(database_filepath) as database:
+        
+        conn = database.connection
+        
+        if verbose:
+            print(f'Swapping "{shadow_table_name}" in as "{table_name}"')
+        
+        conn.execute('BEGIN IMMEDIATE;')
+        
+        try:
+            
+            conn.execute(f'DROP TABLE IF EXISTS "{table_name}";')
+            conn.execute(f'ALTER TABLE "{shadow_table_name}" RENAME TO "{table_name}";')
+            conn.execute('COMMIT;')
+            
+        except BaseException:
+            
+            if conn.in_transaction:
+                conn.execute('ROLLBACK;')
+            raise
+    
+    
+_IMPORT_LOG_TABLE_NAME = '_csvw_functions_extra_import_log'
+
+
+def _get_csv_source_fingerprint(
+        csv_source
+        ):
+    """Returns the size, modification time and (if cheaply available) the 
+    content hash of the CSV data of a table.
+    
+    For a ZIP file member the CRC-32 value stored in the ZIP file is used
+    as the content hash. For other files the hash is None, and can be 
+    calculated using _get_file_sha256.
+    
+    :returns: A dictionary with keys 'size', 'mtime' and 'hash'.
+    
+    """
+    if csv_source['type'] == 'zip':
+        
+        with zipfile.ZipFile(csv_source['filepath']) as z:
+            info = z.getinfo(csv_source['member'])
+        return dict(
+            size=info.file_size,
+            mtime=time.mktime(info.date_time + (0, 0, -1)),
+            hash=f'crc32:{info.CRC:08x}'
+            )
+    
+    else:
+        
+        st = os.stat(csv_source['filepath'])
+        return dict(
+            size=st.st_size,
+            mtime=st.st_mtime,
+            hash=None
+            )
+    
+
+def _get_file_sha256(
+        fp,
+        chunk_size=1024*1024
+        ):
+    """Returns the SHA-256 hash of a file as a 'sha256:...' string.
+    
+    """
+    h = hashlib.sha256()
+    with open(fp, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return f'sha256:{h.hexdigest()}'
+
+
+def _get_metadata_table_hash(
+        metadata_table_dict
+        ):
+    """Returns the SHA-256 hash of a CSVW table description.
+    
+    """
+    x = json.dumps(metadata_table_dict, sort_keys=True)
+    return hashlib.sha256(x.encode()).hexdigest()
+
+
+def _get_import_log_entry(
+        database_filepath,
+        table_name
+        ):
+    """Returns the import log entry of a table, or None.
+    
+    """
+    if not _check_if_table_exists_in_database(
+            database_filepath, 
+            _IMPORT_LOG_TABLE_NAME
+            ):
+        return None
+    
+    with _get_database(database_filepath) as database:
+        query = f'SELECT * FROM "{_IMPORT_LOG_TABLE_NAME}" WHERE table_name = ?;'
+        row = database.execute(query, (table_name,)).fetchone()
+    
+    return None if row is None else dict(row)
+
+
+def _check_if_import_is_unchanged(
+        database_filepath,
+        table_name,
+        csv_source,
+        metadata_table_dict
+        ):
+    """Returns True if a table exists and its CSV data and CSVW metadata
+    are unchanged since it was last imported.
+    
+    The source file is compared first by size and modification time, and
+    only if these have changed is the content hash recalculated.
+    
+    """
+    if not _check_if_table_exists_in_database(
+            database_filepath, 
+            table_name
+            ):
+        return False
+    
+    log_entry = _get_import_log_entry(database_filepath, table_name)
+    if log_entry is None:
+        return False
+    
+    if log_entry['metadata_hash'] != _get_metadata_table_hash(metadata_table_dict) \
+        or log_entry['source_filepath'] != os.path.abspath(csv_source['filepath']) \
+        or log_entry['source_member'] != csv_source['member']:
+        return False
+    
+    fingerprint = _get_csv_source_fingerprint(csv_source)
+    
+    if fingerprint['size'] != log_entry['source_size']:
+        return False
+    
+    if fingerprint['mtime'] == log_entry['source_mtime']:
+        return True
+    
+    source_hash = fingerprint['hash'] or _get_file_sha256(csv_source['filepath'])
+    return source_hash == log_entry['source_hash']
+    
+
+def _write_import_log_entry(
+        database_filepath,
+        table_name,
+        csv_source,
+        metadata_table_dict,
+        row_count
+        ):
+    """Records the import of a table in the import log table.
+    
+    The import log has one row per table, which is replaced on each import.
+    The content hash from the previous entry is reused if the source file 
+    size and modification time are unchanged.
+    
+    """
+    fingerprint = _get_csv_source_fingerprint(csv_source)
+    source_filepath = os.path.abspath(csv_source['filepath'])
+    source_hash = fingerprint['hash']
+    
+    if source_hash is None:
+        log_entry = _get_import_log_entry(database_filepath, table_name)
+        if not log_entry is None \
+            and log_entry['source_filepath'] == source_filepath \
+            and log_entry['source_size'] == fingerprint['size'] \
+            and log_entry['source_mtime'] == fingerprint['mtime']:
+            source_hash = log_entry['source_hash']
+        else:
+            source_hash = _get_file_sha256(csv_source['filepath'])
+    
+    with _get_database(database_filepath) as database:
+        database.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS "{_IMPORT_LOG_TABLE_NAME}" (
+                table_name TEXT PRIMARY KEY,
+                source_filepath TEXT,
+                source_member TEXT,
+                source_size INTEGER,
+                source_mtime REAL,
+                source_hash TEXT,
+                metadata_hash TEXT,
+                row_count INTEGER,
+                imported_at TEXT
+                );
+            """
+            )
+        database.execute(
+            f'INSERT OR REPLACE INTO "{_IMPORT_LOG_TABLE_NAME}" VALUES (?,?,?,?,?,?,?,?,?);',
+            (
+                table_name,
+                source_filepath,
+                csv_source['member'],
+                fingerprint['size'],
+                fingerprint['mtime'],
+                source_hash,
+                _get_metadata_table_hash(metadata_table_dict),
+                row_count,
+                datetime.datetime.now(datetime.timezone.utc).isoformat()
+                )
+            )
+
+
+def _check_if_table_exists_in_database(
+        fp_database,
+        table_name
+        ):
+    ""
+    with _get_database(fp_database) as database:
+        return database.table_exists(table_name)
+
+
+def _create_table_from_csvw(
+        metadata_table_dict,
+        fp_database,
+        table_name,
+        primary_key=True,
+        create_indexes=True,
+        verbose=False
+        ):
+    """Creates an empty table from a CSVW table description.
+    
+    :param primary_key: If False, then the PRIMARY KEY constraint is not 
+        added (and the table is not created WITHOUT ROWID), i.e. for a 
+        staging table.
+    :param create_indexes: If False, then the sqlsetindex indexes are not 
+        created, i.e. so they can be built after a bulk load.
+    
+    """
+    # create query
+    conversion_plan = _get_conversion_plan(metadata_table_dict)
+    query=f'CREATE TABLE "{table_name}" ('
+    for column_dict, (sql_datatype, _) in zip(metadata_table_dict['tableSchema']['columns'], conversion_plan):
+        #print(column_dict)
+        name=column_dict['name']
+        query+=f'"{name}" {sql_datatype}'
+        query+=", "
+    query=query[:-2]
+    
+    pk=_get_primary_key(metadata_table_dict)
+    if primary_key and len(pk)>0:
+        
+        query+=', PRIMARY KEY ('
+        for x in pk:
+            query+=f'"{x}"'
+            query+=", "
+        query=query[:-2]
+        query+=') '
+    
+    query+=')'
+    
+    table_options=[]
+    if metadata_table_dict.get('https://purl.org/berg/csvw_functions_extra/vocab/sql_strict',False):
+        table_options.append('STRICT')
+    if primary_key and metadata_table_dict.get('https://purl.org/berg/csvw_functions_extra/vocab/sql_without_rowid',False):
+        table_options.append('WITHOUT ROWID')
+    if len(table_options)>0:
+        query+=' '+', '.join(table_options)
+    
+    query+=';'
+    
+    if verbose:
+        print('---QUERY TO CREATE TABLE---')
+        print(query)
+    
+    # create empty table in database
+    with _get_database(fp_database) as database:
+        database.execute(query)
+        
+    # create indexes
+    if create_indexes:
+        _create_indexes_from_csvw(
+            metadata_table_dict,
+            fp_database,
+            table_name,
+            verbose=verbose
+            )
+        
+
+def _set_table_layout_defaults(
+        metadata_table_dict,
+        sql_strict=False,
+        sql_without_rowid=False,
+        import_method='native'
+        ):
+    """Returns a copy of a CSVW table description with the sql_strict and
+    sql_without_rowid vocabulary set to True, if requested and not already 
+    present, and checks that the table layout can be used. The 
+    sql_without_rowid default only applies to tables with a primaryKey.
+    
+    As the values are part of the table description, a change of table 
+    layout is detected by the incremental import.
+    
+    """
+    result = dict(metadata_table_dict)
+    
+    strict_key = 'https://purl.org/berg/csvw_functions_extra/vocab/sql_strict'
+    without_rowid_key = 'https://purl.org/berg/csvw_functions_extra/vocab/sql_without_rowid'
+    if sql_strict:
+        result.setdefault(strict_key, True)
+    if sql_without_rowid and len(_get_primary_key(result)) > 0:
+        result.setdefault(without_rowid_key, True)
+    strict = result.get(strict_key, False)
+    without_rowid = result.get(without_rowid_key, False)
+    
+    table_name = result['https://purl.org/berg/csvw_functions_extra/vocab/sql_table_name']['@value']
+    
+    if strict and sqlite3.sqlite_version_info < (3, 37, 0):
+        raise Exception(f'STRICT tables require SQLite 3.37.0 or later (this is SQLite {sqlite3.sqlite_version}).')
+    
+    if without_rowid and len(_get_primary_key(result)) == 0:
+        raise Exception(f'Table "{table_name}" has no primaryKey, so it cannot be created WITHOUT ROWID.')
+    
+    if import_method == 'cli' and (strict or without_rowid):
+        raise Exception(f'Table "{table_name}" is STRICT or WITHOUT ROWID, which cannot be imported with import_method="cli".')
+    
+    return result
+
+
+def _create_indexes_from_csvw(
+        metadata_table_dict,
+        fp_database,
+        table_name,
+        verbose=False
+        ):
+    """Creates an index on each column where sqlsetindex is True, if it
+    does not already exist.
+    
+    """
+    with _get_database(fp_database) as database:
+        for column_dict in metadata_table_dict['tableSchema']['columns']:
+            column_name=column_dict['name']
+            setindex=column_dict.get('https://purl.org/berg/csvw_functions_extra/vocab/sqlsetindex',False)
+            if setindex:
+                index_name=_get_index_name(database,table_name,column_name)
+                query=f'CREATE INDEX IF NOT EXISTS "{index_name}" ON "{table_name}"("{column_name}")'
+                if verbose:
+                    print(query)
+                database.execute(query)
+                
+
+def _get_index_name(
+        database,
+        table_name,
+        column_name
+        ):
+    """Returns the name of the sqlsetindex index of a column.
+    
+    The index is named '<table_name>_<column_name>'. As index names are 
+    not changed when a shadow table is renamed, a table and its shadow 
+    table alternate between this name and 
+    '<table_name>__shadow_<column_name>'. An existing index of either name
+    on the table is returned, otherwise the first name not in use.
+    
+    """
+    if table_name.endswith(_SHADOW_TABLE_SUFFIX):
+        base_table_name = table_name[:-len(_SHADOW_TABLE_SUFFIX)]
+    else:
+        base_table_name = table_name
+        
+    index_names = [f'{table_name}_{column_name}']
+    for x in [base_table_name, f'{base_table_name}{_SHADOW_TABLE_SUFFIX}']:
+        if not f'{x}_{column_name}' in index_names:
+            index_names.append(f'{x}_{column_name}')
+            
+    query = f"SELECT name, tbl_name FROM sqlite_master WHERE type='index' AND name IN ({','.join('?' * len(index_names))});"
+    index_tables = {x[0]: x[1] for x in database.execute(query, index_names).fetchall()}
+    
+    for index_name in index_names:
+        if index_tables.get(index_name) == table_name:
+            return index_name
+    
+    for index_name in index_names:
+        if not index_name in index_tables:
+            return index_name
+        
+    raise Exception(f'No index name available for column "{column_name}" of table "{table_name}".')
+    
+
+def _get_primary_key(
+        metadata_table_dict
+        ):
+    """Returns the primary key column names of a CSVW table description as a list.
+    
+    """
+    pk=metadata_table_dict['tableSchema'].get('primaryKey',[])
+    if isinstance(pk,str):
+        pk=[pk]
+    return pk
+                
+
+def _get_conversion_plan(
+        metadata_table_dict
+        ):
+    """Compiles the value conversions for each column of a table from the 
+    CSVW column datatype and null annotations.
+    
+    :returns: A list with one (sql_datatype, converter) tuple per column. 
+        The converter is a function which converts a CSV string value to 
+        the Python value stored in the database, or None if no conversion 
+        is needed. Values which cannot be converted are stored unchanged,
+        as with the SQLite type affinity rules.
+    
+    """
+    result = []
+    
+    for column_dict in metadata_table_dict['tableSchema']['columns']:
+        
+        datatype = column_dict.get('datatype', {'base': 'string'})
+        if isinstance(datatype, str):
+            datatype = {'base': datatype}
+        base = datatype.get('base', 'string')
+        datatype_format = datatype.get('format')
+        
+        null_values = column_dict.get('null', [''])
+        if isinstance(null_values, str):
+            null_values = [null_values]
+        null_values = frozenset(null_values)
+        
+        if base in _INTEGER_DATATYPES:
+            sql_datatype = 'INTEGER'
+            parse_function = int
+            
+        elif base in _REAL_DATATYPES:
+            sql_datatype = 'REAL'
+            parse_function = _get_number_parse_function(datatype_format)
+            
+        elif base == 'boolean':
+            sql_datatype = 'INTEGER'
+            parse_function = _get_boolean_parse_function(datatype_format)
+            
+        elif base in _DATE_TIME_FORMATS and isinstance(datatype_format, str):
+            sql_datatype = 'TEXT'
+            parse_function = _get_date_time_parse_function(base, datatype_format)
+            
+        else:
+            sql_datatype = 'TEXT'
+            parse_function = None
+            
+        result.append(
+            (
+                sql_datatype, 
+                _get_converter(parse_function, null_values)
+                )
+            )
+        
+    return result
+
+
+_INTEGER_DATATYPES = {
+    'integer', 'long', 'int', 'short', 'byte', 
+    'nonNegativeInteger', 'positiveInteger', 
+    'nonPositiveInteger', 'negativeInteger',
+    'unsignedLong', 'unsignedInt', 'unsignedShort', 'unsignedByte'
+    }
+
+_REAL_DATATYPES = {
+    'decimal', 'number', 'double', 'float'
+    }
+
+# the ISO 8601 formats that date and time values are stored in
+_DATE_TIME_FORMATS = {
+    'date': '%Y-%m-%d',
+    'dateTime': '%Y-%m-%dT%H:%M:%S',
+    'datetime': '%Y-%m-%dT%H:%M:%S',
+    'time': '%H:%M:%S'
+    }
+
+
+def _get_converter(
+        parse_function,
+        null_values
+        ):
+    """Returns a converter function for a column, or None if the values
+    can be stored unchanged.
+    
+    Values which are not strings (i.e. already converted by SQLite) are
+    returned unchanged.
+    
+    """
+    if parse_function is None:
+        
+        if len(null_values) == 0:
+            return None
+        
+        def converter(value):
+            return None if value in null_values else value
+        
+    else:
+        
+        def converter(value):
+            if not isinstance(value, str):
+                return value
+            if value in null_values:
+                return None
+            try:
+                return parse_function(value)
+            except ValueError:
+                return value
+    
+    return converter
+
+
+def _get_number_parse_function(
+        datatype_format
+        ):
+    """Returns a function which parses a CSVW decimal, double or float value.
+    
+    """
+    group_char = None
+    decimal_char = None
+    if isinstance(datatype_format, dict):
+        group_char = datatype_format.get('groupChar')
+        decimal_char = datatype_format.get('decimalChar')
+        
+    if group_char is None and (decimal_char is None or decimal_char == '.'):
+        return float
+    
+    def parse_function(value):
+        if not group_char is None:
+            value = value.replace(group_char, '')
+        if not decimal_char is None:
+            value = value.replace(decimal_char, '.')
+        return float(value)
+    
+    return parse_function
+
+
+def _get_boolean_parse_function(
+        datatype_format
+        ):
+    """Returns a function which parses a CSVW boolean value to 1 or 0.
+    
+    :param datatype_format: None, or a string of the form 'true|false', 
+        i.e. 'Y|N'.
+    
+    """
+    if isinstance(datatype_format, str) and '|' in datatype_format:
+        true_value, false_value = datatype_format.split('|', 1)
+        lookup = {true_value: 1, false_value: 0}
+    else:
+        lookup = {'true': 1, '1': 1, 'false': 0, '0': 0}
+        
+    def parse_function(value):
+        try:
+            return lookup[value]
+        except KeyError:
+            raise ValueError(value)
+        
+    return parse_function
+
+
+def _get_date_time_parse_function(
+        base,
+        datatype_format
+        ):
+    """Returns a function which parses a CSVW date, dateTime or time value
+    with a format pattern (i.e. 'dd/MM/yyyy') to an ISO 8601 string.
+    
+    Only the yyyy, MM, M, dd, d, HH, mm and ss fields are supported; values
+    with other patterns are stored unchanged.
+    
+    """
+    field_map = {
+        'yyyy': '%Y', 'MM': '%m', 'M': '%m', 'dd': '%d', 'd': '%d',
+        'HH': '%H', 'mm': '%M', 'ss': '%S'
+        }
+    pattern = re.sub(
+        r'yyyy|MM|M|dd|d|HH|mm|ss', 
+        lambda m: field_map[m.group()], 
+        datatype_format.replace('%', '%%')
+        )
+    if re.search(r'[A-Za-z]', re.sub(r'%[A-Za-z%]', '', pattern.replace('T', ''))):
+        return None
+    
+    iso_format = _DATE_TIME_FORMATS[base]
+    
+    def parse_function(value):
+        return datetime.datetime.strptime(value, pattern).strftime(iso_format)
+    
+    return parse_function
+
+
+def _convert_batch(
+        batch,
+        conversion_plan
+        ):
+    """Converts the values of a batch of CSV rows (lists) in place.
+    
+    """
+    converters = [
+        (i, converter) 
+        for i, (_, converter) in enumerate(conversion_plan) 
+        if not converter is None
+        ]
+    for row in batch:
+        for i, converter in converters:
+            row[i] = converter(row[i])
+    return batch
+
+
+def _drop_table(
+        fp_database,
+        table_name,
+        verbose=False
+        ):
+    ""
+    with _get_database(fp_database) as database:
+        database.drop_table(table_name, verbose=verbose)
+        for codes_table_name in database._get_codes_table_names(table_name).values():
+            database.drop_table(codes_table_name)
+        _delete_import_progress_entry(database, table_name)
+    _remove_columnar_table_folder(
+        _get_columnar_table_folder(fp_database, table_name)
+        )
+
+
+def _get_import_info(
+        metadata_table_dict,
+        data_folder,
+        verbose=False,
+        ):
+    ""
+    # get info for importing
+    csv_file_name=metadata_table_dict['https://purl.org/berg/csvw_functions_extra/vocab/csv_file_name']['@value']
+    if verbose:
+        print('csv_file_name:',csv_file_name)
+    table_name=metadata_table_dict['https://purl.org/berg/csvw_functions_extra/vocab/sql_table_name']['@value']
+    if verbose:
+        print('table_name:',table_name)
+    url=metadata_table_dict['url']
+    if verbose:
+        print('url',url)
+    fp_csv=os.path.join(data_folder,url)
+    if verbose:
+        print('fp_csv:', fp_csv)
+    remove_existing_table=metadata_table_dict.get(
+        "https://purl.org/berg/csvw_functions_extra/vocab/sql_remove_existing_table",
+        False
+        )
+    
+    return csv_file_name,table_name, fp_csv, remove_existing_table
+    
+
+def _get_csv_source(
+        fp_csv,
+        metadata_table_dict,
+        data_folder
+        ):
+    """Locates the CSV data of a table in the data_folder.
+    
+    The CSV data is read from (in order of preference):
+        - the CSV file fp_csv (which may be gzip compressed if it ends 
+          with '.gz').
+        - a gzip compressed version of the CSV file, named fp_csv + '.gz'.
+        - the ZIP file given by the zip_file_name vocabulary, using the 
+          csv_zip_extract_path vocabulary.
+    
+    :returns: A dictionary with keys 'type' ('csv', 'gzip' or 'zip'), 
+        'filepath' and 'member' (the path in the ZIP file, or None).
+    
+    """
+    if os.path.exists(fp_csv):
+        source_type = 'gzip' if fp_csv.endswith('.gz') else 'csv'
+        return dict(type=source_type, filepath=fp_csv, member=None)
+    
+    if os.path.exists(f'{fp_csv}.gz'):
+        return dict(type='gzip', filepath=f'{fp_csv}.gz', member=None)
+    
+    zip_file_name=metadata_table_dict.get('https://purl.org/berg/csvw_functions_extra/vocab/zip_file_name',{'@value':None})['@value']
+    csv_zip_extract_path=metadata_table_dict.get('https://purl.org/berg/csvw_functions_extra/vocab/csv_zip_extract_path',{'@value':None})['@value']
+    
+    if not zip_file_name is None and not csv_zip_extract_path is None:
+        fp_zip = os.path.join(data_folder,zip_file_name)
+        if os.path.exists(fp_zip):
+            return dict(type='zip', filepath=fp_zip, member=csv_zip_extract_path)
+    
+    raise Exception(f'No CSV data found for "{fp_csv}".')
+    
+    
+class _CountingReader(io.RawIOBase):
+    """A raw binary stream which counts the bytes read from a file object.
+    
+    """
+    
+    def __init__(self, f):
+        ""
+        self._f = f
+        self.bytes_read = 0
+        
+        
+    def readable(self):
+        ""
+        return True
+    
+    
+    def readinto(self, b):
+        ""
+        n = self._f.readinto(b)
+        self.bytes_read += n
+        return n
+    
+    
+@contextlib.contextmanager
+def _open_csv_source(
+        csv_source
+        ):
+    """Opens the CSV data located by _get_csv_source as a text file object.
+    
+    :yields: A (f, counter) tuple, where f is the text file object and 
+        counter is a _CountingReader whose bytes_read value is the number of
+        bytes read so far from the file (for a gzip file, the compressed 
+        bytes) or ZIP file member (the uncompressed bytes).
+    
+    """
+    if csv_source['type'] == 'zip':
+        
+        with zipfile.ZipFile(csv_source['filepath']) as z:
+            with z.open(csv_source['member']) as f_zip:
+                counter = _CountingReader(f_zip)
+                with io.TextIOWrapper(io.BufferedReader(counter), encoding='utf-8-sig', newline='') as f:
+                    yield f, counter
+                    
+    elif csv_source['type'] == 'gzip':
+        
+        with open(csv_source['filepath'], 'rb', buffering=0) as f_gzip:
+            counter = _CountingReader(f_gzip)
+            with gzip.open(io.BufferedReader(counter), 'rt', encoding='utf-8-sig', newline='') as f:
+                yield f, counter
+            
+    else:
+        
+        with open(csv_source['filepath'], 'rb', buffering=0) as f_csv:
+            counter = _CountingReader(f_csv)
+            with io.TextIOWrapper(io.BufferedReader(counter), encoding='utf-8-sig', newline='') as f:
+                yield f, counter
+    
+    
+def _get_csv_source_size(
+        csv_source
+        ):
+    """Returns the total number of bytes which _open_csv_source will read.
+    
+    """
+    if csv_source['type'] == 'zip':
+        with zipfile.ZipFile(csv_source['filepath']) as z:
+            return z.getinfo(csv_source['member']).file_size
+    else:
+        return os.path.getsize(csv_source['filepath'])
+    
+    
+def _get_row_count_in_database_table(
+        fp_database,
+        table_name,
+        column_name='*'
+        ):
+    """Gets number of rows in table
+    
+    """
+    with _get_database(fp_database) as database:
+        query=f'SELECT COUNT({column_name}) FROM "{table_name}"'
+        return database.execute(query).fetchone()[0]
+    
+        
+def _import_csv_file(
+        csv_source,
+        database_filepath,
+        table_name,
+        conversion_plan=None,
+        import_method='native',
+        import_pragmas=None,
+        batch_size=10000,
+        commit_interval=None,
+        progress_callback=None,
+        resume=False,
+        verbose=False
+        ):
+    """Imports CSV data into an existing database table.
+    
+    :param csv_source: The location of the CSV data, as returned by 
+        _get_csv_source.
+    :param conversion_plan: The column conversions, as returned by 
+        _get_conversion_plan. If None, then the CSV values are inserted as
+        strings.
+    :param commit_interval, progress_callback, resume: Options of the 
+        native import method. See _import_csv_file_native.
+    
+    :returns: The number of rows imported.
+    
+    """
+    if import_method == 'native':
+        
+        rows_imported = \
+            _import_csv_file_native(
+                csv_source,
+                database_filepath,
+                table_name,
+                conversion_plan=conversion_plan,
+                import_pragmas=import_pragmas,
+                batch_size=batch_size,
+                commit_interval=commit_interval,
+                progress_callback=progress_callback,
+                resume=resume,
+                verbose=verbose
+                )
+        
+    elif import_method == 'cli':
+        
+        if csv_source['type'] != 'csv':
+            raise Exception('The sqlite3 command line import can only read uncompressed CSV files.')
+        
+        rows_imported = \
+            _import_csv_file_cli(
+                csv_source['filepath'],
+                database_filepath,
+                table_name,
+                conversion_plan=conversion_plan,
+                verbose=verbose
+                )
+        
+    else:
+        
+        raise Exception(f'Unknown import_method "{import_method}".')
+        
+    if verbose:
+        print('Number of rows imported: ', rows_imported)
+        print('Number of rows after import: ', _get_row_count_in_database_table(database_filepath,table_name))
+        
+    return rows_imported
+        
+
+def _import_csv_file_with_deferred_indexes(
+        csv_source,
+        metadata_table_dict,
+        database_filepath,
+        table_name,
+        sort_by_primary_key=False,
+        import_method='native',
+        import_pragmas=None,
+        batch_size=10000,
+        commit_interval=None,
+        progress_callback=None,
+        verbose=False
+        ):
+    """Imports CSV data into a new database table, building the indexes 
+    after the data is loaded.
+    
+    If sort_by_primary_key is True and the table has a primary key, then 
+    the data is loaded into an unindexed staging table and copied into the 
+    final table in primary key order in a single INSERT ... SELECT 
+    statement. The sqlsetindex indexes are then created and the table is 
+    analyzed.
+    
+    :returns: The number of rows imported.
+    
+    """
+    pk = _get_primary_key(metadata_table_dict)
+    
+    _create_table_from_csvw(
+        metadata_table_dict, 
+        database_filepath, 
+        table_name,
+        create_indexes=False,
+        verbose=verbose
+        )
+    
+    if len(pk) == 0 or not sort_by_primary_key:
+        
+        load_table_name = table_name
+        
+    else:
+        
+        load_table_name = f'{table_name}__staging'
+        _drop_table(database_filepath, load_table_name)
+        _create_table_from_csvw(
+            metadata_table_dict, 
+            database_filepath, 
+            load_table_name,
+            primary_key=False,
+            create_indexes=False,
+            verbose=verbose
+            )
+        
+    try:
+        
+        rows_imported = \
+            _import_csv_file(
+                csv_source,
+                database_filepath,
+                load_table_name,
+                conversion_plan=_get_conversion_plan(metadata_table_dict),
+                import_method=import_method,
+                import_pragmas=import_pragmas,
+                batch_size=batch_size,
+                commit_interval=commit_interval,
+                progress_callback=progress_callback,
+                verbose=verbose
+                )
+        
+        if load_table_name != table_name:
+            
+            _copy_table_rows(
+                database_filepath,
+                table_name,
+                source_table_name=load_table_name,
+                order_by=pk,
+                verbose=verbose
+                )
+                
+    finally:
+        
+        if load_table_name != table_name:
+            _drop_table(database_filepath, load_table_name)
+            
+    _create_indexes_from_csvw(
+        metadata_table_dict,
+        database_filepath,
+        table_name,
+        verbose=verbose
+        )
+    
+    _analyze_table(database_filepath, table_name)
+    
+    return rows_imported
+    
+
+def _import_csv_file_cli(
+        fp_csv,
+        database_filepath,
+        table_name,
+        conversion_plan=None,
+        verbose=False
+        ):
+    """Imports a CSV file using the sqlite3 command line tool.
+    
+    The sqlite3 '.import' command inserts the values as strings, so the 
+    conversion plan is applied afterwards to the newly imported rows 
+    using an UPDATE statement.
+    
+    :returns: The number of rows imported.
+    
+    """                
+    with _get_database(database_filepath) as database:
+        rows_before = _get_row_count_in_database_table(database,table_name)
+        max_rowid_before = database.execute(f'SELECT MAX(rowid) FROM "{table_name}"').fetchone()[0] or 0
+        fp_database = database.database_filepath
+    fp_csv2=fp_csv.replace('\\','\\\\')
+    command=[
+        'sqlite3', 
+        fp_database, 
+        '-cmd', 
+        '.mode csv', 
+        f'.import --skip 1 "{fp_csv2}" "{table_name}"'
+        ]
+    if verbose:
+        print('COMMAND LINE', command)
+    subprocess.run(command, check=True)
+    
+    if not conversion_plan is None:
+        _convert_table_rows(
+            database_filepath,
+            table_name,
+            conversion_plan,
+            min_rowid=max_rowid_before,
+            verbose=verbose
+            )
+    
+    return _get_row_count_in_database_table(database_filepath,table_name) - rows_before
+
+
+def _convert_table_rows(
+        database_filepath,
+        table_name,
+        conversion_plan,
+        min_rowid=0,
+        verbose=False
+        ):
+    """Applies a conversion plan to the rows of a database table which have
+    a rowid greater than min_rowid.
+    
+    """
+    with _get_database(database_filepath) as database:
+        
+        conn = database.connection
+        column_names = database.get_field_names(table_name)
+        
+        set_strings = []
+        for i, (column_name, (_, converter)) in enumerate(zip(column_names, conversion_plan)):
+            if not converter is None:
+                conn.create_function(f'_csvw_convert_{i}', 1, converter, deterministic=True)
+                set_strings.append(f'"{column_name}" = _csvw_convert_{i}("{column_name}")')
+                
+        if len(set_strings) == 0:
+            return
+                
+        query = f'UPDATE "{table_name}" SET {", ".join(set_strings)} WHERE rowid > ?;'
+        if verbose:
+            print(query)
+        conn.execute(query, (min_rowid,))
+
+
+def _import_csv_file_native(
+        csv_source,
+        database_filepath,
+        table_name,
+        conversion_plan=None,
+        import_pragmas=None,
+        batch_size=10000,
+        commit_interval=None,
+        progress_callback=None,
+        resume=False,
+        verbose=False
+        ):
+    """Imports CSV data using the Python csv module.
+    
+    The rows are streamed from the CSV source (which can be a ZIP or gzip
+    file), converted using the conversion plan and inserted with 
+    executemany in batches of batch_size rows. As with the sqlite3 
+    '.import' command, the header row is skipped, short rows are padded 
+    with NULL values and long rows are truncated.
+    
+    If commit_interval is None then all rows are inserted in a single 
+    transaction. Otherwise the rows are committed every commit_interval 
+    rows, and the number of rows committed is recorded in the import 
+    progress table in the same transaction. If resume is True, then the 
+    rows already committed by a previous, interrupted import are skipped.
+    
+    :returns: The number of rows from the CSV source in the table, which 
+        includes any rows committed by a previous import if resuming.
+    
+    """
+    pragmas = {
+        'synchronous': 'OFF',
+        'cache_size': -65536,
+        'temp_store': 'MEMORY'
+        }
+    pragmas.update(import_pragmas or {})
+    
+    rows_imported = 0
+    
+    with _get_database(database_filepath) as database:
+        
+        skip_rows = 0
+        if resume:
+            skip_rows = \
+                _get_import_progress_rows_committed(
+                    database, 
+                    table_name, 
+                    csv_source
+                    )
+            if verbose:
+                print('Resuming import after row', skip_rows)
+                
+        if not commit_interval is None:
+            _create_import_progress_table(database)
+        
+        conn = database.connection
+        
+        # the pragmas are restored after the import, as the connection
+        # may be shared
+        previous_pragmas = {}
+        for k in pragmas:
+            row = conn.execute(f'PRAGMA {k};').fetchone()
+            if not row is None:
+                previous_pragmas[k] = row[0]
+        
+        try:
+            
+            for k, v in pragmas.items():
+                conn.execute(f'PRAGMA {k}={v};')
+            
+            rows_imported = \
+                _insert_csv_rows(
+                    database,
+                    csv_source,
+                    table_name,
+                    conversion_plan=conversion_plan,
+                    batch_size=batch_size,
+                    commit_interval=commit_interval,
+                    progress_callback=progress_callback,
+                    skip_rows=skip_rows,
+                    verbose=verbose
+                    )
+            
+        finally:
+            
+            for k, v in previous_pragmas.items():
+                conn.execute(f'PRAGMA {k}={v};')
+        
+    return rows_imported
+
+
+def _insert_csv_rows(
+        database,
+        csv_source,
+        table_name,
+        conversion_plan=None,
+        batch_size=10000,
+        commit_interval=None,
+        progress_callback=None,
+        skip_rows=0,
+        verbose=False
+        ):
+    """Inserts the rows of a CSV source into a table.
+    
+    Only one batch of rows is held in memory at a time. The progress 
+    callback is called after each batch with an 'import_progress' event 
+    dictionary.
+    
+    :param database: A CsvwDatabase object.
+    :param skip_rows: The number of CSV rows (after the header row) to 
+        read without inserting, i.e. those committed by an earlier import.
+    
+    :returns: The number of rows from the CSV source in the table, 
+        including the skipped rows.
+    
+    """
+    conn = database.connection
+    
+    rows_done = skip_rows
+    rows_committed = skip_rows
+    start_time = time.perf_counter()
+    total_bytes = _get_csv_source_size(csv_source)
+    fingerprint = _get_csv_source_fingerprint(csv_source)
+    
+    def commit():
+        if not commit_interval is None:
+            _write_import_progress_entry(
+                database,
+                table_name,
+                csv_source,
+                fingerprint,
+                rows_done
+                )
+        conn.execute('COMMIT;')
+    
+    try:
+        
+        n = len(conn.execute(f'PRAGMA table_info("{table_name}");').fetchall())
+        query = f'INSERT INTO "{table_name}" VALUES ({",".join(["?"] * n)});'
+        if verbose:
+            print(query)
+            
+        with _open_csv_source(csv_source) as (f, counter):
+            
+            reader = csv.reader(f)
+            next(reader, None)  # skip header row
+            
+            # skip rows already committed
+            for _ in itertools.islice(reader, skip_rows):
+                pass
+            
+            conn.execute('BEGIN;')
+            
+            while True:
+                
+                batch = [
+                    row if len(row) == n else row[:n] + [None] * (n - len(row))
+                    for row in itertools.islice(reader, batch_size)
+                    ]
+                if len(batch) == 0:
+                    break
+                
+                if not conversion_plan is None:
+                    _convert_batch(batch, conversion_plan)
+                
+                conn.executemany(query, batch)
+                rows_done += len(batch)
+                
+                if not commit_interval is None \
+                    and rows_done - rows_committed >= commit_interval:
+                    commit()
+                    rows_committed = rows_done
+                    conn.execute('BEGIN;')
+                    
+                if not progress_callback is None:
+                    elapsed = time.perf_counter() - start_time
+                    progress_callback(
+                        dict(
+                            event='import_progress',
+                            table_name=table_name,
+                            rows=rows_done,
+                            rows_committed=rows_committed,
+                            bytes=counter.bytes_read,
+                            total_bytes=total_bytes,
+                            elapsed=elapsed,
+                            rows_per_second=\
+                                (rows_done - skip_rows) / elapsed if elapsed > 0 else None
+                            )
+                        )
+                    
+        _delete_import_progress_entry(database, table_name)
+        conn.execute('COMMIT;')
+        
+    except BaseException:
+        
+        if conn.in_transaction:
+            conn.execute('ROLLBACK;')
+        raise
+        
+    return rows_done
+
+
+_IMPORT_PROGRESS_TABLE_NAME = '_csvw_functions_extra_import_progress'
+
+
+def _create_import_progress_table(
+        database
+        ):
+    """Creates the import progress table, if it does not exist.
+    
+    The table has one row for each table with a chunked import in progress,
+    recording the number of CSV rows committed so far.
     
-    :param verbose: If True, then this function prints intermediate variables
-        and other useful information.
-    :type verbose: bool
+    """
+    database.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS "{_IMPORT_PROGRESS_TABLE_NAME}" (
+            table_name TEXT PRIMARY KEY,
+            source_filepath TEXT,
+            source_member TEXT,
+            source_size INTEGER,
+            source_mtime REAL,
+            rows_committed INTEGER
+            );
+        """
+        )
+    
+    
+def _write_import_progress_entry(
+        database,
+        table_name,
+        csv_source,
+        fingerprint,
+        rows_committed
+        ):
+    """Records the number of CSV rows committed for a table.
+    
+    """
+    database.execute(
+        f'INSERT OR REPLACE INTO "{_IMPORT_PROGRESS_TABLE_NAME}" VALUES (?,?,?,?,?,?);',
+        (
+            table_name,
+            os.path.abspath(csv_source['filepath']),
+            csv_source['member'],
+            fingerprint['size'],
+            fingerprint['mtime'],
+            rows_committed
+            )
+        )
+    
+    
+def _delete_import_progress_entry(
+        database,
+        table_name
+        ):
+    """Removes the import progress entry of a table, if present.
+    
+    """
+    if database.table_exists(_IMPORT_PROGRESS_TABLE_NAME):
+        database.execute(
+            f'DELETE FROM "{_IMPORT_PROGRESS_TABLE_NAME}" WHERE table_name = ?;',
+            (table_name,)
+            )
+        
+
+def _get_import_progress_rows_committed(
+        database_filepath,
+        table_name,
+        csv_source
+        ):
+    """Returns the number of CSV rows committed by an interrupted chunked 
+    import of a table, or 0 if there is no import in progress.
+    
+    Raises an exception if the CSV source has changed since the 
+    interrupted import.
+    
+    """
+    with _get_database(database_filepath) as database:
+        
+        if not database.table_exists(_IMPORT_PROGRESS_TABLE_NAME) \
+            or not database.table_exists(table_name):
+            return 0
+        
+        row = database.execute(
+            f'SELECT * FROM "{_IMPORT_PROGRESS_TABLE_NAME}" WHERE table_name = ?;',
+            (table_name,)
+            ).fetchone()
+        
+    if row is None:
+        return 0
+    
+    fingerprint = _get_csv_source_fingerprint(csv_source)
+    if row['source_filepath'] != os.path.abspath(csv_source['filepath']) \
+        or row['source_member'] != csv_source['member'] \
+        or row['source_size'] != fingerprint['size'] \
+        or row['source_mtime'] != fingerprint['mtime']:
+        raise Exception(
+            f'The CSV data for table "{table_name}" has changed since the '
+            'interrupted import. Use overwrite_existing_tables=True to import it again.'
+            )
+    
+    return row['rows_committed']
+
+
+
+      
+        
+#%% database functions
+
+class CsvwDatabase():
+    """A connection to a SQLite database which is shared by the database 
+    functions.
+    
+    The connection is opened when first used (or by `connect` or by
+    entering a `with` block) and is kept open until `close` is called. It 
+    is in autocommit mode and returns sqlite3.Row objects.
+    
+    The database functions of this module accept either a database 
+    filepath, in which case they open and close their own connection, or 
+    a CsvwDatabase object, in which case its connection is used.
+    
+    Example::
+        
+        with CsvwDatabase('data.sqlite', pragmas={'journal_mode': 'WAL'}) as db:
+            db.import_table_group(metadata_filepath)
+            rows = db.get_rows('table1', filter_by={'id': 1})
+    
+    :param database_filepath: The filepath of the SQLite database.
+    :type database_filepath: str
+    
+    :param pragmas: SQLite PRAGMA statements to run when the connection is
+        opened, i.e. {'journal_mode': 'WAL', 'mmap_size': 268435456, 
+        'cache_size': -65536}.
+    :type pragmas: dict
+    
+    :param result_cache_size: If given, the results of `get_rows` and 
+        `get_row_count` are kept in a least recently used cache of up to 
+        this number of queries. The cache is emptied whenever the 
+        database changes.
+    :type result_cache_size: int
+    
+    :param result_cache_max_bytes: The approximate maximum memory used by 
+        the result cache. Results larger than this are not cached.
+    :type result_cache_max_bytes: int
+    
+    """
+    
+    def __init__(
+            self,
+            database_filepath,
+            pragmas=None,
+            result_cache_size=None,
+            result_cache_max_bytes=None
+            ):
+        ""
+        self.database_filepath = database_filepath
+        self.pragmas = dict(pragmas or {})
+        self._connection = None
+        self._temp_table_changes = 0  # see _get_result_cache_version
+        self._result_cache = \
+            None if not result_cache_size else \
+            _ResultCache(result_cache_size, result_cache_max_bytes)
+        
+        
+    def __repr__(self):
+        ""
+        return f'CsvwDatabase({self.database_filepath!r})'
+        
+        
+    def __enter__(self):
+        ""
+        return self.connect()
+    
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        ""
+        self.close()
+        
+        
+    @property
+    def connection(self):
+        """The sqlite3.Connection object, which is opened if needed.
+        
+        """
+        if self._connection is None:
+            self.connect()
+        return self._connection
+    
+    
+    def connect(self):
+        """Opens the connection, if not already open.
+        
+        :returns: self
+        
+        """
+        if self._connection is None:
+            conn = sqlite3.connect(self.database_filepath, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            for k, v in self.pragmas.items():
+                conn.execute(f'PRAGMA {k}={v};')
+            self._connection = conn
+        return self
+    
+    
+    def close(self):
+        """Closes the connection, if open.
+        
+        """
+        if not self._connection is None:
+            self._connection.close()
+            self._connection = None
+        self._temp_table_changes = 0
+        self.clear_result_cache()  # total_changes restarts with a new connection
+            
+            
+    def execute(
+            self,
+            query,
+            parameters=()
+            ):
+        """Executes a SQL statement and returns the cursor.
+        
+        """
+        return self.connection.execute(query, parameters)
+    
+    
+    def clear_result_cache(self):
+        """Removes all results from the result cache, if used.
+        
+        """
+        if not self._result_cache is None:
+            self._result_cache.clear()
+            
+            
+    def get_result_cache_info(self):
+        """Returns the hits, misses, entries and approximate size in bytes 
+        of the result cache as a dictionary, or None if no result cache 
+        is used.
+        
+        """
+        if self._result_cache is None:
+            return None
+        return self._result_cache.get_info()
+            
+            
+    def _fetch_all(
+            self,
+            query,
+            parameters=(),
+            use_result_cache=True
+            ):
+        """Runs a query and returns the result as a list of dictionaries, 
+        using the result cache if there is one.
+        
+        Cached results are checked against `_get_result_cache_version`. 
+        Copies of the cached dictionaries are returned, so that callers can
+        change them.
+        
+        """
+        cache = self._result_cache
+        
+        if cache is None or not use_result_cache:
+            return [dict(x) for x in self.execute(query, parameters).fetchall()]
+        
+        key = (query, tuple(parameters))
+        
+        version = self._get_result_cache_version()
+        
+        result = cache.get(key, version)
+        
+        if result is None:
+            result = [dict(x) for x in self.execute(query, parameters).fetchall()]
+            cache.put(key, version, result)
+            
+        return [dict(x) for x in result]
+    
+    
+    def _get_result_cache_version(self):
+        """Returns the values which change when the database changes: 
+        PRAGMA data_version (which changes when another connection 
+        commits), PRAGMA schema_version and the total changes made by this
+        connection, excluding changes to the temporary filter tables.
+        
+        """
+        conn = self.connection
+        return (
+            tuple(conn.execute(
+                'SELECT * FROM pragma_data_version, pragma_schema_version;'
+                ).fetchone()),
+            conn.total_changes - self._temp_table_changes
+            )
+    
+    
+    def _fetch_columns(
+            self,
+            query,
+            parameters=(),
+            result_format='columns',
+            batch_size=10000
+            ):
+        """Runs a query and returns the result as a dictionary of columns,
+        with the field names as keys.
+        
+        The rows are fetched batch_size rows at a time and each batch is 
+        added to the columns directly from the cursor's tuples, without 
+        creating a dictionary per row. A column is an array.array of type 
+        'q' (int64) if all its values are integers, of type 'd' (float64) 
+        if all its values are integers or real numbers and otherwise a 
+        list. If result_format is 'numpy', then the columns are converted 
+        to NumPy arrays (without copying the array.array columns).
+        
+        """
+        np = _import_numpy() if result_format == 'numpy' else None
+        
+        cursor = self.connection.cursor()
+        cursor.row_factory = None
+        
+        try:
+            
+            cursor.execute(query, parameters)
+            field_names = [x[0] for x in cursor.description]
+            columns = [array.array('q') for _ in field_names]
+            
+            while True:
+                
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                
+                for i, values in enumerate(zip(*rows)):
+                    columns[i] = _extend_result_column(columns[i], values)
+                    
+        finally:
+            
+            cursor.close()
+            
+        if not np is None:
+            columns = [
+                np.frombuffer(x, dtype=np.int64 if x.typecode == 'q' else np.float64)
+                if isinstance(x, array.array)
+                else np.array(x, dtype=object)
+                for x in columns
+                ]
+            
+        return dict(zip(field_names, columns))
+    
+    
+    def table_exists(
+            self,
+            table_name
+            ):
+        """Returns True if the table exists in the database.
+        
+        """
+        query="SELECT count(*) FROM sqlite_master WHERE type='table' AND name=?;"
+        return True if self.execute(query, (table_name,)).fetchone()[0] else False
+    
+    
+    def drop_table(
+            self,
+            table_name,
+            verbose=False
+            ):
+        """Removes a table from the database, if it exists.
+        
+        """
+        query=f'DROP TABLE IF EXISTS "{table_name}";'
+        if verbose:
+            print(query)
+        self.execute(query)
+        
+        
+    def add_index(
+            self,
+            fields,
+            table_name,
+            unique=False,
+            verbose=False
+            ):
+        """Adds an index to a column or columns. See `add_index`.
+        
+        """
+        fields=convert_to_iterator(fields)
+        fields_string='__'.join(fields)
+        
+        if unique:
+            unique_string='UNIQUE'
+        else:
+            unique_string=''
+        
+        index_name=f'index__{table_name}__{fields_string}'
+        if unique:
+            index_name=f'{index_name}__UNIQUE'
+        
+        if verbose:
+            print('index_name',index_name)
+            
+        column_list='","'.join(fields)
+        column_list=f'"{column_list}"'
+            
+        query=f"""
+            CREATE {unique_string} INDEX "{index_name}" 
+            ON "{table_name}"({column_list});
+        """
+        if verbose:
+            print(query)
+            
+        try:
+            
+            self.execute(query)
+                
+        except sqlite3.OperationalError:
+            
+            if verbose:
+                print('Index not created - already exists in table')
+                
+                
+    def get_all_table_names(self):
+        """Returns the names of all tables in the database.
+        
+        """
+        result = self.execute('SELECT name FROM sqlite_master WHERE type="table"').fetchall()
+        return [x[0] for x in result]
+    
+    
+    def get_field_names(
+            self,
+            table_name,
+            verbose=False
+            ):
+        """Returns the field names of a table.
+        
+        """
+        query=f'PRAGMA table_info("{table_name}");'
+        if verbose:
+            print(query)
+        return [x[1] for x in self.execute(query).fetchall()]
+    
+    
+    def get_row_count(
+            self,
+            table_name,
+            filter_by=None,
+            group_by=None,
+            verbose=False
+            ):
+        """Returns the number of rows in a table. See `get_row_count`.
+        
+        """
+        where_string, parameters, temp_table_names = \
+            self._get_where_clause(
+                table_name,
+                filter_by
+                )
+        if verbose:
+            print('where_string', where_string)
+            print('parameters', parameters)
+            
+        group_by_fields, group_by_string = \
+            get_group_by_string(
+                group_by
+                )
+        if verbose:
+            print('group_by_fields',group_by_fields)
+            print('group_by_string',group_by_string)
+            
+        query=f"""
+            SELECT 
+                {group_by_fields} COUNT(*) AS COUNT
+            FROM 
+                {table_name} 
+            {where_string}
+            {group_by_string}
+            """
+            
+        if verbose:
+            print(query)
+                
+        try:
+            return self._fetch_all(
+                query, 
+                parameters, 
+                use_result_cache=not temp_table_names  # unique table names
+                )
+        finally:
+            self._drop_temp_tables(temp_table_names)
+    
+    
+    def get_rows(
+            self,
+            table_name,
+            filter_by = None,  # a dict
+            fields = None,  # or a list of field names
+            limit = None,
+            replace_codes = False,
+            metadata_filename = None,  # only used for tables imported without code lookup tables
+            result_format = 'rows',
+            verbose = False
+            ):
+        """Returns the rows of a table as a list of dictionaries, or as 
+        columns. See `get_rows`.
+        
+        """
+        _check_result_format(result_format)
+        
+        field_string, field_parameters = \
+            self._get_select_field_string(
+                table_name,
+                fields,
+                replace_codes,
+                metadata_filepath = metadata_filename
+                )
+        
+        where_string, parameters, temp_table_names = \
+            self._get_where_clause(
+                table_name,
+                filter_by
+                )
+        
+        query, parameters = \
+            _get_rows_query(
+                table_name,
+                field_string,
+                where_string,
+                field_parameters + parameters,
+                limit=limit,
+                verbose=verbose
+                )
+            
+        # get data
+        try:
+            if result_format == 'rows':
+                result=self._fetch_all(
+                    query, 
+                    parameters, 
+                    use_result_cache=not temp_table_names  # unique table names
+                    )
+            else:
+                result=self._fetch_columns(
+                    query,
+                    parameters,
+                    result_format
+                    )
+        finally:
+            self._drop_temp_tables(temp_table_names)
+                    
+        return result
+    
+    
+    def iter_rows(
+            self,
+            table_name,
+            filter_by = None,
+            fields = None,
+            limit = None,
+            replace_codes = False,
+            batch_size = 1000,
+            row_format = 'dict',
+            verbose = False
+            ):
+        """Yields the rows of a table, fetching batch_size rows at a time. 
+        See `iter_rows`.
+        
+        """
+        if not row_format in _ROW_FORMATS:
+            raise Exception(
+                f'row_format must be one of {_ROW_FORMATS}, not "{row_format}".'
+                )
+        
+        field_string, _ = \
+            self._get_select_field_string(
+                table_name,
+                fields,
+                replace_codes
+                )
+        
+        return self._iter_rows(
+            table_name,
+            field_string,
+            filter_by,
+            limit,
+            batch_size,
+            row_format,
+            verbose
+            )
+    
+    
+    def _iter_rows(
+            self,
+            table_name,
+            field_string,
+            filter_by,
+            limit,
+            batch_size,
+            row_format,
+            verbose
+            ):
+        """The generator returned by `iter_rows`.
+        
+        Any temporary tables for long filter_by lists are created when the
+        first row is requested, and removed when the generator is 
+        exhausted or closed, so a generator which is never started leaves 
+        no temporary tables.
+        
+        """
+        where_string, parameters, temp_table_names = \
+            self._get_where_clause(
+                table_name,
+                filter_by
+                )
+        
+        try:
+            
+            query, parameters = \
+                _get_rows_query(
+                    table_name,
+                    field_string,
+                    where_string,
+                    parameters,
+                    limit=limit,
+                    verbose=verbose
+                    )
+            
+            yield from _iter_cursor_rows(
+                self.connection.cursor(),
+                query,
+                parameters,
+                batch_size,
+                row_format
+                )
+            
+        finally:
+            
+            self._drop_temp_tables(temp_table_names)
+    
+    
+    def iter_sql(
+            self,
+            sql_query,
+            parameters = (),
+            batch_size = 1000,
+            row_format = 'dict',
+            verbose = False
+            ):
+        """Runs a SQL query and yields the result rows, fetching batch_size 
+        rows at a time. See `iter_sql`.
+        
+        """
+        if not row_format in _ROW_FORMATS:
+            raise Exception(
+                f'row_format must be one of {_ROW_FORMATS}, not "{row_format}".'
+                )
+        
+        if verbose:
+            print(sql_query)
+            
+        return _iter_cursor_rows(
+            self.connection.cursor(),
+            sql_query,
+            parameters,
+            batch_size,
+            row_format
+            )
+        
+        
+    def _get_codes_table_names(
+            self,
+            table_name
+            ):
+        """Returns the names of the code lookup tables of a table as a 
+        dictionary with the column names as keys.
+        
+        """
+        prefix = _get_codes_table_name(table_name, '')
+        query = "SELECT name FROM sqlite_master WHERE type='table' AND substr(name, 1, ?) = ?;"
+        return {
+            x[0][len(prefix):]: x[0] 
+            for x in self.execute(query, (len(prefix), prefix)).fetchall()
+            }
+    
+    
+    def _get_select_field_string(
+            self,
+            table_name,
+            fields,
+            replace_codes,
+            metadata_filepath = None
+            ):
+        """Returns the fields of a SELECT statement and their parameters. 
+        If replace_codes is True, the values of columns with a code lookup 
+        table are replaced by their labels.
+        
+        If the table has no code lookup tables (i.e. it was imported before
+        they were written) and metadata_filepath is given, the codes of the
+        metadata file are used instead, as bound parameters of a VALUES 
+        subquery, so that nothing is written to the database.
+        
+        """
+        if not replace_codes:
+            return get_field_string(fields), ()
+        
+        codes_table_names = self._get_codes_table_names(table_name)
+        
+        if len(codes_table_names) == 0 and not metadata_filepath is None:
+            codes = _get_codes(
+                get_metadata_table_dict(
+                    table_name,
+                    metadata_filepath = metadata_filepath
+                    )
+                )
+        else:
+            codes = {}
+        
+        if fields is None or fields == '':
+            fields = self.get_field_names(table_name)
+        
+        x = []
+        parameters = ()
+        for field in convert_to_iterator(fields):
+            codes_table_name = codes_table_names.get(field)
+            if field in codes and len(codes[field]) > 0:
+                values_string = ','.join(['(?,?)'] * len(codes[field]))
+                x.append(
+                    f'COALESCE((SELECT column2 FROM (VALUES {values_string}) '
+                    f'WHERE column1 = "{table_name}"."{field}"), "{field}") AS "{field}"'
+                    )
+                parameters += tuple(
+                    y for item in codes[field].items() for y in item
+                    )
+            elif codes_table_name is None:
+                x.append(f'"{field}"')
+            else:
+                # an indexed lookup, as a scalar subquery so that the 
+                # field names in the WHERE clause are not ambiguous
+                x.append(
+                    f'COALESCE((SELECT label FROM "{codes_table_name}" '
+                    f'WHERE code = "{table_name}"."{field}"), "{field}") AS "{field}"'
+                    )
+        return ' ' + ', '.join(x) + ' ', parameters
     
-    :returns: None
     
-    """
-    if verbose:
-        print('--- FUNCTION: csvw_functions_extra.import_table_group_to_sqlite ---')
+    def _get_where_clause(
+            self,
+            table_name,
+            filter_by
+            ):
+        """Returns a WHERE clause, its parameters and the names of any 
+        temporary tables it uses.
+        
+        Lists of more than _FILTER_TEMP_TABLE_THRESHOLD values are loaded 
+        into an indexed temporary table and filtered by 
+        "IN (SELECT value FROM ...)" rather than by one parameter per value.
+        The temporary table column has the declared type of the filtered 
+        column, so that values are compared with the same type affinity as
+        the values of an "IN (?,?,...)" list. The temporary tables are 
+        removed by `_drop_temp_tables`.
+        
+        """
+        if filter_by is None:
+            filter_by = dict()
+        
+        small_filter_by = {}
+        temp_table_filters = []
+        for field_name, filter_value in filter_by.items():
+            if not isinstance(filter_value, (str, bytes, dict)) \
+                    and isinstance(filter_value, collections.abc.Collection) \
+                    and len(filter_value) > _FILTER_TEMP_TABLE_THRESHOLD:
+                temp_table_filters.append((field_name, filter_value))
+            else:
+                small_filter_by[field_name] = filter_value
+        
+        where_string, parameters = \
+            get_where_clause(
+                small_filter_by
+                )
+        
+        if len(temp_table_filters) > 0:
+            declared_types = {
+                x[1]: x[2] 
+                for x in self.execute(f'PRAGMA table_info("{table_name}");').fetchall()
+                }
+        
+        temp_table_names = []
+        try:
+            where = [where_string[len(' WHERE '):]] if where_string else []
+            for field_name, filter_value in temp_table_filters:
+                temp_table_name = \
+                    self._create_filter_temp_table(
+                        filter_value,
+                        declared_types.get(field_name, '')
+                        )
+                temp_table_names.append(temp_table_name)
+                where.append(
+                    f'("{field_name}" IN (SELECT value FROM temp."{temp_table_name}"))'
+                    )
+        except BaseException:
+            self._drop_temp_tables(temp_table_names)
+            raise
+        
+        if len(where) > 0:
+            where_string = ' WHERE ' + ' AND '.join(where)
+        
+        return where_string, parameters, temp_table_names
     
-    # convert single csv_file_name to list. None becomes an empty list.
-    csv_file_name_list=convert_to_iterator(csv_file_names)
     
-    # 
-    metadata_dir, metadata_filename = os.path.split(metadata_filepath)
+    def _create_filter_temp_table(
+            self,
+            values,
+            declared_type=''
+            ):
+        """Creates a temporary table with an indexed column of the distinct
+        (non-NULL) values and returns its name.
         
-    # get normalised metadata_table_group_dict
-    metadata_table_group_dict = \
-        get_metadata_table_group_dict(
-                metadata_filepath
+        The column is given the declared_type, which sets its type affinity.
+        ANY (the no affinity type of STRICT tables) is left out, as ANY has
+        NUMERIC affinity in tables which are not STRICT.
+        
+        The values are sorted first (if possible), as inserting in key order
+        is much faster for long lists.
+        
+        """
+        values = [x for x in values if not x is None]  # NULL never matches IN
+        try:
+            values.sort()
+        except TypeError:  # values of mixed types
+            pass
+        
+        temp_table_name = \
+            f'_csvw_functions_extra_filter_{next(_filter_temp_table_numbers)}'
+        
+        if declared_type.upper() == 'ANY':
+            declared_type = ''
+        
+        conn = self.connection
+        total_changes = conn.total_changes
+        conn.execute(
+            f'CREATE TEMP TABLE "{temp_table_name}" (value {declared_type} PRIMARY KEY) WITHOUT ROWID;'
+            )
+        
+        in_transaction = conn.in_transaction
+        if not in_transaction:
+            conn.execute('BEGIN;')
+        try:
+            conn.executemany(
+                f'INSERT OR IGNORE INTO temp."{temp_table_name}" VALUES (?);',
+                ((x,) for x in values)
                 )
-    #print(metadata_table_group_dict)
+            if not in_transaction:
+                conn.execute('COMMIT;')
+        except BaseException:
+            if not in_transaction and conn.in_transaction:
+                conn.execute('ROLLBACK;')
+            raise
+        finally:
+            # the temporary table does not change the database
+            self._temp_table_changes += conn.total_changes - total_changes
+        
+        return temp_table_name
     
-    # remove existing tables if requested
-    for metadata_table_dict in metadata_table_group_dict['tables']:
     
-        # get import info
-        csv_file_name, table_name, fp_csv, remove_existing_table = \
-            _get_import_info(
-                metadata_table_dict,
-                data_folder = metadata_dir,
-                verbose=False,
-                ) 
+    def _drop_temp_tables(
+            self,
+            temp_table_names
+            ):
+        """Removes temporary tables created by `_create_filter_temp_table`.
         
-        # if requested by csv_file_name argument
-        if len(csv_file_name_list)==0 \
-            or csv_file_name in csv_file_name_list:
-                
-            if verbose:
-                print('---')
-                print('csv_file_name',csv_file_name)
-                print('table_name',table_name)
-                print('fp_csv',fp_csv)
-                print('remove_existing_table',remove_existing_table)
-                
-            if _check_if_table_exists_in_database(
-                database_filepath, 
-                table_name
-                ):
-                
-                if remove_existing_table or overwrite_existing_tables:
-    
-                    _drop_table(
-                        database_fielpath,
-                        table_name
-                        )
+        """
+        total_changes = self.connection.total_changes
+        for temp_table_name in temp_table_names:
+            self.execute(f'DROP TABLE IF EXISTS temp."{temp_table_name}";')
+        self._temp_table_changes += self.connection.total_changes - total_changes
         
-    # create and import tables
-    for metadata_table_dict in metadata_table_group_dict['tables']:
         
-        # get import info
-        csv_file_name, table_name, fp_csv, remove_existing_table = _get_import_info(
-                metadata_table_dict,
-                data_folder = metadata_dir,
-                verbose=False,
-                ) 
-            
-        if len(csv_file_name_list)==0 \
-            or csv_file_name in csv_file_name_list:
-            
-            # create empty table if needed
-            if not _check_if_table_exists_in_database(
-                    database_filepath, 
-                    table_name
-                    ):
-                
-                _create_table_from_csvw(
-                    metadata_table_dict, 
-                    database_filepath, 
-                    table_name)
-                
-            # import table data to database
-            _import_csv_file(
-                    fp_csv,
-                    database_filepath,
-                    table_name,
-                    verbose=verbose
+    def get_sql_table_names(
+            self,
+            metadata_filepath
+            ):
+        """Returns the names of the tables in the database which are 
+        described in a CSVW metadata file.
+        
+        """
+        sql_table_names = \
+            get_metadata_sql_table_names(
+                    metadata_table_group_dict = None,
+                    metadata_filepath = metadata_filepath
                     )
+        #print('sql_table_names',sql_table_names)
+                
+        all_table_names = self.get_all_table_names()
+        #print('all_table_names',all_table_names)
         
-            if verbose:
-                print('---')
-            
-
-def _check_if_table_exists_in_database(
-        fp_database,
-        table_name
-        ):
-    ""
-    with sqlite3.connect(fp_database) as conn:
-        c = conn.cursor()
-        query=f"SELECT count(*) FROM sqlite_master WHERE type='table' AND name='{table_name}';"
-        return True if c.execute(query).fetchall()[0][0] else False
-
-
-def _create_table_from_csvw(
-        metadata_table_dict,
-        fp_database,
-        table_name,
-        verbose=False
-        ):
-    ""
-    # create query
-    datatype_map={
-    'integer':'INTEGER',
-    'decimal':'REAL'
-    }
-    query=f'CREATE TABLE "{table_name}" ('
-    for column_dict in metadata_table_dict['tableSchema']['columns']:
-        #print(column_dict)
-        name=column_dict['name']
-        datatype=datatype_map.get(column_dict['datatype']['base'],'TEXT')
-        query+=f'"{name}" {datatype}'
-        query+=", "
-    query=query[:-2]
+        return [x for x in all_table_names if x in sql_table_names]
     
-    if 'primaryKey' in metadata_table_dict['tableSchema']:
+    
+    def run_sql(
+            self,
+            sql_query,
+            result_format='rows',
+            verbose=False
+            ):
+        """Runs a SQL query and returns the result as a list of dictionaries,
+        or as columns (see `_fetch_columns`).
         
-        pk=metadata_table_dict['tableSchema']['primaryKey']
-        if isinstance(pk,str):
-            pk=[pk]
-        query+=', PRIMARY KEY ('
-        for x in pk:
-            query+=f'"{x}"'
-            query+=", "
-        query=query[:-2]
-        query+=') '
+        """
+        _check_result_format(result_format)
+        if verbose:
+            print(sql_query)
+        if result_format == 'rows':
+            return [dict(x) for x in self.execute(sql_query).fetchall()]
+        else:
+            return self._fetch_columns(sql_query, (), result_format)
     
-    query+=');'
     
-    if verbose:
-        print('---QUERY TO CREATE TABLE---')
-        print(query)
+    def export_columnar_table(
+            self,
+            table_name,
+            **kwargs
+            ):
+        """Writes a table to a columnar cache of NumPy .npy files. 
+        See `export_columnar_table`.
+        
+        """
+        return export_columnar_table(
+            table_name,
+            self,
+            **kwargs
+            )
     
-    # create empty table in database
-    with sqlite3.connect(fp_database) as conn:
-        c = conn.cursor()
-        c.execute(query)
-        conn.commit()
+    
+    def load_columnar_table(
+            self,
+            table_name,
+            **kwargs
+            ):
+        """Returns the columns of a table as memory-mapped NumPy arrays. 
+        See `load_columnar_table`.
         
-    # create indexes
-    with sqlite3.connect(fp_database) as conn:
-        c = conn.cursor()
-        for column_dict in metadata_table_dict['tableSchema']['columns']:
-            column_name=column_dict['name']
-            setindex=column_dict.get('https://purl.org/berg/csvw_functions_extra/vocab/sqlsetindex',False)
-            if setindex:
-                index_name=f'{table_name}_{column_name}'
-                query=f'CREATE INDEX "{index_name}" ON "{table_name}"("{column_name}")'
-                if verbose:
-                    print(query)
-                c.execute(query)
-                conn.commit()
-                
+        """
+        return load_columnar_table(
+            table_name,
+            self,
+            **kwargs
+            )
+    
+    
+    def import_table_group(
+            self,
+            metadata_filepath,
+            **kwargs
+            ):
+        """Imports the CSV data of a CSVW metadata file into the database. 
+        See `import_table_group_to_sqlite`.
+        
+        """
+        return import_table_group_to_sqlite(
+            metadata_filepath,
+            self,
+            **kwargs
+            )
+    
+    
+_RESULT_FORMATS = ('rows', 'columns', 'numpy')
 
-def _drop_table(
-        fp_database,
-        table_name,
-        verbose=False
+
+def _check_result_format(
+        result_format
         ):
     ""
-    with sqlite3.connect(fp_database) as conn:
-        c = conn.cursor()
-        query=f'DROP TABLE IF EXISTS "{table_name}";'
-        if verbose:
-            print(query)
-        c.execute(query)
-        conn.commit()
-
+    if not result_format in _RESULT_FORMATS:
+        raise Exception(
+            f'result_format must be one of {_RESULT_FORMATS}, not "{result_format}".'
+            )
+        
 
-def _get_import_info(
-        metadata_table_dict,
-        data_folder,
-        verbose=False,
+def _extend_result_column(
+        column,
+        values
         ):
-    ""
-    # get info for importing
-    csv_file_name=metadata_table_dict['https://purl.org/berg/csvw_functions_extra/vocab/csv_file_name']['@value']
-    if verbose:
-        print('csv_file_name:',csv_file_name)
-    table_name=metadata_table_dict['https://purl.org/berg/csvw_functions_extra/vocab/sql_table_name']['@value']
-    if verbose:
-        print('table_name:',table_name)
-    url=metadata_table_dict['url']
-    if verbose:
-        print('url',url)
-    fp_csv=os.path.join(data_folder,url)
-    if verbose:
-        print('fp_csv:', fp_csv)
-    remove_existing_table=metadata_table_dict.get(
-        "https://purl.org/berg/csvw_functions_extra/vocab/sql_remove_existing_table",
-        False
-        )
-    
-    return csv_file_name,table_name, fp_csv, remove_existing_table
+    """Adds a batch of values to a result column and returns the column.
     
+    An int64 array is changed to a float64 array if a real number is added,
+    and an array is changed to a list if any other value (i.e. NULL or 
+    text) is added.
     
-def _get_row_count_in_database_table(
-        fp_database,
-        table_name,
-        column_name='*'
-        ):
-    """Gets number of rows in table
+    """
+    if isinstance(column, array.array):
+        
+        n = len(column)
+        try:
+            column.extend(values)
+            return column
+        except TypeError:
+            del column[n:]  # remove the values added before the error
+        
+        if column.typecode == 'q':
+            try:
+                x = array.array('d', column)
+                x.extend(values)
+                return x
+            except TypeError:
+                pass
+                
+        column = column.tolist()
+        
+    column.extend(values)
+    return column
+
+
+class _ResultCache():
+    """A least recently used cache of query results, which is emptied when
+    the database version changes.
     
     """
-    with sqlite3.connect(fp_database) as conn:
-        c = conn.cursor()
-        query=f'SELECT COUNT({column_name}) FROM "{table_name}"'
-        return c.execute(query).fetchone()[0]
     
+    def __init__(
+            self,
+            max_entries,
+            max_bytes=None
+            ):
+        ""
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = collections.OrderedDict()  # key -> (result, size)
+        self._version = None
+        self._size = 0
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
         
-def _import_csv_file(
-        fp_csv,
-        database_filepath,
-        table_name,
-        verbose=False
+        
+    def clear(self):
+        ""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            self._version = None
+            
+        
+    def get(
+            self,
+            key,
+            version
+            ):
+        """Returns the cached result or None.
+        
+        """
+        with self._lock:
+            
+            if version != self._version:
+                self._entries.clear()
+                self._size = 0
+                self._version = version
+                
+            try:
+                entry = self._entries[key]
+            except (KeyError, TypeError):  # TypeError if the key is unhashable
+                self._misses += 1
+                return None
+            
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[0]
+        
+        
+    def put(
+            self,
+            key,
+            version,
+            result
+            ):
+        """Adds a result to the cache, removing the least recently used 
+        results if needed.
+        
+        """
+        size = _get_result_size(result)
+        
+        with self._lock:
+            
+            if version != self._version \
+                    or (not self.max_bytes is None and size > self.max_bytes):
+                return
+            
+            try:
+                old_entry = self._entries.pop(key, None)
+            except TypeError:  # unhashable key
+                return
+            if not old_entry is None:
+                self._size -= old_entry[1]
+                
+            self._entries[key] = (result, size)
+            self._size += size
+            
+            while len(self._entries) > self.max_entries \
+                    or (not self.max_bytes is None and self._size > self.max_bytes):
+                _, (_, x) = self._entries.popitem(last=False)
+                self._size -= x
+                
+    
+    def get_info(self):
+        ""
+        with self._lock:
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'entries': len(self._entries),
+                'bytes': self._size
+                }
+        
+
+def _get_result_size(
+        result
         ):
+    """Returns the approximate memory used by a list of dictionaries, in 
+    bytes.
+    
     """
-    """                
-    fp_database2=database_filepath.replace('\\','\\\\')
-    fp_csv2=fp_csv.replace('\\','\\\\')
-    command=f'sqlite3 {fp_database2} -cmd ".mode csv" ".import --skip 1 {fp_csv2} {table_name}"'
-    if verbose:
-        print('COMMAND LINE', command)
-    subprocess.run(command)
-    if verbose:
-        print('Number of rows after import: ', _get_row_count_in_database_table(database_filepath,table_name))
+    size = sys.getsizeof(result)
+    for row in result:
+        size += sys.getsizeof(row) + sum(sys.getsizeof(x) for x in row.values())
+    return size
 
 
+_ROW_FORMATS = ('dict', 'tuple', 'namedtuple')
 
-      
-        
-#%% database functions
 
-def add_index(
-        fields,
+# filter_by lists longer than this are loaded into a temporary table
+# (see benchmarks/bench_filter_lists.py); before SQLite 3.32.0 a statement
+# could have at most 999 parameters
+_FILTER_TEMP_TABLE_THRESHOLD = \
+    999 if sqlite3.sqlite_version_info < (3, 32, 0) else 10000
+
+_filter_temp_table_numbers = itertools.count()
+
+
+def _get_rows_query(
         table_name,
-        database_filepath,
-        unique=False,
-        verbose=False
+        field_string,
+        where_string,
+        parameters,
+        limit = None,
+        verbose = False
         ):
-    ""
-    fields=convert_to_iterator(fields)
-    fields_string='__'.join(fields)
+    """Returns the SELECT query and parameters used by `get_rows` and 
+    `iter_rows`.
     
-    if unique:
-        unique_string='UNIQUE'
+    """
+    if limit is None:
+        limit_string = ''
     else:
-        unique_string=''
-    
-    index_name=f'index__{table_name}__{fields_string}'
-    if unique:
-        index_name=f'{index_name}__UNIQUE'
-    
-    if verbose:
-        print('index_name',index_name)
-        
-    column_list='","'.join(fields)
-    column_list=f'"{column_list}"'
+        limit_string = ' LIMIT ? '
+        parameters += (limit,)
         
     query=f"""
-        CREATE {unique_string} INDEX "{index_name}" 
-        ON "{table_name}"({column_list});
-    """
+        SELECT 
+            {field_string}
+        FROM 
+            {table_name} 
+            {where_string}
+        {limit_string}
+        """
+        
     if verbose:
         print(query)
+        print('parameters', parameters)
         
+    return query, parameters
+
+
+def _iter_cursor_rows(
+        cursor,
+        sql_query,
+        parameters,
+        batch_size,
+        row_format
+        ):
+    """Executes a query and yields its rows in the given format, using 
+    fetchmany so that only one batch of rows is held at a time.
+    
+    The query is executed when the first row is requested and the cursor
+    is closed when the generator is exhausted or closed.
+    
+    """
+    cursor.row_factory = None
+    
     try:
         
-        with sqlite3.connect(database_filepath) as conn:
-            c = conn.cursor()
-            c.execute(query)
-            conn.commit()
-            
-    except sqlite3.OperationalError:
+        cursor.execute(sql_query, parameters)
+        
+        if cursor.description is None:  # not a query which returns rows
+            return
+        
+        field_names = [x[0] for x in cursor.description]
+        
+        if row_format == 'dict':
+            make_row = lambda row: dict(zip(field_names, row))
+        elif row_format == 'namedtuple':
+            make_row = collections.namedtuple('Row', field_names, rename=True)._make
+        else:
+            make_row = None
+        
+        while True:
+            
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            
+            if make_row is None:
+                yield from rows
+            else:
+                yield from map(make_row, rows)
+            
+    finally:
+        
+        cursor.close()
+    
+
+@contextlib.contextmanager
+def _get_database(
+        database_filepath
+        ):
+    """Returns a CsvwDatabase object for use in a `with` statement.
+    
+    :param database_filepath: A database filepath, in which case a new 
+        connection is opened and closed at the end of the `with` block, or 
+        a CsvwDatabase object, which is used as is and left open.
+        
+    """
+    if isinstance(database_filepath, CsvwDatabase):
+        
+        yield database_filepath
+        
+    else:
         
-        if verbose:
-            print('Index not created - already exists in table')
+        database = CsvwDatabase(database_filepath)
+        try:
+            yield database.connect()
+        finally:
+            database.close()
+    
+
+def add_index(
+        fields,
+        table_name,
+        database_filepath,
+        unique=False,
+        verbose=False
+        ):
+    ""
+    with _get_database(database_filepath) as database:
+        database.add_index(
+            fields,
+            table_name,
+            unique=unique,
+            verbose=verbose
+            )
 
         
 def get_all_table_names_in_database(
@@ -763,13 +5129,8 @@ def get_all_table_names_in_database(
         ):
     """
     """
-    with sqlite3.connect(database_filepath) as conn:
-        c = conn.cursor()
-        result = c.execute('SELECT name FROM sqlite_master WHERE type="table"').fetchall()
-
-    result = [x[0] for x in result]
-    
-    return result
+    with _get_database(database_filepath) as database:
+        return database.get_all_table_names()
 
 
 def get_field_names(
@@ -778,15 +5139,11 @@ def get_field_names(
         verbose=False
         ):
     ""
-    query=f'PRAGMA table_info({table_name});'
-    if verbose:
-        print(query)
-        
-    with sqlite3.connect(database_filepath) as conn:
-        c = conn.cursor()
-        
-        return [x[1] for x in c.execute(query).fetchall()]
-    
+    with _get_database(database_filepath) as database:
+        return database.get_field_names(
+            table_name,
+            verbose=verbose
+            )
     
     
 def get_row_count(
@@ -797,40 +5154,13 @@ def get_row_count(
         verbose=False
         ):
     ""
-    
-    where_string=\
-        get_where_string(
-            filter_by
-            )
-    if verbose:
-        print('where_string', where_string)
-        
-    group_by_fields, group_by_string = \
-        get_group_by_string(
-            group_by
+    with _get_database(database_filepath) as database:
+        return database.get_row_count(
+            table_name,
+            filter_by=filter_by,
+            group_by=group_by,
+            verbose=verbose
             )
-    if verbose:
-        print('group_by_fields',group_by_fields)
-        print('group_by_string',group_by_string)
-        
-    query=f"""
-        SELECT 
-            {group_by_fields} COUNT(*) AS COUNT
-        FROM 
-            {table_name} 
-        {where_string}
-        {group_by_string}
-        """
-        
-    if verbose:
-        print(query)
-            
-    with sqlite3.connect(database_filepath) as conn:
-        conn.row_factory = sqlite3.Row
-        c = conn.cursor()
-        result=[dict(x) for x in c.execute(query).fetchall()]
-        
-    return result
 
 
 def get_rows(
@@ -842,123 +5172,486 @@ def get_rows(
         # pandas = False,
         replace_codes = False,
         metadata_filename = None,  # needed if using replace codes
+        result_format = 'rows',
         verbose = False
         ):
     ""
-    field_string = \
-        get_field_string(
-            fields
+    with _get_database(database_filepath) as database:
+        return database.get_rows(
+            table_name,
+            filter_by=filter_by,
+            fields=fields,
+            limit=limit,
+            replace_codes=replace_codes,
+            metadata_filename=metadata_filename,
+            result_format=result_format,
+            verbose=verbose
             )
+
+
+def iter_rows(
+        table_name,
+        database_filepath,
+        filter_by = None,
+        fields = None,
+        limit = None,
+        replace_codes = False,
+        batch_size = 1000,
+        row_format = 'dict',
+        verbose = False
+        ):
+    """Yields the rows of a table one at a time, fetching batch_size rows 
+    from the database at a time, so memory use does not grow with the 
+    number of rows.
     
-    where_string = \
-        get_where_string(
-            filter_by
+    :param row_format: 'dict', 'tuple' or 'namedtuple'.
+    :type row_format: str
+    
+    """
+    with _get_database(database_filepath) as database:
+        yield from database.iter_rows(
+            table_name,
+            filter_by=filter_by,
+            fields=fields,
+            limit=limit,
+            replace_codes=replace_codes,
+            batch_size=batch_size,
+            row_format=row_format,
+            verbose=verbose
             )
         
-    if limit is None:
-        limit_string = ''
-    else:
-        limit_string = f' LIMIT {limit} '
         
-    query=f"""
-        SELECT 
-            {field_string}
-        FROM 
-            {table_name} 
-            {where_string}
-        {limit_string}
+def iter_sql(
+        sql_query,
+        database_filepath,
+        parameters = (),
+        batch_size = 1000,
+        row_format = 'dict',
+        verbose = False
+        ):
+    """Runs a SQL query and yields the result rows one at a time, fetching
+    batch_size rows from the database at a time.
+    
+    :param row_format: 'dict', 'tuple' or 'namedtuple'.
+    :type row_format: str
+    
+    """
+    with _get_database(database_filepath) as database:
+        yield from database.iter_sql(
+            sql_query,
+            parameters=parameters,
+            batch_size=batch_size,
+            row_format=row_format,
+            verbose=verbose
+            )
+
+
+def get_sql_table_names_in_database(
+        database_filepath,
+        metadata_filepath
+        ):
+    """
+    """
+    with _get_database(database_filepath) as database:
+        return database.get_sql_table_names(metadata_filepath)
+    
+
+def run_sql(
+        sql_query,
+        database_filepath,
+        result_format='rows',
+        verbose=False
+        ):
+    ""
+    with _get_database(database_filepath) as database:
+        return database.run_sql(
+            sql_query,
+            result_format=result_format,
+            verbose=verbose
+            )
+
+
+#%% columnar tables
+
+_COLUMNAR_FOLDER_SUFFIX = '-columnar'
+_COLUMNAR_MANIFEST_FILENAME = 'manifest.json'
+
+
+class DictionaryEncodedArray(
+        collections.namedtuple(
+            'DictionaryEncodedArray', 
+            ['codes', 'categories']
+            )
+        ):
+    """A dictionary-encoded text column of a columnar table.
+    
+    `codes` is an int32 NumPy array with one value per row, which is the 
+    index of the value in `categories`, or -1 for a NULL value. 
+    `categories` is a list of the distinct text values of the column.
+    
+    """
+    
+    def decode(self):
+        """Returns the column values as a NumPy object array, with None for 
+        NULL values.
+        
         """
+        np = _import_numpy()
+        categories = np.empty(len(self.categories) + 1, dtype=object)
+        categories[:-1] = self.categories
+        return categories[self.codes]  # a code of -1 selects the final None
+    
+    
+def export_columnar_table(
+        table_name,
+        database_filepath,
+        columnar_folder=None,
+        batch_size=100000,
+        verbose=False
+        ):
+    """Writes a table in the database to a columnar cache of NumPy .npy 
+    files, with one file per column.
+    
+    INTEGER columns are stored as int64 arrays (or as float64 arrays with 
+    NaN values if the column contains NULL values), REAL columns as 
+    float64 arrays with NaN for NULL values and TEXT columns are 
+    dictionary-encoded (see DictionaryEncodedArray).
+    
+    :param table_name: The name of the table in the database.
+    :type table_name: str
+    
+    :param database_filepath: The filepath of the SQLite database, or a
+        CsvwDatabase object.
+    :type database_filepath: str
+    
+    :param columnar_folder: The folder of the columnar cache. If None, then
+        a folder named after the database with the suffix "-columnar" is used.
+    :type columnar_folder: str
+    
+    :param batch_size: The number of rows fetched from the database at a 
+        time.
+    :type batch_size: int
+    
+    :returns: The folder containing the .npy files of the table.
+    :rtype: str
+    
+    """
+    np = _import_numpy()
+    
+    with _get_database(database_filepath) as database:
         
-    if verbose:
-        print(query)
+        if not database.table_exists(table_name):
+            raise Exception(f'Table "{table_name}" does not exist in the database.')
         
+        table_folder = \
+            _get_columnar_table_folder(
+                database, 
+                table_name, 
+                columnar_folder
+                )
         
-    # get data
-    with sqlite3.connect(database_filepath) as conn:
+        if verbose:
+            print(f'Exporting table "{table_name}" to columnar folder "{table_folder}"')
         
-        # if pandas:
-            
-        #     result = pd.read_sql(query,conn)
-                
-        # else:
-            
-        conn.row_factory = sqlite3.Row
-        c = conn.cursor()
-        result=[dict(x) for x in c.execute(query).fetchall()]
+        field_names = database.get_field_names(table_name)
+        row_count = database.execute(f'SELECT COUNT(*) FROM "{table_name}";').fetchone()[0]
+        stamp = _get_columnar_stamp(database, table_name, row_count)
         
-    
-    # replace codes
-    if replace_codes:
+        # choose the array type of each column from the types of its values
+        column_kinds = []
+        for field_name in field_names:
+            value_types = {
+                x[0] for x in database.execute(
+                    f'SELECT DISTINCT typeof("{field_name}") FROM "{table_name}";'
+                    ).fetchall()
+                }
+            if 'blob' in value_types:
+                raise Exception(
+                    f'Column "{field_name}" of table "{table_name}" contains BLOB '
+                    'values which cannot be stored in a columnar table.'
+                    )
+            elif value_types <= {'integer'}:
+                column_kinds.append('int64')
+            elif value_types <= {'integer', 'real', 'null'}:
+                column_kinds.append('float64')
+            else:
+                column_kinds.append('dictionary')
+                
+        # write the arrays to a temporary folder, which replaces the existing
+        # folder when complete
+        os.makedirs(os.path.dirname(table_folder), exist_ok=True)
+        temp_folder = \
+            tempfile.mkdtemp(
+                prefix=f'{os.path.basename(table_folder)}.', 
+                dir=os.path.dirname(table_folder)
+                )
         
-        codes = \
-            get_metadata_columns_codes(
-                    sql_table_name = table_name,
-                    column_names = None,
-                    data_folder = data_folder,
-                    metadata_filename = metadata_filename
+        try:
+            
+            arrays = []
+            dictionaries = []
+            for i, kind in enumerate(column_kinds):
+                fp = os.path.join(temp_folder, f'{i}.npy')
+                dtype = 'int32' if kind == 'dictionary' else kind
+                arrays.append(
+                    np.lib.format.open_memmap(
+                        fp, 
+                        mode='w+', 
+                        dtype=dtype, 
+                        shape=(row_count,)
+                        )
                     )
+                dictionaries.append({} if kind == 'dictionary' else None)
             
-        if isinstance(result,list):  # it's a list of dictionaries
+            cursor = database.connection.cursor()
+            cursor.row_factory = None
+            cursor.execute(
+                'SELECT ' 
+                + ', '.join(f'"{x}"' for x in field_names) 
+                + f' FROM "{table_name}";'
+                )
             
-            for row_dict in result:
+            start = 0
+            while True:
                 
-                for field, value in row_dict.items():
-                    
-                    lookup_dict = codes.get(field)
-                    
-                    row_dict[field] = lookup_dict.get(value,value)
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                stop = start + len(rows)
+                
+                for i, column in enumerate(zip(*rows)):
+                    kind = column_kinds[i]
+                    if kind == 'int64':
+                        arrays[i][start:stop] = column
+                    elif kind == 'float64':
+                        arrays[i][start:stop] = \
+                            [float('nan') if x is None else x for x in column]
+                    else:
+                        categories = dictionaries[i]
+                        arrays[i][start:stop] = [
+                            -1 if x is None else categories.setdefault(str(x), len(categories))
+                            for x in column
+                            ]
+                        
+                start = stop
+                
+            if start != row_count:
+                raise Exception(
+                    f'Table "{table_name}" changed during the columnar export.'
+                    )
             
-        else:  # it's a Pandas dataframe
+            for x in arrays:
+                x.flush()
+            del x, arrays  # closes the memory-mapped files
             
-            for col in result.columns:
-                
-                result[col] = result[col].replace(codes.get(col,{}))
+            manifest = {
+                'table_name': table_name,
+                'row_count': row_count,
+                'stamp': stamp,
+                'columns': [
+                    {
+                        'name': field_name,
+                        'filename': f'{i}.npy',
+                        'kind': column_kinds[i],
+                        'categories': \
+                            None if dictionaries[i] is None else list(dictionaries[i])
+                        }
+                    for i, field_name in enumerate(field_names)
+                    ]
+                }
+            with open(os.path.join(temp_folder, _COLUMNAR_MANIFEST_FILENAME), 'w') as f:
+                json.dump(manifest, f)
                 
+            _remove_columnar_table_folder(table_folder)
+            os.rename(temp_folder, table_folder)
+            
+        except BaseException:
+            
+            shutil.rmtree(temp_folder, ignore_errors=True)
+            raise
         
-    return result
-
+    return table_folder
 
 
-def get_sql_table_names_in_database(
+def load_columnar_table(
+        table_name,
         database_filepath,
-        metadata_filepath
+        columns=None,
+        columnar_folder=None,
+        export_if_required=True,
+        verbose=False
         ):
+    """Returns the columns of a table from its columnar cache as 
+    memory-mapped NumPy arrays.
+    
+    The cache is checked against the table's import log entry and row 
+    count. If the cache is missing or out of date, then it is (re)written 
+    by `export_columnar_table`.
+    
+    :param table_name: The name of the table in the database.
+    :type table_name: str
+    
+    :param database_filepath: The filepath of the SQLite database, or a
+        CsvwDatabase object.
+    :type database_filepath: str
+    
+    :param columns: The names of the columns to load. If None, then all 
+        columns are loaded.
+    :type columns: list
+    
+    :param columnar_folder: The folder of the columnar cache. If None, then
+        a folder named after the database with the suffix "-columnar" is used.
+    :type columnar_folder: str
+    
+    :param export_if_required: If False, an error is raised if the cache is 
+        missing or out of date, rather than rewriting it.
+    :type export_if_required: bool
+    
+    :returns: A dictionary with column names as keys. The values are 
+        read-only memory-mapped NumPy arrays, or DictionaryEncodedArray 
+        objects for TEXT columns.
+    :rtype: dict
+    
     """
-    """
-    sql_table_names = \
-        get_metadata_sql_table_names(
-                metadata_table_group_dict = None,
-                metadata_filepath = metadata_filepath
+    np = _import_numpy()
+    
+    with _get_database(database_filepath) as database:
+        
+        if not database.table_exists(table_name):
+            raise Exception(f'Table "{table_name}" does not exist in the database.')
+        
+        table_folder = \
+            _get_columnar_table_folder(
+                database, 
+                table_name, 
+                columnar_folder
                 )
-    #print('sql_table_names',sql_table_names)
+        
+        manifest = _read_columnar_manifest(table_folder)
+        
+        if not manifest is None:
+            row_count = manifest['row_count']
+            if manifest['stamp'] != _get_columnar_stamp(database, table_name, row_count) \
+                    or database.execute(f'SELECT COUNT(*) FROM "{table_name}";').fetchone()[0] != row_count:
+                manifest = None
+        
+        if manifest is None:
+            
+            if not export_if_required:
+                raise Exception(
+                    f'The columnar cache of table "{table_name}" is missing or out of date.'
+                    )
             
-    all_table_names = \
-        get_all_table_names_in_database(
-                database_filepath = database_filepath
+            export_columnar_table(
+                table_name,
+                database,
+                columnar_folder=columnar_folder,
+                verbose=verbose
                 )
-    #print('all_table_names',all_table_names)
+            manifest = _read_columnar_manifest(table_folder)
+            
+    column_dicts = {x['name']: x for x in manifest['columns']}
     
-    result=[x for x in all_table_names if x in sql_table_names]
+    if columns is None:
+        columns = list(column_dicts)
     
+    result = {}
+    for column_name in columns:
+        
+        column_dict = column_dicts.get(column_name)
+        if column_dict is None:
+            raise Exception(
+                f'Column "{column_name}" does not exist in table "{table_name}".'
+                )
+        
+        column_array = np.load(
+            os.path.join(table_folder, column_dict['filename']), 
+            mmap_mode='r'
+            )
+        
+        if column_dict['kind'] == 'dictionary':
+            column_array = DictionaryEncodedArray(column_array, column_dict['categories'])
+        
+        result[column_name] = column_array
+        
     return result
+
+
+def _import_numpy():
+    """Imports and returns the numpy package, which is an optional 
+    dependency needed for columnar tables.
     
+    """
+    try:
+        import numpy
+    except ImportError:
+        raise Exception(
+            'The numpy package is required for columnar tables. '
+            'Install it using "pip install numpy".'
+            )
+    return numpy
 
 
-def run_sql(
-        sql_query,
+def _get_columnar_table_folder(
         database_filepath,
-        verbose=False
+        table_name,
+        columnar_folder=None
         ):
-    ""
-    if verbose:
-        print(sql_query)
-        
-    with sqlite3.connect(database_filepath) as conn:
-        conn.row_factory = sqlite3.Row
-        c = conn.cursor()
-        result=[dict(x) for x in c.execute(sql_query).fetchall()]
-        
-    return result
+    """Returns the folder of the columnar cache of a table.
+    
+    """
+    if columnar_folder is None:
+        if isinstance(database_filepath, CsvwDatabase):
+            database_filepath = database_filepath.database_filepath
+        columnar_folder = \
+            os.path.abspath(database_filepath) + _COLUMNAR_FOLDER_SUFFIX
+    return os.path.join(columnar_folder, table_name)
+
+
+def _get_columnar_stamp(
+        database_filepath,
+        table_name,
+        row_count
+        ):
+    """Returns the values which identify the version of a table which a 
+    columnar cache was written from.
+    
+    """
+    log_entry = _get_import_log_entry(database_filepath, table_name)
+    return {
+        'imported_at': None if log_entry is None else log_entry['imported_at'],
+        'source_hash': None if log_entry is None else log_entry['source_hash'],
+        'row_count': row_count
+        }
+
+
+def _read_columnar_manifest(
+        table_folder
+        ):
+    """Returns the manifest of a columnar table, or None.
+    
+    """
+    try:
+        with open(os.path.join(table_folder, _COLUMNAR_MANIFEST_FILENAME)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    
+    
+def _remove_columnar_table_folder(
+        table_folder
+        ):
+    """Removes the columnar cache of a table, if it exists.
+    
+    The manifest is removed first so that a partly removed folder is never
+    read as valid.
+    
+    """
+    if os.path.isdir(table_folder):
+        fp = os.path.join(table_folder, _COLUMNAR_MANIFEST_FILENAME)
+        if os.path.exists(fp):
+            os.remove(fp)
+        shutil.rmtree(table_folder, ignore_errors=True)
 
 
 #%% utility functions
@@ -1016,7 +5709,11 @@ def get_group_by_string(
 def get_where_string(
         filter_by = None # a dict
         ):
-    ""
+    """Converts a dictionary of field names and values into a WHERE clause
+    with the values written into the SQL text. See `get_where_clause` for 
+    a WHERE clause with bound parameters.
+    
+    """
     if filter_by is None:
         
         filter_by=dict()
@@ -1096,6 +5793,98 @@ def get_where_string(
         where_string=f' WHERE {x}'
 
     return where_string
+
+
+_WHERE_CLAUSE_OPERATORS = ('=', '!=', '<>', '<', '<=', '>', '>=', 'LIKE', 'NOT LIKE')
+
+
+def get_where_clause(
+        filter_by = None # a dict
+        ):
+    """Converts a dictionary of field names and values into a WHERE clause
+    with ? placeholders and a tuple of the values to bind to them.
+    
+    Because the values are not written into the SQL text, queries which 
+    differ only in their filter values have the same SQL text and so reuse 
+    the prepared statements in the sqlite3 statement cache. 
+    
+    :param filter_by: A dictionary with field names as keys. A value can be 
+        a single value (field = value), a list of values (field IN values) 
+        or a dictionary of operators and values, i.e. {'>=': 1, '<': 5}, 
+        {'BETWEEN': [1, 2]}, {'LIKE': 'a%'} or {'IS NULL': True}. The 
+        operators are =, !=, <>, <, <=, >, >=, LIKE, NOT LIKE, BETWEEN, 
+        IS NULL and IS NOT NULL.
+    :type filter_by: dict
+    
+    :returns: The WHERE clause (or '') and the parameters.
+    :rtype: tuple
+    
+    """
+    if filter_by is None:
+        
+        filter_by=dict()
+    
+    where = []
+    parameters = []
+    
+    for field_name,filter_value in filter_by.items():
+        
+        if isinstance(filter_value,dict):
+            
+            if len(filter_value) == 0:
+                raise Exception(f'No filter operator given for field "{field_name}".')
+            
+            for filter_keyword, x in filter_value.items():
+                
+                filter_keyword = filter_keyword.upper()
+                
+                if filter_keyword in _WHERE_CLAUSE_OPERATORS:
+                    where.append(f'("{field_name}" {filter_keyword} ?)')
+                    parameters.append(x)
+                    
+                elif filter_keyword == 'BETWEEN':
+                    x = convert_to_iterator(x)
+                    if not len(x) == 2:
+                        raise Exception(
+                            f'BETWEEN filter of field "{field_name}" must have two values.'
+                            )
+                    where.append(f'("{field_name}" BETWEEN ? AND ?)')
+                    parameters.extend(x)
+                    
+                elif filter_keyword in ('IS NULL', 'IS NOT NULL'):
+                    if not x:  # i.e. {'IS NULL': False}
+                        filter_keyword = \
+                            'IS NOT NULL' if filter_keyword == 'IS NULL' else 'IS NULL'
+                    where.append(f'("{field_name}" {filter_keyword})')
+                    
+                else:
+                    raise Exception(
+                        f'Filter operator "{filter_keyword}" is not supported.'
+                        )
+            
+        else:
+        
+            filter_values=list(convert_to_iterator(filter_value))
+            
+            if len(filter_values) == 0:
+                where.append(f'("{field_name}" = NULL)')  # as get_where_string
+                
+            elif len(filter_values) == 1:
+                where.append(f'("{field_name}" = ?)')
+                parameters.append(filter_values[0])
+                
+            else:
+                x = ','.join('?' * len(filter_values))
+                where.append(f'("{field_name}" IN ({x}))')
+                parameters.extend(filter_values)
+    
+    if len(where)==0:
+        where_string=''
+    else:
+        x=' AND '.join(where)
+        where_string=f' WHERE {x}'
+        
+    return where_string, tuple(parameters)
         
         
               
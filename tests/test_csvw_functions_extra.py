@@ -5,13 +5,1665 @@ Created on Sat Aug 12 14:49:13 2023
 @author: cvskf
 """
 import unittest
+import sqlite3
 
 import csvw_functions
 import csvw_functions_extra 
 import os
+import json
+import tempfile
+import threading
+import functools
+import http.server
+import hashlib
+import email.utils
+import zipfile
+import unittest.mock
+import gzip
+import asyncio
+import time
+import shutil
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 fp_table_group_metadata='extra_tables-metadata.json'
 
+
+class QuietHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
+    ""
+    
+    def log_message(self, format, *args):
+        ""
+        pass
+    
+
+class RangeHTTPRequestHandler(QuietHTTPRequestHandler):
+    """Serves files with support for Range, If-Range and If-None-Match 
+    requests.
+    
+    Url paths in `truncate_next` have their next response cut short
+    half way through the body. All requests are logged in `requests`
+    as (path, headers, method) tuples. If `write_delay` is set then the 
+    body is written slowly in 1 kB pieces.
+    
+    """
+    truncate_next = set()
+    requests = []
+    write_delay = None
+    
+    def do_HEAD(self):
+        ""
+        self.do_GET()
+    
+    def do_GET(self):
+        ""
+        self.requests.append((self.path, dict(self.headers), self.command))
+        
+        fp = self.translate_path(self.path)
+        if not os.path.isfile(fp):
+            self.send_error(404)
+            return
+        with open(fp, 'rb') as f:
+            data = f.read()
+        etag = '"{}"'.format(hashlib.sha1(data).hexdigest())
+        
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+            
+        last_modified = email.utils.formatdate(os.path.getmtime(fp), usegmt=True)
+        range_header = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        if not if_range is None and not if_range in (etag, last_modified):
+            range_header = None
+        if range_header is None:
+            start = 0
+            self.send_response(200)
+        else:
+            start = int(range_header.split('=')[1].split('-')[0])
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{len(data)-1}/{len(data)}')
+        body = data[start:]
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', last_modified)
+        self.end_headers()
+        
+        if self.command == 'HEAD':
+            pass
+        elif self.path in self.truncate_next:
+            self.truncate_next.discard(self.path)
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+        elif not self.write_delay is None:
+            try:
+                for i in range(0, len(body), 1000):
+                    self.wfile.write(body[i:i+1000])
+                    self.wfile.flush()
+                    time.sleep(self.write_delay)
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True
+        else:
+            self.wfile.write(body)
+            
+
+def start_local_server(
+        directory,
+        handler_class=RangeHTTPRequestHandler
+        ):
+    """Starts a local http server in a background thread.
+    
+    Returns the server and the base url.
+    
+    """
+    server = http.server.ThreadingHTTPServer(
+        ('127.0.0.1', 0),
+        functools.partial(handler_class, directory=directory)
+        )
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    return server, base_url
+
+
+def write_table_group_metadata(
+        fp_metadata,
+        tables,
+        columns=None
+        ):
+    """Writes a CSVW metadata file with a simple two column table schema.
+    
+    tables is a list of dicts of csvw_functions_extra vocabulary values, 
+    i.e. {'csv_file_name': ..., 'csv_download_url': ...}.
+    
+    columns is an optional list of CSVW column descriptions which replaces
+    the two column table schema.
+    
+    """
+    if columns is None:
+        columns = [
+            {'name': 'id', 'datatype': 'integer'},
+            {'name': 'value', 'datatype': 'string'}
+            ]
+    
+    metadata_tables = []
+    for table in tables:
+        metadata_table = {
+            'url': table['csv_file_name'],
+            'tableSchema': {
+                'primaryKey': 'id',
+                'columns': columns
+                }
+            }
+        for k, v in table.items():
+            metadata_table[f'https://purl.org/berg/csvw_functions_extra/vocab/{k}'] = v
+        metadata_tables.append(metadata_table)
+        
+    with open(fp_metadata, 'w') as f:
+        json.dump(
+            {
+                '@context': 'http://www.w3.org/ns/csvw',
+                'tables': metadata_tables
+                },
+            f,
+            indent=4
+            )
+        
+
+class LocalServerTestCase(unittest.TestCase):
+    """Base class for tests which download files from a local http server.
+    
+    """
+    
+    def setUp(self):
+        ""
+        self._tempdir = tempfile.TemporaryDirectory()
+        self.remote_folder = os.path.join(self._tempdir.name, 'remote')
+        self.data_folder = os.path.join(self._tempdir.name, 'data')
+        os.makedirs(self.remote_folder)
+        self.server, self.base_url = start_local_server(self.remote_folder)
+        RangeHTTPRequestHandler.truncate_next = set()
+        RangeHTTPRequestHandler.requests = []
+        RangeHTTPRequestHandler.write_delay = None
+        
+        
+    def tearDown(self):
+        ""
+        self.server.shutdown()
+        self.server.server_close()
+        self._tempdir.cleanup()
+        
+        
+    def _write_remote_csv_files(self, n):
+        ""
+        tables = []
+        for i in range(n):
+            csv_file_name = f'table{i}.csv'
+            with open(os.path.join(self.remote_folder, csv_file_name), 'w') as f:
+                f.write('id,value\n')
+                for j in range(100):
+                    f.write(f'{j},table{i}_row{j}\n')
+            tables.append(
+                {
+                    'csv_file_name': csv_file_name,
+                    'csv_download_url': f'{self.base_url}/{csv_file_name}',
+                    'sql_table_name': f'table{i}'
+                    }
+                )
+        fp_metadata = os.path.join(self._tempdir.name, 'tables-metadata.json')
+        write_table_group_metadata(fp_metadata, tables)
+        return fp_metadata
+    
+    
+    def _write_remote_zip_file(self):
+        ""
+        fp_zip = os.path.join(self.remote_folder, 'tables.zip')
+        with zipfile.ZipFile(fp_zip, 'w') as z:
+            z.writestr('folder/a.csv', 'id,value\n1,a\n')
+            z.writestr('folder/b.csv', 'id,value\n1,b\n')
+        tables = [
+            {
+                'csv_file_name': f'{x}.csv',
+                'zip_download_url': f'{self.base_url}/tables.zip',
+                'zip_file_name': 'tables.zip',
+                'csv_zip_extract_path': f'folder/{x}.csv',
+                'sql_table_name': x
+                }
+            for x in ['a', 'b']
+            ]
+        fp_metadata = os.path.join(self._tempdir.name, 'tables-metadata.json')
+        write_table_group_metadata(fp_metadata, tables)
+        return fp_zip, fp_metadata
+    
+    
+class TESTNormalizedMetadataCache(LocalServerTestCase):
+    ""
+    
+    def test_get_normalized_metadata_table_group_dict_local_cache(self):
+        ""
+        fp_metadata = self._write_remote_csv_files(2)
+        cache_folder = os.path.join(self._tempdir.name, 'cache')
+        
+        with unittest.mock.patch(
+                'csvw_functions.validate_table_group_metadata',
+                wraps=csvw_functions.validate_table_group_metadata
+                ) as mock_validate:
+            
+            results = [
+                csvw_functions_extra.get_available_csv_file_names(
+                    fp_metadata,
+                    cache_folder = cache_folder
+                    )
+                for _ in range(3)
+                ]
+            self.assertEqual(mock_validate.call_count, 1)
+            self.assertEqual(results[0], ['table0.csv', 'table1.csv'])
+            self.assertEqual(results[0], results[2])
+            
+            # changed metadata file is validated again
+            self._write_remote_csv_files(3)
+            result = \
+                csvw_functions_extra.get_available_csv_file_names(
+                    fp_metadata,
+                    cache_folder = cache_folder
+                    )
+            self.assertEqual(mock_validate.call_count, 2)
+            self.assertEqual(result, ['table0.csv', 'table1.csv', 'table2.csv'])
+            
+            
+    def test_get_normalized_metadata_table_group_dict_remote_cache(self):
+        ""
+        fp_metadata = self._write_remote_csv_files(2)
+        shutil.copy(fp_metadata, self.remote_folder)
+        url = f'{self.base_url}/tables-metadata.json'
+        cache_folder = os.path.join(self._tempdir.name, 'cache')
+        
+        with unittest.mock.patch(
+                'csvw_functions.validate_table_group_metadata',
+                wraps=csvw_functions.validate_table_group_metadata
+                ) as mock_validate:
+            
+            result1 = \
+                csvw_functions_extra.get_normalized_metadata_table_group_dict(
+                    url,
+                    cache_folder = cache_folder
+                    )
+            RangeHTTPRequestHandler.requests = []
+            result2 = \
+                csvw_functions_extra.get_normalized_metadata_table_group_dict(
+                    url,
+                    cache_folder = cache_folder
+                    )
+                
+        self.assertEqual(mock_validate.call_count, 1)
+        self.assertEqual(result1, result2)
+        self.assertEqual(len(RangeHTTPRequestHandler.requests), 1)
+        self.assertIn('If-None-Match', RangeHTTPRequestHandler.requests[0][1])
+        
+        
+class TESTDownloadTableGroup(LocalServerTestCase):
+    ""
+        
+    def test_download_table_group_max_workers(self):
+        ""
+        fp_metadata = self._write_remote_csv_files(5)
+        
+        result = \
+            csvw_functions_extra.download_table_group(
+                metadata_document_location = fp_metadata,
+                data_folder = self.data_folder,
+                max_workers = 3,
+                max_workers_per_host = 2
+                )
+            
+        for i in range(5):
+            with open(os.path.join(self.remote_folder, f'table{i}.csv')) as f1, \
+                open(os.path.join(self.data_folder, f'table{i}.csv')) as f2:
+                self.assertEqual(f1.read(), f2.read())
+                
+        with open(result) as f:
+            metadata_table_group_dict = json.load(f)
+        self.assertEqual(
+            [x['url'] for x in metadata_table_group_dict['tables']],
+            [f'table{i}.csv' for i in range(5)]
+            )
+        
+        
+    def test_download_table_group_max_workers_error(self):
+        ""
+        fp_metadata = self._write_remote_csv_files(3)
+        os.remove(os.path.join(self.remote_folder, 'table1.csv'))
+        
+        with self.assertRaises(Exception):
+            csvw_functions_extra.download_table_group(
+                metadata_document_location = fp_metadata,
+                data_folder = self.data_folder,
+                max_workers = 2
+                )
+            
+        self.assertFalse(
+            os.path.exists(os.path.join(self.data_folder, 'tables-metadata.json'))
+            )
+
+        
+    def test_download_table_group_resume_after_dropped_connection(self):
+        ""
+        fp_metadata = self._write_remote_csv_files(1)
+        RangeHTTPRequestHandler.truncate_next.add('/table0.csv')
+        
+        csvw_functions_extra.download_table_group(
+            metadata_document_location = fp_metadata,
+            data_folder = self.data_folder
+            )
+        
+        with open(os.path.join(self.remote_folder, 'table0.csv'), 'rb') as f1, \
+            open(os.path.join(self.data_folder, 'table0.csv'), 'rb') as f2:
+            self.assertEqual(f1.read(), f2.read())
+        self.assertFalse(
+            os.path.exists(os.path.join(self.data_folder, 'table0.csv.part'))
+            )
+        
+        # second request resumes from the end of the '.part' file
+        self.assertEqual(len(RangeHTTPRequestHandler.requests), 2)
+        self.assertNotIn('Range', RangeHTTPRequestHandler.requests[0][1])
+        self.assertIn('Range', RangeHTTPRequestHandler.requests[1][1])
+        
+        
+    def test_download_table_group_existing_part_file(self):
+        ""
+        fp_metadata = self._write_remote_csv_files(1)
+        fp_remote = os.path.join(self.remote_folder, 'table0.csv')
+        with open(fp_remote, 'rb') as f:
+            data = f.read()
+        etag = '"{}"'.format(hashlib.sha1(data).hexdigest())
+        os.makedirs(self.data_folder)
+        fp_part = os.path.join(self.data_folder, 'table0.csv.part')
+        
+        def write_part_file(validators):
+            with open(fp_part, 'wb') as f:
+                f.write(data[:50])
+            if not validators is None:
+                with open(f'{fp_part}.validators', 'w') as f:
+                    json.dump(validators, f)
+                    
+        def download():
+            RangeHTTPRequestHandler.requests.clear()
+            csvw_functions_extra.download_table_group(
+                metadata_document_location = fp_metadata,
+                data_folder = self.data_folder,
+                overwrite_existing_files = True
+                )
+            with open(os.path.join(self.data_folder, 'table0.csv'), 'rb') as f:
+                self.assertEqual(f.read(), new_data)
+            self.assertFalse(os.path.exists(fp_part))
+            self.assertFalse(os.path.exists(f'{fp_part}.validators'))
+            return RangeHTTPRequestHandler.requests[-1][1]
+        
+        # the remote file is unchanged, so the '.part' file is resumed
+        new_data = data
+        write_part_file({'etag': etag, 'last_modified': None})
+        headers = download()
+        self.assertEqual(headers['Range'], 'bytes=50-')
+        self.assertEqual(headers['If-Range'], etag)
+        
+        # the remote file has changed (with the same length), so the 
+        # download restarts
+        new_data = data.replace(b'table0_row9', b'table0_rowX')
+        with open(fp_remote, 'wb') as f:
+            f.write(new_data)
+        write_part_file({'etag': etag, 'last_modified': None})
+        headers = download()
+        self.assertIn('If-Range', headers)
+        
+        # without saved validators, the download restarts
+        write_part_file(None)
+        headers = download()
+        self.assertNotIn('Range', headers)
+        
+        
+    def test_download_table_group_refresh_changed_files(self):
+        ""
+        fp_metadata = self._write_remote_csv_files(2)
+        
+        csvw_functions_extra.download_table_group(
+            metadata_document_location = fp_metadata,
+            data_folder = self.data_folder
+            )
+        
+        with open(os.path.join(
+                self.data_folder, 
+                'csvw_functions_extra_download_manifest.json'
+                )) as f:
+            download_manifest = json.load(f)
+        entry = download_manifest['files']['table0.csv']
+        self.assertEqual(entry['url'], f'{self.base_url}/table0.csv')
+        self.assertEqual(
+            entry['size'], 
+            os.path.getsize(os.path.join(self.data_folder, 'table0.csv'))
+            )
+        self.assertIsNotNone(entry['etag'])
+        
+        # change one remote file
+        with open(os.path.join(self.remote_folder, 'table1.csv'), 'a') as f:
+            f.write('100,new_row\n')
+        RangeHTTPRequestHandler.requests = []
+        
+        csvw_functions_extra.download_table_group(
+            metadata_document_location = fp_metadata,
+            data_folder = self.data_folder,
+            refresh_changed_files = True
+            )
+        
+        self.assertEqual(
+            [x[1]['If-None-Match'] for x in RangeHTTPRequestHandler.requests],
+            [download_manifest['files'][f'table{i}.csv']['etag'] for i in range(2)]
+            )
+        with open(os.path.join(self.data_folder, 'table1.csv')) as f:
+            self.assertTrue(f.read().endswith('100,new_row\n'))
+            
+        
+    def test_download_table_group_zip_opened_once(self):
+        ""
+        fp_zip, fp_metadata = self._write_remote_zip_file()
+        
+        with unittest.mock.patch(
+                'zipfile.ZipFile', 
+                wraps=zipfile.ZipFile
+                ) as mock_zipfile:
+            csvw_functions_extra.download_table_group(
+                metadata_document_location = fp_metadata,
+                data_folder = self.data_folder
+                )
+        
+        self.assertEqual(mock_zipfile.call_count, 1)
+        self.assertEqual(len(RangeHTTPRequestHandler.requests), 1)
+        for x in ['a', 'b']:
+            with open(os.path.join(self.data_folder, f'{x}.csv')) as f:
+                self.assertEqual(f.read(), f'id,value\n1,{x}\n')
+            self.assertFalse(
+                os.path.exists(os.path.join(self.data_folder, f'{x}.csv.part'))
+                )
+        
+        
+    def test_download_table_group_zip_refresh_changed_files(self):
+        ""
+        fp_zip, fp_metadata = self._write_remote_zip_file()
+        
+        csvw_functions_extra.download_table_group(
+            metadata_document_location = fp_metadata,
+            data_folder = self.data_folder
+            )
+        self.assertTrue(os.path.exists(os.path.join(self.data_folder, 'tables.zip')))
+        self.assertEqual(len(RangeHTTPRequestHandler.requests), 1)
+        
+        # unchanged
+        csvw_functions_extra.download_table_group(
+            metadata_document_location = fp_metadata,
+            data_folder = self.data_folder,
+            refresh_changed_files = True
+            )
+        self.assertEqual(len(RangeHTTPRequestHandler.requests), 2)
+        
+        # changed
+        with zipfile.ZipFile(fp_zip, 'w') as z:
+            z.writestr('folder/a.csv', 'id,value\n1,a\n2,aa\n')
+            z.writestr('folder/b.csv', 'id,value\n1,b\n2,bb\n')
+        csvw_functions_extra.download_table_group(
+            metadata_document_location = fp_metadata,
+            data_folder = self.data_folder,
+            refresh_changed_files = True
+            )
+        self.assertEqual(len(RangeHTTPRequestHandler.requests), 3)
+        for x in ['a', 'b']:
+            with open(os.path.join(self.data_folder, f'{x}.csv')) as f:
+                self.assertEqual(f.read(), f'id,value\n1,{x}\n2,{x}{x}\n')
+        
+
+class TESTDownloadEvents(LocalServerTestCase):
+    ""
+    
+    def test_download_table_group_callback(self):
+        ""
+        fp_metadata = self._write_remote_csv_files(2)
+        size = os.path.getsize(os.path.join(self.remote_folder, 'table0.csv'))
+        
+        events = []
+        csvw_functions_extra.download_table_group(
+            metadata_document_location = fp_metadata,
+            data_folder = self.data_folder,
+            callback = events.append
+            )
+        
+        self.assertEqual(
+            [(x['event'], x.get('status')) for x in events],
+            [('file', 'downloaded'), ('table', None), 
+             ('file', 'downloaded'), ('table', None),
+             ('table_group', None)]
+            )
+        self.assertEqual(events[0]['url'], f'{self.base_url}/table0.csv')
+        self.assertEqual(events[0]['host'], self.base_url[7:])
+        self.assertEqual(events[0]['bytes'], size)
+        self.assertGreater(events[0]['throughput'], 0)
+        self.assertEqual(events[1]['csv_file_name'], 'table0.csv')
+        self.assertEqual(events[1]['urls'], [f'{self.base_url}/table0.csv'])
+        self.assertEqual(events[4]['bytes'], size * 2)
+        self.assertEqual(events[4]['table_count'], 2)
+        
+        # existing files are skipped
+        events = []
+        csvw_functions_extra.download_table_group(
+            metadata_document_location = fp_metadata,
+            data_folder = self.data_folder,
+            callback = events.append
+            )
+        self.assertEqual(
+            [x['status'] for x in events if x['event'] == 'file'],
+            ['skipped', 'skipped']
+            )
+        self.assertEqual(events[-1]['bytes'], 0)
+        
+        
+    def test_download_table_group_callback_zip(self):
+        ""
+        fp_zip, fp_metadata = self._write_remote_zip_file()
+        
+        events = []
+        csvw_functions_extra.download_table_group(
+            metadata_document_location = fp_metadata,
+            data_folder = self.data_folder,
+            callback = events.append
+            )
+        
+        self.assertEqual(
+            [(x['event'], x.get('status')) for x in events],
+            [('file', 'downloaded'), ('table', None), 
+             ('file', 'shared'), ('table', None),
+             ('zip_extract', None), ('zip_extract', None),
+             ('table_group', None)]
+            )
+        self.assertEqual(
+            [x['csv_zip_extract_path'] for x in events if x['event'] == 'zip_extract'],
+            ['folder/a.csv', 'folder/b.csv']
+            )
+        
+        
+class TESTDownloadTableGroupAsync(LocalServerTestCase):
+    ""
+    
+    def test_download_table_group_async(self):
+        ""
+        fp_metadata = self._write_remote_csv_files(4)
+        
+        result = asyncio.run(
+            csvw_functions_extra.download_table_group_async(
+                metadata_document_location = fp_metadata,
+                data_folder = self.data_folder,
+                max_workers = 2
+                )
+            )
+        
+        for i in range(4):
+            with open(os.path.join(self.remote_folder, f'table{i}.csv')) as f1, \
+                open(os.path.join(self.data_folder, f'table{i}.csv')) as f2:
+                self.assertEqual(f1.read(), f2.read())
+        with open(result) as f:
+            metadata_table_group_dict = json.load(f)
+        self.assertEqual(
+            [x['url'] for x in metadata_table_group_dict['tables']],
+            [f'table{i}.csv' for i in range(4)]
+            )
+        
+        
+    def test_download_table_group_async_cancel(self):
+        ""
+        fp_metadata = self._write_remote_csv_files(1)
+        with open(os.path.join(self.remote_folder, 'table0.csv'), 'a') as f:
+            for j in range(100, 3000):
+                f.write(f'{j},table0_row{j}\n')
+        RangeHTTPRequestHandler.write_delay = 0.05
+        
+        async def download_with_timeout():
+            await asyncio.wait_for(
+                csvw_functions_extra.download_table_group_async(
+                    metadata_document_location = fp_metadata,
+                    data_folder = self.data_folder
+                    ),
+                timeout = 0.2
+                )
+        
+        with self.assertRaises(asyncio.TimeoutError):
+            asyncio.run(download_with_timeout())
+        time.sleep(0.2)  # allows the download thread to stop
+            
+        self.assertFalse(os.path.exists(os.path.join(self.data_folder, 'table0.csv')))
+        self.assertTrue(os.path.exists(os.path.join(self.data_folder, 'table0.csv.part')))
+        self.assertFalse(os.path.exists(os.path.join(self.data_folder, 'tables-metadata.json')))
+        
+        # the next call resumes the download
+        RangeHTTPRequestHandler.write_delay = None
+        asyncio.run(
+            csvw_functions_extra.download_table_group_async(
+                metadata_document_location = fp_metadata,
+                data_folder = self.data_folder
+                )
+            )
+        with open(os.path.join(self.remote_folder, 'table0.csv')) as f1, \
+            open(os.path.join(self.data_folder, 'table0.csv')) as f2:
+            self.assertEqual(f1.read(), f2.read())
+        self.assertIn('Range', RangeHTTPRequestHandler.requests[-1][1])
+        
+        
+class TESTDownloadCache(LocalServerTestCase):
+    ""
+    
+    def test_download_table_group_cache_folder(self):
+        ""
+        fp_metadata = self._write_remote_csv_files(2)
+        cache_folder = os.path.join(self._tempdir.name, 'cache')
+        
+        for data_folder in ['data1', 'data2']:
+            csvw_functions_extra.download_table_group(
+                metadata_document_location = fp_metadata,
+                data_folder = os.path.join(self._tempdir.name, data_folder),
+                cache_folder = cache_folder
+                )
+            
+        # second data folder only makes HEAD requests
+        self.assertEqual(
+            [x[2] for x in RangeHTTPRequestHandler.requests],
+            ['HEAD', 'GET', 'HEAD', 'GET', 'HEAD', 'HEAD']
+            )
+        for i in range(2):
+            with open(os.path.join(self.remote_folder, f'table{i}.csv')) as f1, \
+                open(os.path.join(self._tempdir.name, 'data2', f'table{i}.csv')) as f2:
+                self.assertEqual(f1.read(), f2.read())
+        self.assertEqual(len(os.listdir(os.path.join(cache_folder, 'objects'))), 2)
+        
+        # changed remote file is downloaded again
+        with open(os.path.join(self.remote_folder, 'table0.csv'), 'a') as f:
+            f.write('100,new_row\n')
+        csvw_functions_extra.download_table_group(
+            metadata_document_location = fp_metadata,
+            data_folder = os.path.join(self._tempdir.name, 'data3'),
+            cache_folder = cache_folder
+            )
+        with open(os.path.join(self._tempdir.name, 'data3', 'table0.csv')) as f:
+            self.assertTrue(f.read().endswith('100,new_row\n'))
+        self.assertEqual(len(os.listdir(os.path.join(cache_folder, 'objects'))), 3)
+            
+        
+    def test_download_table_group_cache_max_size(self):
+        ""
+        fp_metadata = self._write_remote_csv_files(3)
+        cache_folder = os.path.join(self._tempdir.name, 'cache')
+        size = os.path.getsize(os.path.join(self.remote_folder, 'table0.csv'))
+        
+        csvw_functions_extra.download_table_group(
+            metadata_document_location = fp_metadata,
+            data_folder = self.data_folder,
+            cache_folder = cache_folder,
+            cache_max_size = size * 2
+            )
+        
+        self.assertEqual(len(os.listdir(os.path.join(cache_folder, 'objects'))), 2)
+        for i in range(3):
+            self.assertTrue(os.path.exists(os.path.join(self.data_folder, f'table{i}.csv')))
+        
+        
+class TESTImportTableGroupToSqlite(LocalServerTestCase):
+    ""
+    
+    def test_import_table_group_to_sqlite_import_methods(self):
+        ""
+        fp_metadata = self._write_remote_csv_files(2)
+        metadata_filepath = \
+            csvw_functions_extra.download_table_group(
+                metadata_document_location = fp_metadata,
+                data_folder = self.data_folder
+                )
+        
+        rows = {}
+        for import_method in ['native', 'cli']:
+            database_filepath = os.path.join(self.data_folder, f'{import_method}.sqlite')
+            result = \
+                csvw_functions_extra.import_table_group_to_sqlite(
+                    metadata_filepath = metadata_filepath,
+                    database_filepath = database_filepath,
+                    import_method = import_method
+                    )
+            self.assertEqual(result, {'table0': 100, 'table1': 100})
+            rows[import_method] = \
+                csvw_functions_extra.get_rows('table1', database_filepath)
+        
+        self.assertEqual(rows['native'], rows['cli'])
+        self.assertEqual(rows['native'][5], {'id': 5, 'value': 'table1_row5'})
+        
+        
+    def test_import_table_group_to_sqlite_from_zip(self):
+        ""
+        fp_zip, fp_metadata = self._write_remote_zip_file()
+        
+        metadata_filepath = \
+            csvw_functions_extra.download_table_group(
+                metadata_document_location = fp_metadata,
+                data_folder = self.data_folder,
+                extract_zip_files = False
+                )
+        self.assertFalse(os.path.exists(os.path.join(self.data_folder, 'a.csv')))
+        
+        database_filepath = os.path.join(self.data_folder, 'data.sqlite')
+        csvw_functions_extra.import_table_group_to_sqlite(
+            metadata_filepath = metadata_filepath,
+            database_filepath = database_filepath
+            )
+        
+        for x in ['a', 'b']:
+            self.assertEqual(
+                csvw_functions_extra.get_rows(x, database_filepath),
+                [{'id': 1, 'value': x}]
+                )
+            
+            
+    def test_import_table_group_to_sqlite_from_gzip(self):
+        ""
+        with gzip.open(os.path.join(self.remote_folder, 'c.csv.gz'), 'wt') as f:
+            f.write('id,value\n1,c\n2,cc\n')
+        fp_metadata = os.path.join(self._tempdir.name, 'tables-metadata.json')
+        write_table_group_metadata(
+            fp_metadata, 
+            [
+                {
+                    'csv_file_name': 'c.csv.gz',
+                    'csv_download_url': f'{self.base_url}/c.csv.gz',
+                    'sql_table_name': 'c'
+                    }
+                ]
+            )
+        
+        metadata_filepath = \
+            csvw_functions_extra.download_table_group(
+                metadata_document_location = fp_metadata,
+                data_folder = self.data_folder
+                )
+        database_filepath = os.path.join(self.data_folder, 'data.sqlite')
+        csvw_functions_extra.import_table_group_to_sqlite(
+            metadata_filepath = metadata_filepath,
+            database_filepath = database_filepath
+            )
+        
+        self.assertEqual(
+            csvw_functions_extra.get_rows('c', database_filepath),
+            [{'id': 1, 'value': 'c'}, {'id': 2, 'value': 'cc'}]
+            )
+        
+        
+    def test_import_table_group_to_sqlite_datatypes(self):
+        ""
+        with open(os.path.join(self.remote_folder, 'd.csv'), 'w') as f:
+            f.write('id,amount,flag,day,note\n')
+            f.write('1,9.5,Y,31/01/2020,NA\n')
+            f.write('2,10.25,N,01/02/2020,x\n')
+            f.write('3,,,,\n')
+        fp_metadata = os.path.join(self._tempdir.name, 'tables-metadata.json')
+        write_table_group_metadata(
+            fp_metadata, 
+            [
+                {
+                    'csv_file_name': 'd.csv',
+                    'csv_download_url': f'{self.base_url}/d.csv',
+                    'sql_table_name': 'd'
+                    }
+                ],
+            columns = [
+                {'name': 'id', 'datatype': 'integer'},
+                {'name': 'amount', 'datatype': 'decimal'},
+                {'name': 'flag', 'datatype': {'base': 'boolean', 'format': 'Y|N'}},
+                {'name': 'day', 'datatype': {'base': 'date', 'format': 'dd/MM/yyyy'}},
+                {'name': 'note', 'datatype': 'string', 'null': 'NA'}
+                ]
+            )
+        metadata_filepath = \
+            csvw_functions_extra.download_table_group(
+                metadata_document_location = fp_metadata,
+                data_folder = self.data_folder
+                )
+        
+        for import_method in ['native', 'cli']:
+            database_filepath = os.path.join(self.data_folder, f'{import_method}.sqlite')
+            csvw_functions_extra.import_table_group_to_sqlite(
+                metadata_filepath = metadata_filepath,
+                database_filepath = database_filepath,
+                import_method = import_method
+                )
+            
+            self.assertEqual(
+                csvw_functions_extra.get_rows('d', database_filepath),
+                [
+                    {'id': 1, 'amount': 9.5, 'flag': 1, 'day': '2020-01-31', 'note': None},
+                    {'id': 2, 'amount': 10.25, 'flag': 0, 'day': '2020-02-01', 'note': 'x'},
+                    {'id': 3, 'amount': None, 'flag': None, 'day': None, 'note': ''}
+                    ]
+                )
+            self.assertEqual(
+                csvw_functions_extra.run_sql(
+                    'SELECT id FROM d WHERE amount < 10', 
+                    database_filepath
+                    ),
+                [{'id': 1}]
+                )
+            self.assertEqual(
+                csvw_functions_extra.get_row_count(
+                    'd', 
+                    database_filepath, 
+                    filter_by = {'flag': 1}
+                    ),
+                [{'COUNT': 1}]
+                )
+        
+        
+    def test_import_table_group_to_sqlite_defer_indexes(self):
+        ""
+        with open(os.path.join(self.remote_folder, 'e.csv'), 'w') as f:
+            f.write('id,value\n')
+            for j in reversed(range(100)):
+                f.write(f'{j},e{j % 10}\n')
+        fp_metadata = os.path.join(self._tempdir.name, 'tables-metadata.json')
+        write_table_group_metadata(
+            fp_metadata, 
+            [
+                {
+                    'csv_file_name': 'e.csv',
+                    'csv_download_url': f'{self.base_url}/e.csv',
+                    'sql_table_name': 'e'
+                    }
+                ],
+            columns = [
+                {'name': 'id', 'datatype': 'integer'},
+                {'name': 'value', 'datatype': 'string',
+                 'https://purl.org/berg/csvw_functions_extra/vocab/sqlsetindex': True}
+                ]
+            )
+        metadata_filepath = \
+            csvw_functions_extra.download_table_group(
+                metadata_document_location = fp_metadata,
+                data_folder = self.data_folder
+                )
+        database_filepath = os.path.join(self.data_folder, 'data.sqlite')
+        
+        result = \
+            csvw_functions_extra.import_table_group_to_sqlite(
+                metadata_filepath = metadata_filepath,
+                database_filepath = database_filepath,
+                defer_indexes = True,
+                sort_by_primary_key = True
+                )
+        self.assertEqual(result, {'e': 100})
+        
+        self.assertEqual(
+            csvw_functions_extra.get_all_table_names_in_database(database_filepath),
+            ['e', 'sqlite_stat1', '_csvw_functions_extra_import_log']
+            )
+        self.assertEqual(
+            csvw_functions_extra.run_sql(
+                "SELECT name FROM sqlite_master WHERE type='index' AND sql IS NOT NULL", 
+                database_filepath
+                ),
+            [{'name': 'e_value'}]
+            )
+        self.assertEqual(
+            csvw_functions_extra.get_rows('e', database_filepath, limit=2),
+            [{'id': 0, 'value': 'e0'}, {'id': 1, 'value': 'e1'}]
+            )
+        self.assertEqual(
+            csvw_functions_extra.get_row_count('e', database_filepath, filter_by={'value': 'e3'}),
+            [{'COUNT': 10}]
+            )
+        
+        
+    def test_import_table_group_to_sqlite_max_workers(self):
+        ""
+        fp_metadata = self._write_remote_csv_files(3)
+        metadata_filepath = \
+            csvw_functions_extra.download_table_group(
+                metadata_document_location = fp_metadata,
+                data_folder = self.data_folder
+                )
+        
+        for kwargs in [dict(), dict(defer_indexes=True, sort_by_primary_key=True)]:
+            
+            rows = {}
+            for max_workers in [None, 2]:
+                database_filepath = os.path.join(self.data_folder, f'{max_workers}.sqlite')
+                if os.path.exists(database_filepath):
+                    os.remove(database_filepath)
+                result = \
+                    csvw_functions_extra.import_table_group_to_sqlite(
+                        metadata_filepath = metadata_filepath,
+                        database_filepath = database_filepath,
+                        max_workers = max_workers,
+                        **kwargs
+                        )
+                self.assertEqual(result, {'table0': 100, 'table1': 100, 'table2': 100})
+                rows[max_workers] = [
+                    csvw_functions_extra.get_rows(f'table{i}', database_filepath)
+                    for i in range(3)
+                    ]
+                
+            self.assertEqual(rows[None], rows[2])
+            
+        # temporary databases are removed
+        self.assertEqual(
+            [x for x in os.listdir(self.data_folder) if x.startswith('csvw_functions_extra_import_')],
+            []
+            )
+        
+        
+    def test_import_table_group_to_sqlite_incremental(self):
+        ""
+        fp_metadata = self._write_remote_csv_files(2)
+        metadata_filepath = \
+            csvw_functions_extra.download_table_group(
+                metadata_document_location = fp_metadata,
+                data_folder = self.data_folder
+                )
+        database_filepath = os.path.join(self.data_folder, 'data.sqlite')
+        
+        def import_tables():
+            return csvw_functions_extra.import_table_group_to_sqlite(
+                metadata_filepath = metadata_filepath,
+                database_filepath = database_filepath,
+                incremental = True
+                )
+        
+        self.assertEqual(import_tables(), {'table0': 100, 'table1': 100})
+        
+        # unchanged tables are skipped, even if the file is touched
+        os.utime(os.path.join(self.data_folder, 'table0.csv'))
+        self.assertEqual(import_tables(), {'table0': 0, 'table1': 0})
+        
+        # changed tables are rebuilt
+        with open(os.path.join(self.data_folder, 'table1.csv'), 'a') as f:
+            f.write('100,table1_row100\n')
+        self.assertEqual(import_tables(), {'table0': 0, 'table1': 101})
+        self.assertEqual(
+            csvw_functions_extra.get_row_count('table1', database_filepath),
+            [{'COUNT': 101}]
+            )
+        
+        log = \
+            csvw_functions_extra.run_sql(
+                'SELECT table_name, source_size, row_count FROM _csvw_functions_extra_import_log',
+                database_filepath
+                )
+        self.assertEqual(
+            log,
+            [
+                {
+                    'table_name': f'table{i}', 
+                    'source_size': os.path.getsize(os.path.join(self.data_folder, f'table{i}.csv')), 
+                    'row_count': 100 + i
+                    }
+                for i in range(2)
+                ]
+            )
+        
+        
+    def test_import_table_group_to_sqlite_resume(self):
+        ""
+        fp_metadata = self._write_remote_csv_files(1)
+        metadata_filepath = \
+            csvw_functions_extra.download_table_group(
+                metadata_document_location = fp_metadata,
+                data_folder = self.data_folder
+                )
+        database_filepath = os.path.join(self.data_folder, 'data.sqlite')
+        
+        events = []
+        def progress_callback(event):
+            events.append(event)
+            if event['rows'] == 50 and len(events) == 5:
+                raise KeyboardInterrupt
+        
+        kwargs = dict(
+            metadata_filepath = metadata_filepath,
+            database_filepath = database_filepath,
+            batch_size = 10,
+            commit_interval = 20,
+            progress_callback = progress_callback
+            )
+        
+        # interrupted import keeps the committed rows
+        with self.assertRaises(KeyboardInterrupt):
+            csvw_functions_extra.import_table_group_to_sqlite(**kwargs)
+        self.assertEqual(
+            [(x['rows'], x['rows_committed']) for x in events],
+            [(10, 0), (20, 20), (30, 20), (40, 40), (50, 40)]
+            )
+        self.assertEqual(
+            csvw_functions_extra.get_row_count('table0', database_filepath),
+            [{'COUNT': 40}]
+            )
+        
+        # resumed import continues after the committed rows
+        events.clear()
+        result = \
+            csvw_functions_extra.import_table_group_to_sqlite(
+                resume = True, 
+                **kwargs
+                )
+        self.assertEqual(result, {'table0': 100})
+        self.assertEqual(events[0]['rows'], 50)
+        self.assertEqual(events[-1]['rows'], 100)
+        self.assertEqual(
+            events[-1]['bytes'], 
+            os.path.getsize(os.path.join(self.data_folder, 'table0.csv'))
+            )
+        self.assertEqual(events[-1]['bytes'], events[-1]['total_bytes'])
+        self.assertEqual(
+            csvw_functions_extra.get_rows('table0', database_filepath, fields='id'),
+            [{'id': i} for i in range(100)]
+            )
+        self.assertEqual(
+            csvw_functions_extra.run_sql(
+                'SELECT * FROM _csvw_functions_extra_import_progress', 
+                database_filepath
+                ),
+            []
+            )
+        
+        
+    def test_import_table_group_to_sqlite_atomic_reload(self):
+        ""
+        fp_metadata = os.path.join(self._tempdir.name, 'tables-metadata.json')
+        write_table_group_metadata(
+            fp_metadata, 
+            [
+                {
+                    'csv_file_name': 'f.csv',
+                    'csv_download_url': f'{self.base_url}/f.csv',
+                    'sql_table_name': 'f'
+                    }
+                ],
+            columns = [
+                {'name': 'id', 'datatype': 'integer'},
+                {'name': 'value', 'datatype': 'string',
+                 'https://purl.org/berg/csvw_functions_extra/vocab/sqlsetindex': True}
+                ]
+            )
+        
+        os.makedirs(self.data_folder)
+        database_filepath = os.path.join(self.data_folder, 'data.sqlite')
+        reader = sqlite3.connect(database_filepath, isolation_level=None)
+        self.addCleanup(reader.close)
+        
+        for n in [10, 20, 30]:
+            
+            with open(os.path.join(self.remote_folder, 'f.csv'), 'w') as f:
+                f.write('id,value\n')
+                for j in range(n):
+                    f.write(f'{j},f{j}\n')
+            metadata_filepath = \
+                csvw_functions_extra.download_table_group(
+                    metadata_document_location = fp_metadata,
+                    data_folder = self.data_folder,
+                    overwrite_existing_files = True
+                    )
+            
+            # a reader in a read transaction keeps seeing the old table
+            if n > 10:
+                reader.execute('BEGIN;')
+                self.assertEqual(reader.execute('SELECT COUNT(*) FROM f').fetchone()[0], n - 10)
+                
+            csvw_functions_extra.import_table_group_to_sqlite(
+                metadata_filepath = metadata_filepath,
+                database_filepath = database_filepath,
+                overwrite_existing_tables = True,
+                atomic_reload = True
+                )
+            
+            if n > 10:
+                self.assertEqual(reader.execute('SELECT COUNT(*) FROM f').fetchone()[0], n - 10)
+                reader.execute('COMMIT;')
+            self.assertEqual(reader.execute('SELECT COUNT(*) FROM f').fetchone()[0], n)
+            
+            # one index, with a name that alternates between reloads
+            self.assertEqual(
+                reader.execute("SELECT name, tbl_name FROM sqlite_master WHERE name LIKE 'f%'").fetchall(),
+                [('f', 'f'), ('f__shadow_value' if n == 20 else 'f_value', 'f')]
+                )
+            
+        self.assertEqual(reader.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+        
+        
+    def test_import_table_group_to_sqlite_strict_without_rowid(self):
+        ""
+        for x, rows in [('g', '1,a\n2,b\n'), ('h', '1,a\nx,b\n')]:
+            with open(os.path.join(self.remote_folder, f'{x}.csv'), 'w') as f:
+                f.write('id,value\n' + rows)
+        fp_metadata = os.path.join(self._tempdir.name, 'tables-metadata.json')
+        write_table_group_metadata(
+            fp_metadata, 
+            [
+                {
+                    'csv_file_name': f'{x}.csv',
+                    'csv_download_url': f'{self.base_url}/{x}.csv',
+                    'sql_table_name': x,
+                    'sql_without_rowid': True
+                    }
+                for x in ['g', 'h']
+                ]
+            )
+        # tables without a primaryKey, with and without sql_without_rowid
+        with open(fp_metadata) as f:
+            metadata = json.load(f)
+        for x, without_rowid in [('n', None), ('m', True)]:
+            with open(os.path.join(self.remote_folder, f'{x}.csv'), 'w') as f:
+                f.write('id,value\n1,a\n1,a\n')
+            metadata_table = {
+                k: x if k.endswith('sql_table_name') 
+                else v.replace('g.csv', f'{x}.csv') if isinstance(v, str) 
+                else v
+                for k, v in metadata['tables'][0].items()
+                }
+            metadata_table['tableSchema'] = {'columns': metadata_table['tableSchema']['columns']}
+            if without_rowid is None:
+                del metadata_table['https://purl.org/berg/csvw_functions_extra/vocab/sql_without_rowid']
+            metadata['tables'].append(metadata_table)
+        with open(fp_metadata, 'w') as f:
+            json.dump(metadata, f)
+        
+        metadata_filepath = \
+            csvw_functions_extra.download_table_group(
+                metadata_document_location = fp_metadata,
+                data_folder = self.data_folder
+                )
+        database_filepath = os.path.join(self.data_folder, 'data.sqlite')
+        
+        # the unselected table "m" is not checked
+        csvw_functions_extra.import_table_group_to_sqlite(
+            metadata_filepath = metadata_filepath,
+            database_filepath = database_filepath,
+            csv_file_names = 'g.csv',
+            sql_strict = True,
+            sql_without_rowid = True
+            )
+        self.assertEqual(
+            csvw_functions_extra.run_sql(
+                "SELECT sql FROM sqlite_master WHERE name = 'g'", 
+                database_filepath
+                ),
+            [{'sql': 'CREATE TABLE "g" ("id" INTEGER, "value" TEXT, PRIMARY KEY ("id") ) STRICT, WITHOUT ROWID'}]
+            )
+        self.assertEqual(
+            csvw_functions_extra.get_rows('g', database_filepath),
+            [{'id': 1, 'value': 'a'}, {'id': 2, 'value': 'b'}]
+            )
+        
+        # sql_without_rowid only applies to tables with a primaryKey
+        self.assertEqual(
+            csvw_functions_extra.import_table_group_to_sqlite(
+                metadata_filepath = metadata_filepath,
+                database_filepath = database_filepath,
+                csv_file_names = 'n.csv',
+                sql_without_rowid = True
+                ),
+            {'n': 2}
+            )
+        with self.assertRaises(Exception):
+            csvw_functions_extra.import_table_group_to_sqlite(
+                metadata_filepath = metadata_filepath,
+                database_filepath = database_filepath,
+                csv_file_names = 'm.csv'
+                )
+        
+        # a value which does not match the column datatype is an error
+        with self.assertRaises(sqlite3.IntegrityError):
+            csvw_functions_extra.import_table_group_to_sqlite(
+                metadata_filepath = metadata_filepath,
+                database_filepath = database_filepath,
+                csv_file_names = 'h.csv',
+                sql_strict = True
+                )
+        
+        
+class TESTCsvwDatabase(LocalServerTestCase):
+    ""
+    
+    def test_csvw_database(self):
+        ""
+        fp_metadata = self._write_remote_csv_files(2)
+        metadata_filepath = \
+            csvw_functions_extra.download_table_group(
+                metadata_document_location = fp_metadata,
+                data_folder = self.data_folder
+                )
+        database_filepath = os.path.join(self.data_folder, 'data.sqlite')
+        
+        with csvw_functions_extra.CsvwDatabase(
+                database_filepath, 
+                pragmas = {'journal_mode': 'WAL'}
+                ) as db:
+            
+            conn = db.connection
+            
+            self.assertEqual(
+                db.import_table_group(metadata_filepath),
+                {'table0': 100, 'table1': 100}
+                )
+            self.assertEqual(
+                db.get_sql_table_names(metadata_filepath), 
+                ['table0', 'table1']
+                )
+            self.assertEqual(db.get_field_names('table0'), ['id', 'value'])
+            self.assertEqual(
+                db.get_rows('table1', filter_by={'id': 5}),
+                [{'id': 5, 'value': 'table1_row5'}]
+                )
+            self.assertEqual(
+                db.get_rows('table1', filter_by={'id': {'>': 97}}, fields='id'),
+                [{'id': 98}, {'id': 99}]
+                )
+            self.assertEqual(
+                db.get_rows('table1', filter_by={'value': '"a\'b"'}),
+                []
+                )
+            self.assertEqual(
+                db.get_row_count('table1', filter_by={'value': {'LIKE': 'table1_row9%'}}),
+                [{'COUNT': 11}]
+                )
+            
+            # streaming
+            rows = db.iter_rows('table0', filter_by={'id': {'<': 3}}, batch_size=2)
+            self.assertEqual(
+                list(rows),
+                [{'id': 0, 'value': 'table0_row0'}, {'id': 1, 'value': 'table0_row1'}, {'id': 2, 'value': 'table0_row2'}]
+                )
+            rows = list(db.iter_sql('SELECT id, value FROM table1', batch_size=7, row_format='namedtuple'))
+            self.assertEqual(len(rows), 100)
+            self.assertEqual((rows[99].id, rows[99].value), (99, 'table1_row99'))
+            self.assertEqual(
+                next(csvw_functions_extra.iter_sql('SELECT COUNT(*) FROM table1', db, row_format='tuple')),
+                (100,)
+                )
+            
+            # columnar results
+            columns = db.get_rows('table0', filter_by={'id': [1, 2]}, result_format='columns')
+            self.assertEqual(list(columns), ['id', 'value'])
+            self.assertEqual(columns['id'].typecode, 'q')
+            self.assertEqual(list(columns['id']), [1, 2])
+            self.assertEqual(columns['value'], ['table0_row1', 'table0_row2'])
+            columns = db.run_sql(
+                'SELECT id, id / 2.0 AS half, NULLIF(id, 1) AS x FROM table0 WHERE id < 3', 
+                result_format='columns'
+                )
+            self.assertEqual(columns['half'].tolist(), [0.0, 0.5, 1.0])
+            self.assertEqual(columns['x'], [0, None, 2])
+            if not numpy is None:
+                columns = csvw_functions_extra.run_sql('SELECT id FROM table0', db, result_format='numpy')
+                self.assertEqual(columns['id'].dtype, numpy.int64)
+                self.assertEqual(int(columns['id'].sum()), 4950)
+            
+            # long filter lists use a temporary table
+            with unittest.mock.patch(
+                    'csvw_functions_extra.csvw_functions_extra._FILTER_TEMP_TABLE_THRESHOLD', 
+                    5
+                    ):
+                ids = [3, 1, 2, 4, 5, 6, 200, None]
+                self.assertEqual(
+                    db.get_rows('table0', filter_by={'id': ids, 'value': {'!=': 'table0_row2'}}, fields='id'),
+                    [{'id': 1}, {'id': 3}, {'id': 4}, {'id': 5}, {'id': 6}]
+                    )
+                self.assertEqual(
+                    db.get_row_count('table0', filter_by={'id': ids}),
+                    [{'COUNT': 6}]
+                    )
+                self.assertEqual(
+                    len(list(db.iter_rows('table0', filter_by={'id': ids}, batch_size=2))), 
+                    6
+                    )
+                self.assertEqual(db.run_sql('SELECT * FROM temp.sqlite_master'), [])
+            
+            # the database functions accept a CsvwDatabase and leave it open
+            self.assertEqual(
+                csvw_functions_extra.get_row_count('table0', db),
+                [{'COUNT': 100}]
+                )
+            
+            # one connection is used throughout, with the import pragmas restored
+            self.assertIs(db.connection, conn)
+            self.assertEqual(db.run_sql('PRAGMA journal_mode'), [{'journal_mode': 'wal'}])
+            self.assertEqual(db.run_sql('PRAGMA synchronous'), [{'synchronous': 2}])
+            
+        self.assertIsNone(db._connection)
+        
+        
+    def test_csvw_database_long_filter_lists(self):
+        ""
+        os.makedirs(self.data_folder)
+        database_filepath = os.path.join(self.data_folder, 'data.sqlite')
+        
+        with csvw_functions_extra.CsvwDatabase(database_filepath) as db:
+            
+            db.execute('CREATE TABLE t (s TEXT, n INTEGER, x)')
+            db.connection.executemany(
+                'INSERT INTO t VALUES (?,?,?)',
+                [(str(i), i, i) for i in range(10)] + [('a', 'a', 'a')]
+                )
+            
+            # the same rows are returned with and without a temporary table
+            for filter_by in [
+                    {'s': list(range(8))},
+                    {'s': [1, '2', 3.0, 'a', None, 4, 5, 6]},
+                    {'n': ['1', '2', 3.0, 'a', 4, 5, 6, 7]},
+                    {'x': [1, '2', 3, 'a', 4, 5, 6, 7]},
+                    ]:
+                expected = db.get_rows('t', filter_by=filter_by)
+                self.assertTrue(len(expected) > 5)
+                with unittest.mock.patch(
+                        'csvw_functions_extra.csvw_functions_extra._FILTER_TEMP_TABLE_THRESHOLD', 
+                        5
+                        ):
+                    self.assertEqual(
+                        sorted(map(str, db.get_rows('t', filter_by=filter_by))),
+                        sorted(map(str, expected))
+                        )
+                    
+                    # temporary tables are only created once iteration starts
+                    rows = db.iter_rows('t', filter_by=filter_by)
+                    self.assertEqual(db.run_sql('SELECT * FROM temp.sqlite_master'), [])
+                    self.assertEqual(len(list(rows)), len(expected))
+                    self.assertEqual(db.run_sql('SELECT * FROM temp.sqlite_master'), [])
+        
+        
+    def test_csvw_database_result_cache(self):
+        ""
+        fp_metadata = self._write_remote_csv_files(1)
+        metadata_filepath = \
+            csvw_functions_extra.download_table_group(
+                metadata_document_location = fp_metadata,
+                data_folder = self.data_folder
+                )
+        database_filepath = os.path.join(self.data_folder, 'data.sqlite')
+        csvw_functions_extra.import_table_group_to_sqlite(
+            metadata_filepath = metadata_filepath,
+            database_filepath = database_filepath
+            )
+        
+        with csvw_functions_extra.CsvwDatabase(
+                database_filepath, 
+                result_cache_size = 2
+                ) as db:
+            
+            for _ in range(3):
+                rows = db.get_rows('table0', filter_by={'id': 1})
+                self.assertEqual(rows, [{'id': 1, 'value': 'table0_row1'}])
+                rows[0]['value'] = None  # the cached result is not changed
+            self.assertEqual(
+                db.get_result_cache_info(),
+                {'hits': 2, 'misses': 1, 'entries': 1, 'bytes': db.get_result_cache_info()['bytes']}
+                )
+            
+            # least recently used results are removed
+            db.get_rows('table0', filter_by={'id': 2})
+            db.get_row_count('table0')
+            self.assertEqual(db.get_result_cache_info()['entries'], 2)
+            db.get_rows('table0', filter_by={'id': 1})
+            self.assertEqual(db.get_result_cache_info()['misses'], 4)
+            
+            # queries with long filter lists (which use temporary tables) 
+            # do not empty the cache
+            with unittest.mock.patch(
+                    'csvw_functions_extra.csvw_functions_extra._FILTER_TEMP_TABLE_THRESHOLD', 
+                    5
+                    ):
+                self.assertEqual(
+                    len(db.get_rows('table0', filter_by={'id': list(range(10))})), 
+                    10
+                    )
+            info = db.get_result_cache_info()
+            db.get_rows('table0', filter_by={'id': 1})
+            self.assertEqual(db.get_result_cache_info()['hits'], info['hits'] + 1)
+            self.assertEqual(db.get_result_cache_info()['entries'], 2)
+            
+            # queries which differ only in whitespace inside quotes are not the same
+            self.assertEqual(db._fetch_all("SELECT 'a  b' AS x", []), [{'x': 'a  b'}])
+            self.assertEqual(db._fetch_all("SELECT 'a b' AS x", []), [{'x': 'a b'}])
+            
+            # changes by another connection empty the cache
+            with sqlite3.connect(database_filepath) as conn:
+                conn.execute("UPDATE table0 SET value = 'x' WHERE id = 1")
+            conn.close()
+            self.assertEqual(
+                db.get_rows('table0', filter_by={'id': 1}), 
+                [{'id': 1, 'value': 'x'}]
+                )
+            
+            # changes by this connection empty the cache
+            db.execute('DELETE FROM table0 WHERE id = 1')
+            self.assertEqual(db.get_rows('table0', filter_by={'id': 1}), [])
+            self.assertEqual(db.get_row_count('table0'), [{'COUNT': 99}])
+            
+        # results larger than result_cache_max_bytes are not cached
+        with csvw_functions_extra.CsvwDatabase(
+                database_filepath, 
+                result_cache_size = 10,
+                result_cache_max_bytes = 1000
+                ) as db:
+            db.get_rows('table0')
+            db.get_row_count('table0')
+            self.assertEqual(db.get_result_cache_info()['entries'], 1)
+        
+        
+class TESTReplaceCodes(LocalServerTestCase):
+    ""
+    
+    def test_get_rows_replace_codes(self):
+        ""
+        with open(os.path.join(self.remote_folder, 'p.csv'), 'w') as f:
+            f.write('id,region,flag,status\n1,E1,true,1\n2,W1,false,2\n3,X9,,\n')
+        fp_metadata = os.path.join(self._tempdir.name, 'tables-metadata.json')
+        write_table_group_metadata(
+            fp_metadata, 
+            [
+                {
+                    'csv_file_name': 'p.csv',
+                    'csv_download_url': f'{self.base_url}/p.csv',
+                    'sql_table_name': 'p'
+                    }
+                ],
+            columns = [
+                {'name': 'id', 'datatype': 'integer'},
+                {
+                    'name': 'region', 
+                    'datatype': 'string',
+                    'https://purl.org/berg/csvw_functions_extra/vocab/codes': {
+                        'E1': 'England', 
+                        'W1': 'Wales'
+                        }
+                    },
+                {
+                    'name': 'flag', 
+                    'datatype': 'boolean',
+                    'https://purl.org/berg/csvw_functions_extra/vocab/codes': {
+                        'true': 'yes', 
+                        'false': 'no'
+                        }
+                    },
+                {
+                    'name': 'status', 
+                    'datatype': 'long',
+                    'https://purl.org/berg/csvw_functions_extra/vocab/codes': {
+                        '1': 'active', 
+                        '2': 'closed'
+                        }
+                    }
+                ]
+            )
+        metadata_filepath = \
+            csvw_functions_extra.download_table_group(
+                metadata_document_location = fp_metadata,
+                data_folder = self.data_folder
+                )
+        database_filepath = os.path.join(self.data_folder, 'data.sqlite')
+        csvw_functions_extra.import_table_group_to_sqlite(
+            metadata_filepath = metadata_filepath,
+            database_filepath = database_filepath
+            )
+        
+        self.assertEqual(
+            csvw_functions_extra.run_sql(
+                'SELECT * FROM p__codes__status', 
+                database_filepath
+                ),
+            [{'code': 1, 'label': 'active'}, {'code': 2, 'label': 'closed'}]
+            )
+        
+        # codes are replaced, and unknown codes and NULLs are unchanged
+        self.assertEqual(
+            csvw_functions_extra.get_rows(
+                'p', 
+                database_filepath, 
+                replace_codes = True
+                ),
+            [
+                {'id': 1, 'region': 'England', 'flag': 'yes', 'status': 'active'},
+                {'id': 2, 'region': 'Wales', 'flag': 'no', 'status': 'closed'},
+                {'id': 3, 'region': 'X9', 'flag': None, 'status': None}
+                ]
+            )
+        
+        # filters apply to the codes
+        self.assertEqual(
+            list(csvw_functions_extra.iter_rows(
+                'p', 
+                database_filepath, 
+                filter_by = {'region': 'W1'},
+                fields = ['region', 'id'],
+                replace_codes = True
+                )),
+            [{'region': 'Wales', 'id': 2}]
+            )
+        
+        # re-importing the table replaces its lookup tables
+        csvw_functions_extra.import_table_group_to_sqlite(
+            metadata_filepath = metadata_filepath,
+            database_filepath = database_filepath,
+            overwrite_existing_tables = True
+            )
+        self.assertEqual(
+            csvw_functions_extra.get_all_table_names_in_database(database_filepath),
+            ['_csvw_functions_extra_import_log', 'p', 'p__codes__region', 'p__codes__flag', 'p__codes__status']
+            )
+        
+        # tables imported without lookup tables use the metadata codes, 
+        # without writing to the database
+        with sqlite3.connect(database_filepath) as conn:
+            for x in ['region', 'flag', 'status']:
+                conn.execute(f'DROP TABLE p__codes__{x}')
+        conn.close()
+        with csvw_functions_extra.CsvwDatabase(database_filepath) as db:
+            schema_version = db.execute('PRAGMA schema_version').fetchone()[0]
+            self.assertEqual(
+                db.get_rows(
+                    'p', 
+                    filter_by = {'id': [1, 3]},
+                    replace_codes = True,
+                    metadata_filename = metadata_filepath
+                    ),
+                [
+                    {'id': 1, 'region': 'England', 'flag': 'yes', 'status': 'active'},
+                    {'id': 3, 'region': 'X9', 'flag': None, 'status': None}
+                    ]
+                )
+            self.assertEqual(
+                db.execute('PRAGMA schema_version').fetchone()[0],
+                schema_version
+                )
+        self.assertEqual(
+            csvw_functions_extra.get_all_table_names_in_database(database_filepath),
+            ['_csvw_functions_extra_import_log', 'p']
+            )
+        
+        
+@unittest.skipIf(numpy is None, 'numpy is not installed')
+class TESTColumnarTables(LocalServerTestCase):
+    ""
+    
+    def test_columnar_tables(self):
+        ""
+        with open(os.path.join(self.remote_folder, 'c.csv'), 'w') as f:
+            f.write('id,amount,label\n1,1.5,a\n2,,b\n3,4,\n4,2.5,a\n')
+        fp_metadata = os.path.join(self._tempdir.name, 'tables-metadata.json')
+        write_table_group_metadata(
+            fp_metadata, 
+            [
+                {
+                    'csv_file_name': 'c.csv',
+                    'csv_download_url': f'{self.base_url}/c.csv',
+                    'sql_table_name': 'c'
+                    }
+                ],
+            columns = [
+                {'name': 'id', 'datatype': 'integer'},
+                {'name': 'amount', 'datatype': 'decimal'},
+                {'name': 'label', 'datatype': 'string'}
+                ]
+            )
+        metadata_filepath = \
+            csvw_functions_extra.download_table_group(
+                metadata_document_location = fp_metadata,
+                data_folder = self.data_folder
+                )
+        database_filepath = os.path.join(self.data_folder, 'data.sqlite')
+        csvw_functions_extra.import_table_group_to_sqlite(
+            metadata_filepath = metadata_filepath,
+            database_filepath = database_filepath
+            )
+        
+        columns = csvw_functions_extra.load_columnar_table('c', database_filepath)
+        table_folder = database_filepath + '-columnar/c'
+        self.assertTrue(os.path.isdir(table_folder))
+        
+        self.assertIsInstance(columns['id'], numpy.memmap)
+        self.assertEqual(columns['id'].dtype, numpy.int64)
+        self.assertEqual(columns['id'].tolist(), [1, 2, 3, 4])
+        self.assertEqual(float(numpy.nansum(columns['amount'])), 8.0)
+        self.assertTrue(numpy.isnan(columns['amount'][1]))
+        self.assertEqual(columns['label'].categories, ['a', 'b'])
+        self.assertEqual(columns['label'].codes.tolist(), [0, 1, -1, 0])
+        self.assertEqual(columns['label'].decode().tolist(), ['a', 'b', None, 'a'])
+        
+        # re-importing the table removes the columnar cache
+        with open(os.path.join(self.data_folder, 'c.csv'), 'a') as f:
+            f.write('5,1,c\n')
+        del columns
+        csvw_functions_extra.import_table_group_to_sqlite(
+            metadata_filepath = metadata_filepath,
+            database_filepath = database_filepath,
+            overwrite_existing_tables = True
+            )
+        self.assertFalse(os.path.exists(table_folder))
+        with self.assertRaises(Exception):
+            csvw_functions_extra.load_columnar_table(
+                'c', 
+                database_filepath, 
+                export_if_required = False
+                )
+        
+        columns = csvw_functions_extra.load_columnar_table(
+            'c', 
+            database_filepath, 
+            columns = ['id']
+            )
+        self.assertEqual(list(columns), ['id'])
+        self.assertEqual(columns['id'].tolist(), [1, 2, 3, 4, 5])
+        
+        
 class EXTRA(unittest.TestCase):
     ""
         
@@ -250,6 +1902,50 @@ class TESTUtilityFunctions(unittest.TestCase):
             )
         
         
+    def test_get_where_clause(self):
+        ""
+        # None
+        self.assertEqual(
+            csvw_functions_extra.get_where_clause(None),
+            ('', ())
+            )
+        
+        # single values and lists
+        self.assertEqual(
+            csvw_functions_extra.get_where_clause(
+                {
+                    'field1': 1,
+                    'field2': 'a"b',
+                    'field3': [1,2]
+                    }
+                ),
+            (
+                ' WHERE ("field1" = ?) AND ("field2" = ?) AND ("field3" IN (?,?))',
+                (1, 'a"b', 1, 2)
+                )
+            )
+        
+        # operators
+        self.assertEqual(
+            csvw_functions_extra.get_where_clause(
+                {
+                    'field1': {'BETWEEN': [1,2]},
+                    'field2': {'>=': 1, '<': 5},
+                    'field3': {'like': 'a%'},
+                    'field4': {'IS NULL': False}
+                    }
+                ),
+            (
+                ' WHERE ("field1" BETWEEN ? AND ?) AND ("field2" >= ?) AND ("field2" < ?)'
+                ' AND ("field3" LIKE ?) AND ("field4" IS NOT NULL)',
+                (1, 2, 1, 5, 'a%')
+                )
+            )
+        
+        with self.assertRaises(Exception):
+            csvw_functions_extra.get_where_clause({'field1': {'IN SET': 1}})
+        
+        
         
 if __name__=="__main__":
     